@@ -0,0 +1,132 @@
+# auth_server_flask/allowlist.py
+
+"""
+許可ユーザーリスト (ALLOWED_USERS_LIST) の判定エンジン。
+
+ルールの書式 (カンマ区切り、または1行1ルール。'#' 以降はコメント):
+    user@example.com       … メールアドレスの完全一致で許可
+    @example.com           … example.com ドメインの全アドレスを許可
+    @*.example.com         … example.com のサブドメイン (dev.example.com など) の全アドレスを許可
+    !user@example.com      … 拒否 (許可ルールより優先)。ドメインルールにも '!' を付けられます。
+
+判定はすべて小文字化したうえでハッシュ検索で行うため、エントリ数に関係なく
+メールアドレスのドメインのラベル数に比例するコストで済みます。
+"""
+
+import observability
+
+logger = observability.get_logger(__name__)
+
+DENY_PREFIX = "!"
+SUBDOMAIN_PREFIX = "*."
+
+def normalize_email(email):
+    """比較用にメールアドレスを正規化します (前後の空白除去・小文字化)。"""
+    return email.strip().lower() if email else ""
+
+class _RuleSet:
+    __slots__ = ("emails", "domains", "subdomain_suffixes")
+
+    def __init__(self, emails, domains, subdomain_suffixes):
+        self.emails = emails
+        self.domains = domains
+        self.subdomain_suffixes = subdomain_suffixes
+
+    def __eq__(self, other):
+        return (isinstance(other, _RuleSet) and self.emails == other.emails
+                and self.domains == other.domains and self.subdomain_suffixes == other.subdomain_suffixes)
+
+    def __len__(self):
+        return len(self.emails) + len(self.domains) + len(self.subdomain_suffixes)
+
+    def matches(self, email, domain):
+        if email in self.emails or domain in self.domains:
+            return True
+        if self.subdomain_suffixes:
+            # dev.eu.example.com -> eu.example.com, example.com, com の順に親ドメインを検索
+            dot = domain.find(".")
+            while dot != -1:
+                if domain[dot + 1:] in self.subdomain_suffixes:
+                    return True
+                dot = domain.find(".", dot + 1)
+        return False
+
+class AllowList:
+    """
+    不変の許可/拒否ルール集合。構築後は変更せず、再読み込み時は新しいインスタンスに差し替えます。
+    """
+
+    __slots__ = ("_allow", "_deny")
+
+    def __init__(self, allow, deny):
+        self._allow = allow
+        self._deny = deny
+
+    @classmethod
+    def from_rules(cls, rules):
+        """
+        ルールのイテラブルから AllowList を構築します。
+        各要素はカンマ区切りの複数ルールを含んでいても構いません (大きなファイルも1行ずつ処理できます)。
+        """
+        sets = {
+            False: (set(), set(), set()),
+            True: (set(), set(), set()),
+        }
+        for line in rules:
+            line = line.split("#", 1)[0]
+            for raw_rule in line.split(","):
+                rule = raw_rule.strip().lower()
+                if not rule:
+                    continue
+                deny = rule.startswith(DENY_PREFIX)
+                if deny:
+                    rule = rule[len(DENY_PREFIX):].strip()
+                emails, domains, subdomain_suffixes = sets[deny]
+                if rule.startswith("@"):
+                    domain = rule[1:]
+                    if domain.startswith(SUBDOMAIN_PREFIX):
+                        subdomain_suffixes.add(domain[len(SUBDOMAIN_PREFIX):])
+                    elif domain:
+                        domains.add(domain)
+                elif "@" in rule:
+                    emails.add(rule)
+                else:
+                    logger.warning("解釈できないルールを無視します: '%s'", raw_rule.strip())
+        allow, deny = (
+            _RuleSet(frozenset(e), frozenset(d), frozenset(s)) for e, d, s in (sets[False], sets[True])
+        )
+        return cls(allow, deny)
+
+    @classmethod
+    def from_string(cls, rules_str):
+        """カンマ区切り・改行区切りの文字列 (Secret Manager の値など) から構築します。"""
+        return cls.from_rules(rules_str.splitlines() if rules_str else [])
+
+    @classmethod
+    def from_file(cls, path, encoding="utf-8"):
+        """ファイルを1行ずつ読み込みながら構築します (全体をメモリに読み込みません)。"""
+        with open(path, "r", encoding=encoding) as f:
+            return cls.from_rules(f)
+
+    def is_allowed(self, email):
+        """メールアドレスが許可されているかを判定します。拒否ルールは許可ルールより優先されます。"""
+        email = normalize_email(email)
+        at = email.rfind("@")
+        if at <= 0:
+            return False
+        domain = email[at + 1:]
+        if self._deny.matches(email, domain):
+            return False
+        return self._allow.matches(email, domain)
+
+    __contains__ = is_allowed
+
+    def __eq__(self, other):
+        return isinstance(other, AllowList) and self._allow == other._allow and self._deny == other._deny
+
+    def __len__(self):
+        return len(self._allow) + len(self._deny)
+
+    def __repr__(self):
+        return (f"AllowList(emails={len(self._allow.emails)}, domains={len(self._allow.domains)}, "
+                f"subdomains={len(self._allow.subdomain_suffixes)}, deny={len(self._deny)})")
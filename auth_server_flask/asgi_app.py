@@ -0,0 +1,375 @@
+# auth_server_flask/asgi_app.py
+
+"""
+認証サーバーの ASGI モード (uvicorn などの ASGI サーバーで起動します)。
+
+- /auth/login, /auth/callback (旧パス /auth_login, /auth_callback を含む) と /auth/introspect, /auth/introspect:batch は
+  非同期ハンドラで処理します。Google とのトークン交換は httpx.AsyncClient で行い、待っている間も他のリクエストを処理します。
+- 判定ロジック (state の検証、許可ユーザー、トークン発行、イントロスペクション) は auth_routes / introspection と共通で、
+  応答も Flask 版と同じです。
+- テナント (tenants.py) のパス /t/<テナントID>/... とホスト名も Flask 版と同じく扱います。
+- それ以外のルートは Flask アプリ (main.app) に WSGI アダプタ (asgiref) 経由で渡します。
+- Google の証明書と設定 (Secret Manager) の再取得は、イベントループ上のバックグラウンドタスクで行います。
+
+    python asgi_app.py --mode local_direct [--port 8080]
+    uvicorn asgi_app:app --port 8080     (モードは ENV 環境変数)
+"""
+
+import asyncio
+import html
+import json
+import os
+from urllib.parse import parse_qsl
+
+# 設定の読み込みは lifespan の startup で行うため、インポート時のウォームアップスレッドは使わない
+os.environ.setdefault("CONFIG_INIT_MODE", "lazy")
+if __name__ == '__main__':
+    # 設定のスナップショットは config のインポート時にモードを確認してから適用するため、--mode を先に ENV_ARG で渡す
+    import argparse
+    _mode_parser = argparse.ArgumentParser(add_help=False)
+    _mode_parser.add_argument("--mode", default=os.environ.get("ENV_ARG", os.environ.get("ENV", "local_direct")))
+    os.environ["ENV_ARG"] = _mode_parser.parse_known_args()[0].mode.lower()
+
+import jwt
+
+import config
+import auth_routes
+import google_certs
+import google_oauth
+import introspection
+import observability
+import ratelimit
+import revocation
+import tenants
+from main import app as flask_app
+
+logger = observability.get_logger(__name__)
+
+CERTS_REFRESH_RETRY_SECONDS = 30
+
+class AuthASGIApp:
+    """非同期ハンドラを持つルート以外は Flask アプリに委譲する ASGI アプリケーション。"""
+
+    def __init__(self, wsgi_app, mode=None):
+        self.mode = mode
+        self._wsgi_app = wsgi_app
+        self._wsgi_adapter = None
+        self._routes = {
+            ("GET", "/auth/login"): self.login,
+            ("GET", "/auth_login"): self.login,
+            ("GET", "/auth/callback"): self.callback,
+            ("GET", "/auth_callback"): self.callback,
+            ("POST", "/auth/introspect"): self.introspect,
+            ("POST", "/auth/introspect:batch"): self.introspect_batch,
+        }
+        self._certs_lock = None
+        self._background_tasks = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http":
+            tenant_id, path = tenants.split_tenant_path(scope["path"])
+            handler = self._routes.get((scope["method"], path)) if tenant_id != "" else None
+            if handler is not None:
+                if tenant_id is not None:
+                    scope = dict(scope, **{"auth.tenant_id": tenant_id})
+                try:
+                    return await handler(scope, receive, send)
+                except tenants.UnknownTenantError:
+                    return await _send_text(send, 404, "Unknown tenant.")
+        return await self._wsgi_fallback(scope, receive, send)
+
+    # --- ルート ---
+    async def login(self, scope, receive, send):
+        cfg = await self._config(scope)
+        if await self._reject_rate_limited(cfg, scope, send):
+            return
+        if cfg is None or not all([cfg.google_client_id, cfg.google_client_secret, cfg.redirect_uri,
+                                   auth_routes.SCOPES]):
+            logger.error("/auth/login: OAuth クライアントの設定が不完全です。")
+            return await _send_text(send, 500, "Server configuration error: OAuth client is not configured.")
+        authorization_url = auth_routes.login_redirect_url(cfg, _query(scope).get("return_to"))
+        logger.debug("/auth/login: Redirecting to Google authorization endpoint.")
+        await _send_redirect(send, authorization_url)
+
+    async def callback(self, scope, receive, send):
+        cfg = await self._config(scope)
+        if await self._reject_rate_limited(cfg, scope, send):
+            return
+        if cfg is None or not cfg.is_complete():
+            return await _send_text(send, 500, "Server configuration error: Essential configurations missing.")
+        try:
+            return_to, code = auth_routes.parse_callback_request(cfg, _query(scope))
+            oauth_client = google_oauth.get_oauth_client(cfg)
+            try:
+                token_response = await oauth_client.exchange_code_async(code)
+                id_info = await self._verify_id_token(token_response["id_token"], oauth_client.client_id)
+            except Exception as e:
+                raise auth_routes.token_verification_failed(return_to, e)
+        except auth_routes.CallbackRejected as e:
+            if e.redirect_url:
+                return await _send_redirect(send, e.redirect_url)
+            return await _send_text(send, e.status, e.message)
+
+        # JWT の署名とリフレッシュトークンのストア (SQLite など) への書き込みはブロッキングのため、スレッドで行う
+        location, issued = await asyncio.to_thread(auth_routes.complete_login, cfg, id_info, return_to)
+        await _send_redirect(send, location, no_store=issued)
+
+    async def introspect(self, scope, receive, send):
+        cfg = await self._config(scope)
+        if await self._reject_unauthorized_service(cfg, scope, send):
+            return
+        body = await _read_body(receive)
+        form = dict(parse_qsl(body.decode("utf-8", "replace"))) if _is_form(scope) else {}
+        token = form.get("token")
+        if not token:
+            return await _send_json(send, 400, {"error": "invalid_request", "error_description": "token is required"})
+        # 署名の検証は CPU 処理のため、イベントループを止めないようにスレッドで行う (introspect_batch と同じ)
+        result, max_age = await asyncio.to_thread(
+            introspection.get_introspector().introspect,
+            token, cfg, revocation.get_revocation_service().is_revoked,
+        )
+        await _send_json(send, 200, result, cache_control=f"private, max-age={max_age}")
+
+    async def introspect_batch(self, scope, receive, send):
+        cfg = await self._config(scope)
+        if await self._reject_unauthorized_service(cfg, scope, send):
+            return
+        body = await _read_body(receive)
+        try:
+            payload = json.loads(body) if _header(scope, "content-type").startswith("application/json") else {}
+        except ValueError:
+            payload = {}
+        tokens = payload.get("tokens") if isinstance(payload, dict) else None
+        if not isinstance(tokens, list) or not tokens:
+            return await _send_json(send, 400, {"error": "invalid_request",
+                                                "error_description": "tokens must be a non-empty list"})
+        if len(tokens) > auth_routes.INTROSPECT_BATCH_MAX_TOKENS:
+            return await _send_json(send, 400, {
+                "error": "invalid_request",
+                "error_description": f"at most {auth_routes.INTROSPECT_BATCH_MAX_TOKENS} tokens per batch",
+            })
+        # 署名の検証は CPU 処理のため、イベントループを止めないようにスレッドで行う
+        results, max_age = await asyncio.to_thread(
+            introspection.get_introspector().introspect_many,
+            tokens, cfg, revocation.get_revocation_service().is_revoked,
+        )
+        await _send_json(send, 200, {"results": results}, cache_control=f"private, max-age={max_age}")
+
+    async def _reject_rate_limited(self, cfg, scope, send):
+        """レート制限を超えた場合は 429 を送信して True を返します (auth_routes と同じ応答)。"""
+        remote_addr = (scope.get("client") or (None,))[0]
+        args = (cfg, remote_addr, _header(scope, "x-forwarded-for"))
+        if ratelimit.has_shared_backend():
+            # 共有のバックエンド (SQLite) はロックを待つことがあるため、イベントループを止めないようにスレッドで確認する
+            retry_after = await asyncio.to_thread(auth_routes.rate_limit_retry_after, *args)
+        else:
+            retry_after = auth_routes.rate_limit_retry_after(*args) # プロセス内の確認はロックを待たない
+        if retry_after is None:
+            return False
+        await _send_text(send, 429, auth_routes.RATE_LIMITED_MESSAGE,
+                         extra_headers=[(b"retry-after", retry_after.encode("latin-1"))])
+        return True
+
+    async def _reject_unauthorized_service(self, cfg, scope, send):
+        """サービス間APIの認証に失敗した場合はエラー応答を送信して True を返します (auth_routes と同じ応答)。"""
+        if cfg is None or not cfg.service_api_key:
+            await _send_json(send, 404, {"error": "not_found"})
+            return True
+        if not auth_routes.is_authorized_service(cfg, _header(scope, "authorization")):
+            await _send_json(send, 401, {"error": "unauthorized"},
+                             extra_headers=[(b"www-authenticate", b'Bearer realm="auth"')])
+            return True
+        return False
+
+    async def _wsgi_fallback(self, scope, receive, send):
+        if self._wsgi_adapter is None:
+            try:
+                from asgiref.wsgi import WsgiToAsgi
+            except ImportError:
+                raise RuntimeError("asgiref ライブラリが見つかりません。pip install asgiref を実行してください。")
+            self._wsgi_adapter = WsgiToAsgi(self._wsgi_app)
+        await self._wsgi_adapter(scope, receive, send)
+
+    # --- 設定・証明書 ---
+    async def _config(self, scope=None):
+        """
+        このリクエストの設定スナップショット (テナントの指定があればテナントの設定) を返します。
+
+        Raises:
+            tenants.UnknownTenantError: 指定されたテナントが存在しない場合。
+        """
+        cfg = config.get_config()
+        if cfg is None:
+            try:
+                cfg = await asyncio.to_thread(config.initialize_app_configs, self.mode)
+            except Exception as e:
+                logger.critical("Failed to initialize configs: %s", e)
+                return None
+        if scope is None:
+            return cfg
+        tenant_id = scope.get("auth.tenant_id") or tenants.tenant_id_from_host(_header(scope, "host"))
+        if tenant_id is None or cfg is None:
+            return cfg
+        registry = tenants.get_tenant_registry(cfg.env_type)
+        if registry.is_cached(tenant_id, cfg):
+            return registry.get_config(tenant_id, cfg)
+        # 定義の取得 (Secret Manager) は同期 API のため、スレッドで実行する
+        return await asyncio.to_thread(registry.get_config, tenant_id, cfg)
+
+    async def _verify_id_token(self, id_token_str, client_id):
+        """証明書の取得が必要な場合はイベントループ上で取得してから、ID トークンを検証します。"""
+        cert_cache = google_certs.get_cert_cache()
+        kid = jwt.get_unverified_header(id_token_str).get("kid")
+        if not cert_cache.is_warm() or (not cert_cache.has_key(kid) and cert_cache.can_refetch_for_unknown_kid()):
+            try:
+                await self._refresh_certs(kid)
+            except Exception as e:
+                if cert_cache.cached_key(kid) is None:
+                    raise
+                # 取得に失敗しても、期限切れの鍵で検証を続ける (次のリクエストで再試行)
+                logger.warning("証明書の再取得に失敗したため、キャッシュ済みの鍵を使用します: %s", e)
+        key = cert_cache.cached_key(kid)
+        if key is None:
+            raise google_certs.UnknownKeyIdError(f"Unknown key id: {kid}")
+        return google_certs.decode_google_id_token(id_token_str, key, client_id)
+
+    async def _refresh_certs(self, kid=None, force=False):
+        """証明書を再取得します。同時に呼ばれた場合は1回の取得にまとめます。"""
+        cert_cache = google_certs.get_cert_cache()
+        if self._certs_lock is None: # lifespan に対応していないサーバーから呼ばれた場合
+            self._certs_lock = asyncio.Lock()
+        async with self._certs_lock:
+            if not force and cert_cache.is_warm() and (kid is None or cert_cache.has_key(kid)):
+                return # 待っている間に他のリクエストが取得済み
+            await cert_cache.refresh_async()
+
+    async def _certs_refresher(self):
+        """証明書の期限が近づいたら先行して再取得するバックグラウンドタスク。"""
+        cert_cache = google_certs.get_cert_cache()
+        while True:
+            await asyncio.sleep(max(1.0, cert_cache.seconds_until_refresh()))
+            if cert_cache.seconds_until_refresh() > 0:
+                continue
+            try:
+                await self._refresh_certs(force=True)
+            except Exception as e:
+                logger.warning("バックグラウンドでの証明書の更新に失敗しました: %s", e)
+                await asyncio.sleep(CERTS_REFRESH_RETRY_SECONDS)
+
+    async def _config_reloader(self, interval_seconds):
+        """設定 (Secret Manager のシークレット) を定期的に再読み込みするバックグラウンドタスク。"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            # Secret Manager のクライアントは同期 API のため、スレッドで実行する
+            await asyncio.to_thread(config.reload_configs)
+
+    # --- lifespan ---
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self._startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _startup(self):
+        self._certs_lock = asyncio.Lock()
+        # 失敗しても起動は続け、各リクエストで再試行する (Flask 版の auth_http と同じ)
+        cfg = await self._config()
+        if cfg is not None:
+            logger.info("Config ready (Mode: %s, version: %s).", cfg.env_type, cfg.version)
+        try:
+            await self._refresh_certs()
+        except Exception as e:
+            logger.warning("Google の証明書を事前に取得できませんでした: %s", e)
+        self._background_tasks.append(asyncio.create_task(self._certs_refresher()))
+        reload_interval = float(os.environ.get("CONFIG_RELOAD_INTERVAL_SECONDS", "0"))
+        if reload_interval > 0:
+            self._background_tasks.append(asyncio.create_task(self._config_reloader(reload_interval)))
+
+    async def _shutdown(self):
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+        await google_oauth.close_async_http_client()
+
+# --- ASGI の送受信ヘルパー (応答は Flask 版と同じ形式) ---
+def _query(scope):
+    return dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+
+def _header(scope, name):
+    name = name.encode("latin-1")
+    for key, value in scope.get("headers", ()):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+def _is_form(scope):
+    return _header(scope, "content-type").startswith("application/x-www-form-urlencoded")
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def _send(send, status, body, headers):
+    headers = list(headers) + [(b"content-length", str(len(body)).encode("latin-1"))]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def _send_text(send, status, text, extra_headers=()):
+    await _send(send, status, text.encode("utf-8"),
+                [(b"content-type", b"text/html; charset=utf-8")] + list(extra_headers))
+
+async def _send_json(send, status, body, cache_control=None, extra_headers=()):
+    # flask.jsonify と同じ形式 (キーをソート、区切り文字なし、末尾に改行)
+    data = (json.dumps(body, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+    headers = [(b"content-type", b"application/json")] + list(extra_headers)
+    if cache_control:
+        headers.append((b"cache-control", cache_control.encode("latin-1")))
+    await _send(send, status, data, headers)
+
+async def _send_redirect(send, location, no_store=False):
+    escaped = html.escape(location)
+    body = (
+        "<!doctype html>\n<html lang=en>\n<title>Redirecting...</title>\n<h1>Redirecting...</h1>\n"
+        f"<p>You should be redirected automatically to the target URL: <a href=\"{escaped}\">{escaped}</a>. "
+        "If not, click the link.\n"
+    ).encode("utf-8")
+    headers = [(b"content-type", b"text/html; charset=utf-8"), (b"location", location.encode("latin-1"))]
+    if no_store:
+        headers.append((b"cache-control", b"no-store"))
+    await _send(send, 302, body, headers)
+
+app = AuthASGIApp(flask_app, mode=os.environ.get("ENV_ARG") or None)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Flask OAuth Authentication Server (ASGI)")
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=['local_direct', 'local_sm_test', 'prod'],
+        default=os.environ.get("ENV_ARG", os.environ.get("ENV", "local_direct")).lower(),
+        help="動作モードを選択します。 (例: local_direct, local_sm_test)"
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn ライブラリが見つかりません。pip install uvicorn を実行してください。")
+    app.mode = args.mode
+    logger.info("Listen on http://%s:%s (ASGI, Mode: %s)", args.host, args.port, args.mode)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
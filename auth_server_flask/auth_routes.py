@@ -1,18 +1,221 @@
-from flask import Blueprint, redirect, request, make_response
+import hmac
+import os
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+from flask import Blueprint, redirect, request, make_response, g, jsonify
 # 必要な他のモジュールもインポート
 import config
 import auth_utils # もしルート内で直接使うなら
-from google.oauth2 import id_token
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request as GoogleAuthRequest
+import revocation
+import refresh_tokens
+import introspection
+import ratelimit
+import tenants
+import google_oauth # Google とのやり取り (google-auth 等の重いモジュールは使用時に遅延インポート)
+import observability
 # import jwt # auth_utils が担当
 
 # Blueprintオブジェクトを作成
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth') # url_prefix で /auth を共通化も可能
+# /.well-known/ 配下 (JWKS など) は url_prefix なし
+well_known_bp = Blueprint('well_known', __name__, url_prefix='/.well-known')
+
+logger = observability.get_logger(__name__)
+
+JWKS_MAX_AGE_SECONDS = int(os.environ.get("JWKS_MAX_AGE_SECONDS", "300"))
+
+# トークンのバッチ発行 (/auth/tokens:batch)
+BATCH_MINT_MAX_SUBJECTS = int(os.environ.get("BATCH_MINT_MAX_SUBJECTS", "1000"))
+BATCH_MINT_MAX_EXPIRES_HOURS = float(os.environ.get("BATCH_MINT_MAX_EXPIRES_HOURS", "24"))
+BATCH_MINT_PROCESSES = int(os.environ.get("BATCH_MINT_PROCESSES", "0")) # 2以上で非対称鍵の署名を並列化
+
+# トークンのイントロスペクション (/auth/introspect, /auth/introspect:batch)
+INTROSPECT_BATCH_MAX_TOKENS = int(os.environ.get("INTROSPECT_BATCH_MAX_TOKENS", "1000"))
+
+# アクセストークン (JWT) の有効期間。期限前に /auth/refresh で更新する
+ACCESS_TOKEN_EXPIRES_HOURS = float(os.environ.get("ACCESS_TOKEN_EXPIRES_HOURS", "1"))
+# /auth/refresh の grant_type ごとのトークンのパラメータ名 (ログインコードもリフレッシュトークンと同じストアで交換する)
+_REFRESH_GRANT_TOKEN_PARAMS = {"refresh_token": "refresh_token", "authorization_code": "code"}
 
 # 定数 (ここか、configから持ってくる)
-SCOPES = ['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile']
-STATE_COOKIE_NAME = "myappstate" # main.pyと共有
+SCOPES = google_oauth.SCOPES
+# stateはCookieではなく署名付きトークン (auth_utils.create_oauth_state_token) で検証する。
+# 使用済み nonce のプロセス内キャッシュ (0 で無効化)。マルチインスタンス構成でもトークンの有効期限で保護される。
+OAUTH_STATE_REPLAY_CACHE_SIZE = int(os.environ.get("OAUTH_STATE_REPLAY_CACHE_SIZE", "10000"))
+_state_replay_cache = (auth_utils.NonceReplayCache(OAUTH_STATE_REPLAY_CACHE_SIZE)
+                       if OAUTH_STATE_REPLAY_CACHE_SIZE > 0 else None)
+
+def get_request_config():
+    """
+    このリクエストで使用する設定スナップショットを返します。
+    1リクエスト内では最初に取得したスナップショットを使い続けるため、途中で再読み込みがあっても値が混ざりません。
+    テナント (パス /t/<テナントID>/... またはホスト名) の指定があれば、そのテナントの設定を返します。
+
+    Raises:
+        tenants.UnknownTenantError: 指定されたテナントが存在しない場合 (main.py で 404 にする)。
+    """
+    cfg = g.get("auth_config")
+    if cfg is None:
+        base = g.get("default_auth_config") or config.get_config()
+        cfg = tenants.resolve_config(base, g.get("tenant_id"), request.host)
+        g.auth_config = cfg
+    return cfg
+
+def _safe_return_to(cfg, return_to):
+    """
+    戻り先URLは Streamlit アプリ配下のみ許可する (オープンリダイレクト対策)。
+    スキーム・ホスト名・ポートが完全に一致し、パスがアプリのパス配下の場合のみ許可し、それ以外はアプリのURLを返す。
+    (文字列の前方一致では https://app.example.com.evil.net/ や https://app.example.com@evil.net/ を通してしまう)
+    """
+    app_url = cfg.streamlit_app_url
+    if not return_to:
+        return app_url
+    try:
+        target, app_parts = urlsplit(return_to), urlsplit(app_url)
+        same_origin = (target.scheme.lower() == app_parts.scheme.lower()
+                       and target.scheme.lower() in ("http", "https")
+                       and target.hostname is not None
+                       and target.hostname == app_parts.hostname
+                       and target.port == app_parts.port
+                       and target.username is None and target.password is None)
+    except ValueError: # 不正なポート番号など
+        return app_url
+    app_path = app_parts.path.rstrip("/")
+    if same_origin and (target.path == app_path or target.path.startswith(app_path + "/")):
+        return return_to
+    return app_url
+
+def _with_query_params(url, **params):
+    """URLにクエリパラメータを追加します (既存のパラメータは保持)。"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query.extend(params.items())
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def is_authorized_service(cfg, authorization_header):
+    """Authorization: Bearer <SERVICE_API_KEY> によるサービス間APIの認証。"""
+    if not cfg.service_api_key:
+        return False
+    scheme, _, credential = (authorization_header or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(credential.strip().encode(), cfg.service_api_key.encode())
+
+def _is_authorized_service(cfg):
+    return is_authorized_service(cfg, request.headers.get("Authorization"))
+
+def _service_auth_error(cfg):
+    """サービス間APIの認証エラー応答 (認証済みなら None)。"""
+    if cfg is None or not cfg.service_api_key:
+        return make_response(jsonify(error="not_found"), 404) # サービスAPIキー未設定時は無効
+    if not _is_authorized_service(cfg):
+        response = make_response(jsonify(error="unauthorized"), 401)
+        response.headers["WWW-Authenticate"] = 'Bearer realm="auth"'
+        return response
+    return None
+
+# --- ログインフローの共通処理 (Flask のルートと ASGI モード (asgi_app.py) の両方で使用) ---
+class CallbackRejected(Exception):
+    """
+    コールバックを続行できない場合の例外。
+    redirect_url があればそこへリダイレクトし、なければ status と message で応答します。
+    """
+
+    def __init__(self, status=400, message=None, redirect_url=None):
+        super().__init__(message or redirect_url)
+        self.status = status
+        self.message = message
+        self.redirect_url = redirect_url
+
+def rate_limit_retry_after(cfg, remote_addr, forwarded_for):
+    """
+    /auth/login, /auth/callback のレート制限 (クライアントIP ごと、OAuth クライアントごと)。
+    許可なら None、制限する場合は Retry-After ヘッダーの値を返します。
+    """
+    limiter = ratelimit.get_rate_limiter()
+    wait = limiter.retry_after(ratelimit.SCOPE_IP, ratelimit.client_ip(remote_addr, forwarded_for))
+    if not wait and cfg is not None:
+        wait = limiter.retry_after(ratelimit.SCOPE_CLIENT, cfg.google_client_id)
+    if not wait:
+        return None
+    logger.debug("Rate limited (retry after %.1f s)", wait)
+    return ratelimit.retry_after_header(wait)
+
+RATE_LIMITED_MESSAGE = "Too many requests. Please try again later."
+
+def _rate_limited_response(cfg):
+    retry_after = rate_limit_retry_after(cfg, request.remote_addr, request.headers.get("X-Forwarded-For"))
+    if retry_after is None:
+        return None
+    response = make_response(RATE_LIMITED_MESSAGE, 429)
+    response.headers["Retry-After"] = retry_after
+    return response
+
+def login_redirect_url(cfg, return_to):
+    """Google の認可エンドポイントへのURL (署名付き state を含む) を返します。"""
+    oauth_client = google_oauth.get_oauth_client(cfg) # 設定スナップショットごとに1回だけ構築
+
+    # stateはサーバー側にもCookieにも保存せず、署名付きトークンとして Google 経由で往復させる
+    return_to = _safe_return_to(cfg, return_to)
+    oauth_state_param = auth_utils.create_oauth_state_token(cfg.oauth_state_key, return_to=return_to)
+    return oauth_client.authorization_url(oauth_state_param)
+
+def parse_callback_request(cfg, args):
+    """
+    コールバックのクエリパラメータを検証し、(戻り先URL, 認可コード) を返します。
+
+    Raises:
+        CallbackRejected: state が不正、Google がエラーを返した、または認可コードがない場合。
+    """
+    # stateの検証 (署名・有効期限・再利用)
+    try:
+        state_payload = auth_utils.verify_oauth_state_token(
+            args.get("state"), cfg.oauth_state_key, replay_cache=_state_replay_cache
+        )
+    except auth_utils.OAuthStateError as e:
+        logger.warning("/auth/callback: Invalid state parameter: %s", e)
+        raise CallbackRejected(400, "Invalid state parameter.")
+    return_to = _safe_return_to(cfg, state_payload.get("r"))
+
+    if args.get("error"):
+        logger.warning("/auth/callback: Google returned error: %s", args.get("error"))
+        raise CallbackRejected(redirect_url=_with_query_params(return_to, auth_error=args.get("error")))
+    code = args.get("code")
+    if not code:
+        raise CallbackRejected(400, "Missing authorization code.")
+    return return_to, code
+
+def token_verification_failed(return_to, error):
+    """トークン交換・ID トークン検証の失敗を、エラー付きの戻り先URLへのリダイレクト (CallbackRejected) にします。"""
+    logger.error("/auth/callback: Token exchange or ID token verification failed: %s", error)
+    return CallbackRejected(redirect_url=_with_query_params(return_to, auth_error="token_verification_failed"))
+
+def complete_login(cfg, id_info, return_to):
+    """
+    検証済みの ID トークンのクレームからログインを完了します。
+    リダイレクト先にはアクセストークン (auth_token) と、リフレッシュトークンと交換する使い捨てのログインコード
+    (login_code) を付けます。長期間有効なリフレッシュトークン自体は URL (履歴・アクセスログ・Referer) に載せません。
+
+    Returns:
+        tuple: (リダイレクト先URL, トークンを発行したか)。許可されていないユーザーの場合はエラー付きのURL。
+    """
+    user_email = id_info.get("email")
+    with observability.timed(observability.PHASE_ALLOW_LIST):
+        allowed = bool(user_email) and id_info.get("email_verified", False) and cfg.allow_list.is_allowed(user_email)
+    if not allowed:
+        logger.warning("/auth/callback: Unauthorized user", extra={"user": user_email})
+        return _with_query_params(return_to, auth_error="unauthorized_user"), False
+
+    jwt_token = auth_utils.create_custom_jwt(
+        user_email,
+        id_info.get("name", user_email),
+        cfg.function_base_url,
+        cfg.streamlit_app_url,
+        cfg.key_ring,
+        expires_delta_hours=ACCESS_TOKEN_EXPIRES_HOURS,
+    )
+    service = refresh_tokens.get_refresh_token_service()
+    if service is None:
+        return _with_query_params(return_to, auth_token=jwt_token), True
+    login_code = service.issue_login_code(user_email, id_info.get("name", user_email), namespace=cfg.tenant_id)
+    return _with_query_params(return_to, auth_token=jwt_token, login_code=login_code), True
 
 # 元の main.py にあったルート関数をここに移動
 # @app.route('/') はBlueprintのurl_prefixを考慮して調整するか、別のBlueprintにするか、main.pyに残す
@@ -20,24 +223,236 @@ STATE_COOKIE_NAME = "myappstate" # main.pyと共有
 
 @auth_bp.route('/login') # url_prefix='/auth' なら、実際のパスは /auth/login
 def auth_login_route():
-    print("\n--- /auth/login accessed ---") # パスが変わる可能性に注意
-    if not all([config.GOOGLE_CLIENT_ID, config.GOOGLE_CLIENT_SECRET, config.REDIRECT_URI, SCOPES]):
-        # ... (エラー処理)
-        pass # 以下、元のロジックを移植
+    cfg = get_request_config() # このリクエストでは同じスナップショットだけを参照する
+    limited = _rate_limited_response(cfg)
+    if limited is not None:
+        return limited
+    if cfg is None or not all([cfg.google_client_id, cfg.google_client_secret, cfg.redirect_uri, SCOPES]):
+        logger.error("/auth/login: OAuth クライアントの設定が不完全です。")
+        return "Server configuration error: OAuth client is not configured.", 500
 
-    # ... (元の /auth_login のロジック)
-    # oauth_state_param = auth_utils.generate_oauth_state_parameter()
-    # ...
-    # response.set_cookie(STATE_COOKIE_NAME, oauth_state_param, ...)
-    return response # response を返す
+    authorization_url = login_redirect_url(cfg, request.args.get("return_to"))
+    logger.debug("/auth/login: Redirecting to Google authorization endpoint.")
+    return redirect(authorization_url)
 
 @auth_bp.route('/callback') # 実際のパスは /auth/callback
 def auth_callback_route():
-    print("\n--- /auth/callback accessed ---")
-    # ... (元の /auth_callback のロジック)
-    # jwt_token = auth_utils.create_custom_jwt(...)
-    # ...
-    return response_final # response_final を返す
+    cfg = get_request_config()
+    limited = _rate_limited_response(cfg)
+    if limited is not None:
+        return limited
+    if cfg is None or not cfg.is_complete():
+        return "Server configuration error: Essential configurations missing.", 500
+
+    try:
+        return_to, code = parse_callback_request(cfg, request.args)
+    except CallbackRejected as e:
+        return redirect(e.redirect_url) if e.redirect_url else make_response(e.message, e.status)
+
+    oauth_client = google_oauth.get_oauth_client(cfg)
+    try:
+        # トークン交換・ID トークン検証ともに共有の Keep-Alive セッションを使用
+        token_response = oauth_client.exchange_code(code)
+        id_info = oauth_client.verify_id_token(token_response["id_token"])
+    except Exception as e:
+        return redirect(token_verification_failed(return_to, e).redirect_url)
+
+    location, issued = complete_login(cfg, id_info, return_to)
+    response_final = redirect(location)
+    if issued:
+        response_final.headers["Cache-Control"] = "no-store"
+    return response_final
+
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh_route():
+    """
+    リフレッシュトークンを新しいアクセストークン (JWT) とリフレッシュトークンに交換します (RFC 6749 6章)。
+
+    Google とのやり取りは行わず、許可ユーザーリストの確認と署名だけで応答します。
+    リクエスト (フォーム): grant_type=refresh_token&refresh_token=...
+                           または grant_type=authorization_code&code=<ログイン時の login_code>
+    レスポンス (JSON): {"access_token", "token_type", "expires_in", "refresh_token"}
+    """
+    cfg = get_request_config()
+    if cfg is None or cfg.key_ring is None:
+        return make_response(jsonify(error="server_error"), 500)
+    token_param = _REFRESH_GRANT_TOKEN_PARAMS.get(request.form.get("grant_type", "refresh_token"))
+    service = refresh_tokens.get_refresh_token_service()
+    if token_param is None or service is None:
+        return make_response(jsonify(error="unsupported_grant_type"), 400)
+
+    try:
+        record, new_refresh_token = service.rotate(request.form.get(token_param), namespace=cfg.tenant_id)
+    except refresh_tokens.RefreshTokenError as e:
+        logger.debug("/auth/refresh: refresh rejected (%s)", e.reason)
+        return make_response(jsonify(error="invalid_grant", error_description=e.reason), 400)
+    with observability.timed(observability.PHASE_ALLOW_LIST):
+        allowed = cfg.allow_list.is_allowed(record.email)
+    if not allowed:
+        # 許可ユーザーリストから外されたユーザーのセッションはここで終了する
+        service.revoke(new_refresh_token, namespace=cfg.tenant_id)
+        logger.warning("/auth/refresh: Unauthorized user", extra={"user": record.email})
+        return make_response(jsonify(error="invalid_grant", error_description="unauthorized_user"), 400)
+
+    access_token = auth_utils.create_custom_jwt(
+        record.email, record.name, cfg.function_base_url, cfg.streamlit_app_url, cfg.key_ring,
+        expires_delta_hours=ACCESS_TOKEN_EXPIRES_HOURS,
+    )
+    response = jsonify(
+        access_token=access_token,
+        token_type="Bearer",
+        expires_in=int(ACCESS_TOKEN_EXPIRES_HOURS * 3600),
+        refresh_token=new_refresh_token,
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@auth_bp.route('/tokens:batch', methods=['POST'])
+def mint_tokens_batch_route():
+    """
+    サービス間連携・負荷試験用に、複数ユーザーのトークンをまとめて発行します。
+
+    リクエスト (JSON): {"subjects": ["a@example.com", {"email": "b@example.com", "name": "B"}], "expires_in_hours": 1}
+    レスポンス (JSON): {"tokens": [{"sub": ..., "token": ...}], "rejected": [...], "expires_in": 秒}
+    許可ユーザーリストにないユーザーは発行せず rejected に含めます。
+    """
+    cfg = get_request_config()
+    error_response = _service_auth_error(cfg)
+    if error_response is not None:
+        return error_response
+
+    body = request.get_json(silent=True) or {}
+    subjects = body.get("subjects")
+    if not isinstance(subjects, list) or not subjects:
+        return make_response(jsonify(error="invalid_request", error_description="subjects must be a non-empty list"), 400)
+    if len(subjects) > BATCH_MINT_MAX_SUBJECTS:
+        return make_response(jsonify(error="invalid_request",
+                                     error_description=f"at most {BATCH_MINT_MAX_SUBJECTS} subjects per batch"), 400)
+    try:
+        expires_in_hours = float(body.get("expires_in_hours", 1))
+    except (TypeError, ValueError):
+        expires_in_hours = 0
+    if not 0 < expires_in_hours <= BATCH_MINT_MAX_EXPIRES_HOURS:
+        return make_response(jsonify(error="invalid_request", error_description="invalid expires_in_hours"), 400)
+
+    accepted, rejected = [], []
+    for subject in subjects:
+        email = subject.get("email") if isinstance(subject, dict) else subject
+        if isinstance(email, str) and cfg.allow_list.is_allowed(email):
+            accepted.append(subject)
+        else:
+            rejected.append(subject)
+
+    tokens = auth_utils.mint_tokens_batch(
+        accepted, cfg.function_base_url, cfg.streamlit_app_url, cfg.key_ring,
+        expires_delta_hours=expires_in_hours, processes=BATCH_MINT_PROCESSES,
+    )
+    logger.debug("/auth/tokens:batch: minted=%d rejected=%d", len(tokens), len(rejected))
+    response = jsonify(
+        tokens=[{"sub": auth_utils.normalize_subject(subject)[0], "token": token}
+                for subject, token in zip(accepted, tokens)],
+        rejected=rejected,
+        expires_in=int(expires_in_hours * 3600),
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@auth_bp.route('/revoke', methods=['POST'])
+def revoke_token_route():
+    """
+    トークンを失効させます (RFC 7009 形式: フォームパラメータ token, token_type_hint)。
+
+    トークン自体の所持者 (ログアウト時の Streamlit アプリなど)、または SERVICE_API_KEY を持つサービスが呼び出せます。
+    リフレッシュトークンの場合は、同じログインから派生したトークンをすべて無効にします。
+    RFC 7009 に従い、不正・期限切れのトークンでも 200 を返します。
+    """
+    cfg = get_request_config()
+    if cfg is None or cfg.key_ring is None:
+        return make_response(jsonify(error="server_error"), 500)
+    body = request.form if request.form else (request.get_json(silent=True) or {})
+    token = body.get("token")
+    if not token:
+        return make_response(jsonify(error="invalid_request", error_description="token is required"), 400)
+    if body.get("token_type_hint") == "refresh_token" or token.count(".") != 2: # JWT 以外はリフレッシュトークン
+        service = refresh_tokens.get_refresh_token_service()
+        record = service.revoke(token, namespace=cfg.tenant_id) if service is not None else None
+        if record is not None:
+            logger.debug("/auth/revoke: revoked refresh token family", extra={"user": record.email})
+        response = make_response("", 200)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    try:
+        # 期限切れのトークンは失効させる必要がないため、通常の検証で十分
+        payload = auth_utils.verify_custom_jwt(token, cfg.key_ring, cfg.function_base_url, cfg.streamlit_app_url)
+    except Exception as e:
+        logger.debug("/auth/revoke: token not revocable (%s); responding 200.", e.__class__.__name__)
+        return make_response("", 200)
+    if payload.get("jti"):
+        revocation.get_revocation_service().revoke(payload["jti"], payload["exp"])
+        logger.debug("/auth/revoke: revoked jti", extra={"user": payload.get("sub"), "jti": payload["jti"]})
+    response = make_response("", 200)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+def _introspection_response(body, max_age):
+    response = jsonify(body)
+    # 応答は呼び出し元のサービスだけがキャッシュできる (失効の反映は最大 max_age 秒遅れる)
+    response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    return response
+
+@auth_bp.route('/introspect', methods=['POST'])
+def introspect_route():
+    """
+    トークンの有効性と内容を返します (RFC 7662)。下流サービスは JWT の鍵や検証オプションを持つ必要がありません。
+
+    リクエスト (フォーム): token=...  (Authorization: Bearer <SERVICE_API_KEY> が必要)
+    レスポンス (JSON): {"active": true, "sub": ..., "exp": ...} または {"active": false}
+    """
+    cfg = get_request_config()
+    error_response = _service_auth_error(cfg)
+    if error_response is not None:
+        return error_response
+    token = request.form.get("token")
+    if not token:
+        return make_response(jsonify(error="invalid_request", error_description="token is required"), 400)
+    result, max_age = introspection.get_introspector().introspect(
+        token, cfg, revocation.get_revocation_service().is_revoked
+    )
+    return _introspection_response(result, max_age)
+
+@auth_bp.route('/introspect:batch', methods=['POST'])
+def introspect_batch_route():
+    """
+    複数のトークンをまとめて検証します。結果は tokens と同じ順序で返します。
+
+    リクエスト (JSON): {"tokens": ["...", "..."]}  (Authorization: Bearer <SERVICE_API_KEY> が必要)
+    レスポンス (JSON): {"results": [{"active": true, ...}, {"active": false}]}
+    max-age は全トークンの中で最も短いものに合わせます。
+    """
+    cfg = get_request_config()
+    error_response = _service_auth_error(cfg)
+    if error_response is not None:
+        return error_response
+    tokens = (request.get_json(silent=True) or {}).get("tokens")
+    if not isinstance(tokens, list) or not tokens:
+        return make_response(jsonify(error="invalid_request", error_description="tokens must be a non-empty list"), 400)
+    if len(tokens) > INTROSPECT_BATCH_MAX_TOKENS:
+        return make_response(jsonify(error="invalid_request",
+                                     error_description=f"at most {INTROSPECT_BATCH_MAX_TOKENS} tokens per batch"), 400)
+    results, max_age = introspection.get_introspector().introspect_many(
+        tokens, cfg, revocation.get_revocation_service().is_revoked
+    )
+    return _introspection_response({"results": results}, max_age)
+
+@well_known_bp.route('/jwks.json')
+def jwks_route():
+    """署名に使用する非対称鍵の公開鍵 (JWKS)。検証側はこれを使い、共有シークレットを必要としません。"""
+    cfg = get_request_config()
+    if cfg is None or cfg.key_ring is None:
+        return make_response({"keys": []}, 503)
+    response = make_response(cfg.key_ring.jwks())
+    response.headers["Cache-Control"] = f"public, max-age={JWKS_MAX_AGE_SECONDS}"
+    return response
 
 # もしルートパス '/' もこのBlueprintで扱うなら
 # root_bp = Blueprint('root', __name__)
@@ -1,12 +1,146 @@
 # auth_server_flask/auth_utils.py
 
-import uuid
+import base64
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import jwt
 from datetime import datetime, timedelta, timezone
+from signing_keys import KeyRing
+import observability
 
-def generate_oauth_state_parameter():
-    """OAuth 2.0のCSRF対策用のstateパラメータを生成します。"""
-    return str(uuid.uuid4())
+logger = observability.get_logger(__name__)
+
+JWT_VERIFY_LEEWAY_SECONDS = 30
+
+OAUTH_STATE_TTL_SECONDS = 600 # stateトークンの有効期間 (Googleでの認証操作を含む)
+
+class OAuthStateError(Exception):
+    """OAuth stateトークンの検証に失敗した場合の例外。"""
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """失効済みのJWTが提示された場合の例外。"""
+
+class UnknownSigningKeyError(jwt.InvalidTokenError):
+    """JWT ヘッダーの kid がキーリングにない (不明・期限切れの鍵) 場合の例外。"""
+
+def generate_jti():
+    """JWTの一意な識別子 (jtiクレーム) を生成します。失効管理に使用します。"""
+    return secrets.token_urlsafe(16)
+
+def _b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64url_decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def derive_oauth_state_key(secret):
+    """
+    stateトークン署名用の鍵を導出します。
+    JWT署名鍵などの既存のシークレットから、用途を分離した鍵を作るために使用します。
+    """
+    return hmac.new(secret.encode("utf-8"), b"oauth-state-v1", hashlib.sha256).digest()
+
+def create_oauth_state_token(signing_key, return_to=None, ttl_seconds=OAUTH_STATE_TTL_SECONDS, now=None):
+    """
+    サーバー側の保存領域やCookieを必要としない、署名付きのstateトークンを生成します。
+
+    形式: base64url(JSONペイロード) + "." + base64url(HMAC-SHA256署名)
+    ペイロードには nonce (n)、発行時刻 (iat)、有効期限 (exp)、ログイン後の戻り先URL (r) を含みます。
+
+    Args:
+        signing_key (bytes): HMAC署名鍵 (derive_oauth_state_key で導出したもの)。
+        return_to (str, optional): ログイン完了後の戻り先URL。
+        ttl_seconds (int, optional): 有効期間（秒）。
+        now (int, optional): 現在時刻 (UNIX秒)。テスト・ベンチマーク用。
+
+    Returns:
+        str: stateトークン。
+    """
+    issued_at = int(now if now is not None else time.time())
+    payload = {"n": secrets.token_urlsafe(12), "iat": issued_at, "exp": issued_at + int(ttl_seconds)}
+    if return_to:
+        payload["r"] = return_to
+    body = _b64url_encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    signature = hmac.new(signing_key, body.encode("ascii"), hashlib.sha256).digest()
+    return f"{body}.{_b64url_encode(signature)}"
+
+def verify_oauth_state_token(token, signing_key, replay_cache=None, now=None):
+    """
+    stateトークンを検証し、ペイロードを返します。署名の比較は定数時間で行います。
+
+    Args:
+        token (str): コールバックで受け取った state パラメータ。
+        signing_key (bytes): HMAC署名鍵。
+        replay_cache (NonceReplayCache, optional): 指定した場合、同じ nonce の再利用を拒否します。
+        now (int, optional): 現在時刻 (UNIX秒)。テスト・ベンチマーク用。
+
+    Returns:
+        dict: ペイロード (n, iat, exp, r)。
+
+    Raises:
+        OAuthStateError: 形式不正、署名不一致、期限切れ、再利用の場合。
+    """
+    if not token or token.count(".") != 1:
+        raise OAuthStateError("malformed")
+    body, signature = token.split(".")
+    expected = hmac.new(signing_key, body.encode("ascii", "replace"), hashlib.sha256).digest()
+    try:
+        actual = _b64url_decode(signature)
+    except (ValueError, TypeError):
+        raise OAuthStateError("malformed")
+    if not hmac.compare_digest(expected, actual):
+        raise OAuthStateError("invalid_signature")
+    try:
+        payload = json.loads(_b64url_decode(body))
+        expires_at = int(payload["exp"])
+        nonce = payload["n"]
+    except (ValueError, TypeError, KeyError):
+        raise OAuthStateError("malformed")
+    current_time = now if now is not None else time.time()
+    if current_time >= expires_at:
+        raise OAuthStateError("expired")
+    if replay_cache is not None and not replay_cache.add(nonce, expires_at, now=current_time):
+        raise OAuthStateError("replayed")
+    return payload
+
+class NonceReplayCache:
+    """
+    使用済み nonce を記録する、メモリ上限付きのプロセス内キャッシュ。
+
+    期限切れの nonce は追加時に古い順から削除し、max_entries を超えた場合も古い順に破棄します。
+    (破棄された nonce はトークン自体の有効期限で保護されます)
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # nonce -> exp (追加順 ≒ 期限順)
+        self._lock = threading.Lock()
+
+    def add(self, nonce, expires_at, now=None):
+        """nonce を記録します。既に使用済みの場合は False を返します。"""
+        current_time = now if now is not None else time.time()
+        with self._lock:
+            entries = self._entries
+            while entries:
+                oldest_nonce, oldest_exp = next(iter(entries.items()))
+                if oldest_exp > current_time and len(entries) < self.max_entries:
+                    break
+                del entries[oldest_nonce]
+            if nonce in entries:
+                return False
+            entries[nonce] = expires_at
+            return True
+
+    def __len__(self):
+        return len(self._entries)
 
 def create_custom_jwt(user_email, user_name, issuer_url, audience_url, jwt_secret_key, expires_delta_hours=1):
     """
@@ -17,7 +151,8 @@ def create_custom_jwt(user_email, user_name, issuer_url, audience_url, jwt_secre
         user_name (str): ユーザー名 (JWTのnameクレーム)。
         issuer_url (str): JWTの発行者URL (issクレーム)。
         audience_url (str): JWTの対象者URL (audクレーム)。
-        jwt_secret_key (str): JWTの署名に使用する秘密鍵。
+        jwt_secret_key (str | KeyRing): JWTの署名に使用する秘密鍵 (HS256)、
+            またはキーリング (primary の鍵・アルゴリズムで署名し、ヘッダーに kid を付与)。
         expires_delta_hours (int, optional): JWTの有効期間（時間）。デフォルトは1時間。
 
     Returns:
@@ -33,12 +168,180 @@ def create_custom_jwt(user_email, user_name, issuer_url, audience_url, jwt_secre
         "iss": issuer_url,
         "aud": audience_url,
         "exp": datetime.now(timezone.utc) + timedelta(hours=expires_delta_hours),
-        "iat": datetime.now(timezone.utc)
+        "iat": datetime.now(timezone.utc),
+        "jti": generate_jti(),
     }
     try:
-        token = jwt.encode(payload, jwt_secret_key, algorithm="HS256")
-        print(f"DEBUG auth_utils: JWT generated for {user_email}. Token (first 20 chars): {token[:20]}...")
+        with observability.timed(observability.PHASE_JWT_SIGN):
+            if isinstance(jwt_secret_key, KeyRing):
+                signing_key = jwt_secret_key.primary
+                token = jwt.encode(payload, signing_key.signing_key, algorithm=signing_key.algorithm,
+                                   headers={"kid": signing_key.kid})
+            else:
+                token = jwt.encode(payload, jwt_secret_key, algorithm="HS256")
+        # トークン自体 (の一部) は出力しない。追跡には jti を使う
+        logger.debug("JWT generated", extra={"sub": user_email, "jti": payload["jti"]})
         return token
     except Exception as e:
-        print(f"ERROR auth_utils: JWT encoding failed: {e}")
-        raise # エラーを呼び出し元に再スローして処理させる
\ No newline at end of file
+        logger.error("JWT encoding failed: %s", e)
+        raise # エラーを呼び出し元に再スローして処理させる
+
+def normalize_subject(subject):
+    """バッチ発行の対象を (email, name) に正規化します。"""
+    if isinstance(subject, str):
+        return subject, subject
+    if isinstance(subject, dict):
+        return subject["email"], subject.get("name") or subject["email"]
+    email, name = subject
+    return email, name or email
+
+def _sign_batch(algorithm_obj, prepared_key, header_segment, claims_template, subjects):
+    """
+    共通のヘッダー・時刻・準備済みの鍵を使って、複数のJWTを署名します。
+    jwt.encode と同じ形式 (base64url(header).base64url(payload).base64url(signature)) を生成します。
+    """
+    tokens = []
+    for email, name in subjects:
+        claims = {"sub": email, "name": name, "email": email}
+        claims.update(claims_template)
+        claims["jti"] = generate_jti()
+        payload_segment = _b64url_encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        signing_input = f"{header_segment}.{payload_segment}"
+        signature = algorithm_obj.sign(signing_input.encode("ascii"), prepared_key)
+        tokens.append(f"{signing_input}.{_b64url_encode(signature)}")
+    return tokens
+
+# --- バッチ発行用プロセスプール (非対称鍵の署名をCPUコア間で並列化する) ---
+_mint_worker_state = None # ワーカープロセス内: (algorithm_obj, prepared_key)
+_mint_pool = None         # (鍵の識別子, ProcessPoolExecutor)
+_mint_pool_lock = threading.Lock() # プールの作成・入れ替えと、プールへの投入を直列化する
+
+def _init_mint_worker(algorithm, private_key_pem):
+    global _mint_worker_state
+    from cryptography.hazmat.primitives import serialization
+    from jwt.algorithms import get_default_algorithms
+    algorithm_obj = get_default_algorithms()[algorithm]
+    key = serialization.load_pem_private_key(private_key_pem, password=None)
+    _mint_worker_state = (algorithm_obj, algorithm_obj.prepare_key(key))
+
+def _mint_worker_sign(header_segment, claims_template, subjects):
+    algorithm_obj, prepared_key = _mint_worker_state
+    return _sign_batch(algorithm_obj, prepared_key, header_segment, claims_template, subjects)
+
+def _get_mint_pool(signing_key, processes):
+    """
+    署名鍵ごとにワーカープールを1つ作成し、以降の呼び出しで再利用します。
+    _mint_pool_lock を保持して呼び出してください (鍵が変わった場合は古いプールを終了します)。
+    """
+    global _mint_pool
+    from cryptography.hazmat.primitives import serialization
+    pool_id = (signing_key.kid, id(signing_key), processes)
+    if _mint_pool is not None and _mint_pool[0] == pool_id:
+        return _mint_pool[1]
+    if _mint_pool is not None:
+        _mint_pool[1].shutdown(wait=False) # 投入済みの処理は完了してから終了する
+        _mint_pool = None
+    private_key_pem = signing_key.signing_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    # ワーカーは fork ではなく spawn で起動する。スレッドを持つプロセス (gthread のワーカーなど) から fork すると、
+    # 他のスレッドが保持していたロック (import・logging など) を子プロセスが引き継いでデッドロックすることがある
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_mint_worker, initargs=(signing_key.algorithm, private_key_pem))
+    _mint_pool = (pool_id, pool)
+    return pool
+
+def _submit_mint_chunks(signing_key, processes, header_segment, claims_template, chunks):
+    """
+    チャンクをワーカープールに投入し、Future のリストを返します。
+    プールの取得から投入までをロック内で行うため、別のスレッドが同時に鍵の異なるバッチを発行しても、
+    プールが二重に作成されたり、終了したプールに投入したりすることはありません。
+    """
+    with _mint_pool_lock:
+        pool = _get_mint_pool(signing_key, processes)
+        return [pool.submit(_mint_worker_sign, header_segment, claims_template, chunk) for chunk in chunks]
+
+def _reinit_mint_pool_after_fork():
+    # 親プロセスのワーカープール (とロック) はフォーク後の子プロセスでは使えないため、破棄して必要時に作り直す
+    global _mint_pool, _mint_pool_lock
+    _mint_pool = None
+    _mint_pool_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_mint_pool_after_fork)
+
+def mint_tokens_batch(subjects, issuer_url, audience_url, key_ring, expires_delta_hours=1, processes=None):
+    """
+    複数のユーザーに対してカスタムJWTをまとめて発行します (サービス間連携・負荷試験用)。
+
+    create_custom_jwt と同じクレームのトークンを生成しますが、時刻・ヘッダーはバッチで共通とし、
+    準備済みの鍵を再利用し、トークンごとのログ出力は行いません。
+
+    Args:
+        subjects (list): メールアドレス、(email, name) のタプル、または {"email", "name"} の辞書のリスト。
+        issuer_url (str): JWTの発行者URL (issクレーム)。
+        audience_url (str): JWTの対象者URL (audクレーム)。
+        key_ring (KeyRing): 署名に使用するキーリング (primary の鍵で署名)。
+        expires_delta_hours (int, optional): JWTの有効期間（時間）。デフォルトは1時間。
+        processes (int, optional): 2以上を指定すると、非対称鍵の署名をプロセスプールで並列化します。
+            HS256 は常に呼び出し元のプロセスで署名します (並列化のオーバーヘッドの方が大きいため)。
+
+    Returns:
+        list[str]: subjects と同じ順序のJWT文字列のリスト。
+    """
+    subjects = [normalize_subject(subject) for subject in subjects]
+    signing_key = key_ring.primary
+    issued_at = int(time.time())
+    claims_template = {
+        "iss": issuer_url,
+        "aud": audience_url,
+        "exp": issued_at + int(expires_delta_hours * 3600),
+        "iat": issued_at,
+    }
+    header = {"alg": signing_key.algorithm, "kid": signing_key.kid, "typ": "JWT"}
+    header_segment = _b64url_encode(json.dumps(header, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+
+    if processes and processes > 1 and signing_key.algorithm != "HS256" and len(subjects) > processes:
+        chunk_size = -(-len(subjects) // (processes * 4))
+        chunks = [subjects[i:i + chunk_size] for i in range(0, len(subjects), chunk_size)]
+        futures = _submit_mint_chunks(signing_key, processes, header_segment, claims_template, chunks)
+        return [token for future in futures for token in future.result()]
+
+    algorithm_obj, prepared_key = signing_key.prepared_signer()
+    return _sign_batch(algorithm_obj, prepared_key, header_segment, claims_template, subjects)
+
+def verify_custom_jwt(token, key_ring, issuer_url, audience_url, leeway_seconds=JWT_VERIFY_LEEWAY_SECONDS,
+                      revocation_list=None):
+    """
+    create_custom_jwt で発行したJWTを、キーリングの鍵で検証します。
+
+    Args:
+        token (str): JWT文字列。
+        key_ring (KeyRing): 検証に使用するキーリング (ヘッダーの kid で鍵を選択。kid なしは primary)。
+        issuer_url (str): 期待する発行者 (iss)。
+        audience_url (str): 期待する対象者 (aud)。
+        leeway_seconds (int, optional): 有効期限の許容誤差（秒）。
+        revocation_list (optional): is_revoked(jti) を持つ失効リスト。指定時は失効済みのトークンを拒否します。
+
+    Returns:
+        dict: デコードされたペイロード。
+
+    Raises:
+        jwt.InvalidTokenError: 検証に失敗した場合 (kid が不明・期限切れの場合は UnknownSigningKeyError、
+            失効済みの場合は TokenRevokedError)。
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    signing_key = key_ring.get(kid) if kid else key_ring.primary
+    if signing_key is None:
+        raise UnknownSigningKeyError(f"Unknown key id: {kid}")
+    payload = jwt.decode(
+        token,
+        signing_key.verification_key,
+        algorithms=[signing_key.algorithm],
+        audience=audience_url,
+        issuer=issuer_url,
+        leeway=leeway_seconds,
+    )
+    if revocation_list is not None and payload.get("jti") and revocation_list.is_revoked(payload["jti"]):
+        raise TokenRevokedError("Token has been revoked.")
+    return payload
\ No newline at end of file
@@ -1,182 +1,766 @@
+import json
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config_snapshot
+import observability
+from allowlist import AllowList
+from auth_utils import derive_oauth_state_key
+from signing_keys import KeyRing, hs256_spec, spec_fingerprint
 
 # Load .env file at the very beginning if it exists
-load_dotenv()
-print("DEBUG config.py: dotenv loaded (if .env exists)")
+# 有効な設定のスナップショット (config_snapshot.py) がある場合は .env を解析せず、作成時に記録した .env の内容を使う
+# 記録した .env の内容は、このプロセスのモード (ENV_ARG / ENV) と参照先のものと確認してから適用する
+# (使えない理由は最初の設定の読み込み時に _snapshot_values がログに出す)
+_snapshot = None # 確認済みのスナップショットのペイロード
+_snapshot_error = None # スナップショットを使わない理由
+if os.environ.get("CONFIG_SNAPSHOT_FILE"):
+    try:
+        _snapshot = config_snapshot.read_snapshot(os.environ["CONFIG_SNAPSHOT_FILE"])
+        config_snapshot.check_source(
+            _snapshot, (os.environ.get("ENV_ARG") or os.environ.get("ENV", "prod")).lower(), os.environ)
+    except (config_snapshot.SnapshotError, OSError, ValueError, ImportError) as e:
+        _snapshot, _snapshot_error = None, e
+if _snapshot is not None:
+    for _name, _value in _snapshot["environ"].items():
+        os.environ.setdefault(_name, _value) # load_dotenv と同じく、既存の環境変数を優先する
+else:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+logger = observability.get_logger(__name__)
 
-# --- グローバル設定値 (configモジュールの属性として管理) ---
+# --- グローバル状態 ---
+# 設定値そのものは AuthConfig スナップショットとして保持し、参照の差し替えだけで公開する
 GCP_PROJECT_ID = None
-GOOGLE_CLIENT_ID = None
-GOOGLE_CLIENT_SECRET = None
-JWT_SECRET_KEY = None
-STREAMLIT_APP_URL = None
-FUNCTION_BASE_URL = None # このサービス自身のベースURL
-REDIRECT_URI = None      # FUNCTION_BASE_URL から構築
-ALLOWED_USERS_LIST = []
 ENV_TYPE = os.environ.get("ENV", "prod").lower() # 初期値。initialize_app_configsで上書き可能性あり
 secret_manager_client = None # SecretManagerServiceクライアント
 
-# アプリケーション初期化済みフラグ
-_app_configs_initialized = False
+_current_config = None # 公開中の AuthConfig (読み取りはロック不要)
+_config_version = 0
+_config_build_lock = threading.RLock() # スナップショットの構築・公開を直列化する
+_config_warmup_thread = None
+_config_reloader_thread = None
+
+logger.debug("Initial ENV_TYPE: %s, GCP_PROJECT_ID from env: %s", ENV_TYPE, os.environ.get("GCP_PROJECT"))
+
+# --- シークレットキャッシュの設定 ---
+# Secret Manager へのアクセスはリクエストごとに発生させず、TTL付きでプロセス内にキャッシュする
+SECRET_CACHE_TTL_SECONDS = float(os.environ.get("SECRET_CACHE_TTL_SECONDS", "300"))
+SECRET_CACHE_REFRESH_AHEAD_SECONDS = float(os.environ.get("SECRET_CACHE_REFRESH_AHEAD_SECONDS", "60"))
+SECRET_CACHE_ERROR_RETRY_SECONDS = float(os.environ.get("SECRET_CACHE_ERROR_RETRY_SECONDS", "30"))
+SECRET_FETCH_MAX_WORKERS = int(os.environ.get("SECRET_FETCH_MAX_WORKERS", "6"))
+
+_secret_backend = None # 差し替え可能なシークレットバックエンド
+_secret_cache = None   # SecretCache インスタンス
+_secret_cache_lock = threading.Lock()
+
+# --- シークレットバックエンド ---
+class SecretManagerBackend:
+    """Google Cloud Secret Manager からシークレットを取得するバックエンド。"""
+
+    def __init__(self, project_id, client):
+        self.project_id = project_id
+        self.client = client
+
+    def access(self, secret_name):
+        name = f"projects/{self.project_id}/secrets/{secret_name}/versions/latest"
+        response = self.client.access_secret_version(request={"name": name})
+        return response.payload.data.decode("UTF-8").strip()
+
+class InMemorySecretBackend:
+    """
+    テスト・ローカル検証用のインメモリ Secret Manager 代替。
+
+    存在しないシークレットを要求された場合は KeyError を送出します。
+    access_count で実際のバックエンド呼び出し回数を確認できます。
+    """
+
+    def __init__(self, secrets=None):
+        self._secrets = dict(secrets or {})
+        self._lock = threading.Lock()
+        self.access_count = 0
+
+    def set_secret(self, secret_name, value):
+        with self._lock:
+            self._secrets[secret_name] = value
+
+    def delete_secret(self, secret_name):
+        with self._lock:
+            self._secrets.pop(secret_name, None)
+
+    def access(self, secret_name):
+        with self._lock:
+            self.access_count += 1
+            return str(self._secrets[secret_name]).strip()
+
+class _CachedSecret:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+
+class SecretCache:
+    """
+    シークレットごとにTTLを持つキャッシュ。
+
+    - TTL内はバックエンドへアクセスせずにキャッシュ値を返します。
+    - 期限の refresh_ahead_seconds 前からはキャッシュ値を返しつつ、バックグラウンドで再取得します。
+    - 期限切れ後の再取得に失敗した場合は古い値を返し (stale-while-revalidate)、
+      error_retry_seconds 後に再試行します。
+    - 同じシークレットへの同時取得は1回にまとめられます。
+    """
+
+    def __init__(self, backend, ttl_seconds=300, refresh_ahead_seconds=60,
+                 error_retry_seconds=30, max_workers=6, clock=time.monotonic):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead_seconds = min(refresh_ahead_seconds, ttl_seconds)
+        self.error_retry_seconds = error_retry_seconds
+        self._clock = clock
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="secret-fetch")
+
+    def _fetch(self, secret_name):
+        try:
+            with observability.timed(observability.PHASE_SECRET_FETCH):
+                value = self.backend.access(secret_name)
+        except Exception as e:
+            logger.warning("SMからの取得失敗 ('%s'): %s", secret_name, e)
+            with self._lock:
+                self._inflight.pop(secret_name, None)
+                stale = self._entries.get(secret_name)
+                if stale is not None:
+                    # 古い値を保持したまま、一定時間後に再試行させる
+                    self._entries[secret_name] = _CachedSecret(stale.value, self._clock() + self.error_retry_seconds)
+            raise
+        with self._lock:
+            self._entries[secret_name] = _CachedSecret(value, self._clock() + self.ttl_seconds)
+            self._inflight.pop(secret_name, None)
+        logger.debug("Secret Managerから '%s' を取得成功。", secret_name)
+        return value
+
+    def _submit(self, secret_name):
+        with self._lock:
+            future = self._inflight.get(secret_name)
+            if future is None:
+                future = self._executor.submit(self._fetch, secret_name)
+                self._inflight[secret_name] = future
+            return future
+
+    def get(self, secret_name):
+        """単一のシークレットを取得します。取得できない場合は None を返します。"""
+        return self.get_many([secret_name])[secret_name]
+
+    def get_many(self, secret_names):
+        """
+        複数のシークレットを取得します。キャッシュにないものはスレッドプールで並行して取得します。
+
+        Returns:
+            dict: シークレット名 -> 値 (取得できなかったものは None)。
+        """
+        results = {}
+        pending = {}
+        now = self._clock()
+        for secret_name in secret_names:
+            if not secret_name or secret_name in results or secret_name in pending:
+                results.setdefault(secret_name, None)
+                continue
+            entry = self._entries.get(secret_name)
+            if entry is not None and now < entry.expires_at:
+                results[secret_name] = entry.value
+                if now >= entry.expires_at - self.refresh_ahead_seconds:
+                    self._submit(secret_name) # バックグラウンドで先行更新
+            else:
+                pending[secret_name] = (self._submit(secret_name), entry)
+
+        for secret_name, (future, stale) in pending.items():
+            try:
+                results[secret_name] = future.result()
+            except Exception:
+                if stale is not None:
+                    logger.warning("'%s' の再取得に失敗したため、キャッシュ済みの古い値を使用します。", secret_name)
+                    results[secret_name] = stale.value
+                else:
+                    results[secret_name] = None
+        return results
+
+    def invalidate(self, secret_name=None):
+        """キャッシュを破棄します。secret_name 省略時は全件。"""
+        with self._lock:
+            if secret_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(secret_name, None)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _reinit_after_fork(self):
+        """フォーク後の子プロセスで、取得済みの値を残したままロックとスレッドプールを作り直します。"""
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="secret-fetch")
 
-print(f"DEBUG config.py: Initial ENV_TYPE: {ENV_TYPE}")
-print(f"DEBUG config.py: Initial GCP_PROJECT_ID from env: {os.environ.get('GCP_PROJECT')}")
+def set_secret_backend(backend):
+    """
+    シークレットバックエンドを差し替えます (テスト用のインメモリ実装など)。
+    既存のキャッシュは破棄されます。
+    """
+    global _secret_backend, _secret_cache
+    with _secret_cache_lock:
+        if _secret_cache is not None:
+            _secret_cache.close()
+        _secret_backend = backend
+        _secret_cache = None
+
+def get_secret_cache():
+    """現在のバックエンドに対応する SecretCache を返します (必要なら作成)。"""
+    global _secret_cache
+    cache = _secret_cache
+    if cache is not None:
+        return cache
+    with _secret_cache_lock:
+        if _secret_cache is None:
+            backend = _secret_backend
+            if backend is None:
+                backend = SecretManagerBackend(GCP_PROJECT_ID, secret_manager_client)
+            _secret_cache = SecretCache(
+                backend,
+                ttl_seconds=SECRET_CACHE_TTL_SECONDS,
+                refresh_ahead_seconds=SECRET_CACHE_REFRESH_AHEAD_SECONDS,
+                error_retry_seconds=SECRET_CACHE_ERROR_RETRY_SECONDS,
+                max_workers=SECRET_FETCH_MAX_WORKERS,
+            )
+        return _secret_cache
+
+def _reinit_after_fork():
+    """
+    プリフォーク型サーバー (prod_server.py) のワーカー用。マスタープロセスで読み込んだ設定・シークレットは
+    そのまま使い、フォークを越えて使えないロック・スレッド・gRPC クライアントだけを作り直します。
+    """
+    global _config_build_lock, _secret_cache_lock, _config_warmup_thread, _config_reloader_thread
+    global secret_manager_client
+    _config_build_lock = threading.RLock()
+    _secret_cache_lock = threading.Lock()
+    _config_warmup_thread = None
+    _config_reloader_thread = None
+    if secret_manager_client is not None:
+        secret_manager_client = type(secret_manager_client)() # gRPC のチャネルはフォーク後に使えない
+    if _secret_cache is not None:
+        _secret_cache._reinit_after_fork()
+        if isinstance(_secret_cache.backend, SecretManagerBackend):
+            _secret_cache.backend.client = secret_manager_client
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
 
 # --- ヘルパー関数: Secret Managerから値を取得 ---
 def get_secret_from_sm(secret_name_on_sm):
     global GCP_PROJECT_ID, secret_manager_client # これらは initialize_app_configs で設定される
     if not secret_name_on_sm:
-        print(f"DEBUG get_secret_from_sm: Secret name not provided for SM access.")
-        return None
-    if not GCP_PROJECT_ID:
-        print(f"エラー (get_secret_from_sm): GCP_PROJECT_ID is not set. Cannot fetch '{secret_name_on_sm}'.")
-        return None
-    if not secret_manager_client:
-        # 通常、initialize_app_configs でクライアントは初期化されているはず
-        # ここで再度初期化を試みるか、エラーとするかは設計次第
-        # 今回はエラーとして、呼び出し元で適切に処理することを期待
-        print(f"エラー (get_secret_from_sm): Secret Manager client not initialized. Cannot fetch '{secret_name_on_sm}'.")
-        return None
-    try:
-        name = f"projects/{GCP_PROJECT_ID}/secrets/{secret_name_on_sm}/versions/latest"
-        response = secret_manager_client.access_secret_version(request={"name": name})
-        value = response.payload.data.decode("UTF-8").strip()
-        print(f"DEBUG: Secret Managerから '{secret_name_on_sm}' を取得成功。")
-        return value
-    except Exception as e:
-        print(f"SMからの取得失敗 ('{secret_name_on_sm}'): {e}")
+        logger.debug("get_secret_from_sm: Secret name not provided for SM access.")
         return None
+    if _secret_backend is None:
+        if not GCP_PROJECT_ID:
+            logger.error("get_secret_from_sm: GCP_PROJECT_ID is not set. Cannot fetch '%s'.", secret_name_on_sm)
+            return None
+        if not secret_manager_client:
+            # 設定をスナップショットから読み込んだ場合はクライアントが未作成のため、最初の取得時に作成する
+            try:
+                _ensure_secret_manager_client()
+            except RuntimeError as e:
+                logger.error("get_secret_from_sm: %s Cannot fetch '%s'.", e, secret_name_on_sm)
+                return None
+    return get_secret_cache().get(secret_name_on_sm)
 
-# --- 設定値の初期化関数 ---
-def initialize_app_configs(mode_from_arg=None):
-    global GCP_PROJECT_ID, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, JWT_SECRET_KEY
-    global STREAMLIT_APP_URL, FUNCTION_BASE_URL, REDIRECT_URI, ALLOWED_USERS_LIST
-    global secret_manager_client, ENV_TYPE
-    global _app_configs_initialized
+# --- 設定スナップショット ---
+class AuthConfig:
+    """
+    アプリケーション設定の不変スナップショット。
 
-    if _app_configs_initialized and not mode_from_arg: # 既に初期化済みで、強制的なモード指定がない場合はスキップ
-        print("DEBUG initialize_app_configs: Already initialized. Skipping.")
-        return
+    initialize_app_configs / reload_configs がリクエスト経路の外で構築し、
+    モジュール変数の参照を1回差し替えることで公開します。
+    各リクエストは get_config() で1つのスナップショットを取得し、最後までそれを使います。
+    """
 
-    print("DEBUG: initialize_app_configs CALLED")
+    __slots__ = (
+        "version",
+        "env_type",
+        "gcp_project_id",
+        "google_client_id",
+        "google_client_secret",
+        "jwt_secret_key",
+        "streamlit_app_url",
+        "function_base_url",
+        "redirect_uri",
+        "allow_list",
+        "oauth_state_key",
+        "key_ring",
+        "service_api_key",
+        "tenant_id",
+        "loaded_at",
+    )
 
-    # mode_from_arg があれば ENV_TYPE を上書き
-    # os.environ.get("ENV_ARG") はローカル実行時の引数から来る想定
-    # os.environ.get("ENV") はCloud Functions/Runの環境変数から来る想定
-    effective_mode = mode_from_arg or os.environ.get("ENV_ARG") or os.environ.get("ENV", "prod")
-    ENV_TYPE = effective_mode.lower()
+    # 値の比較 (変更検知) から除外する属性
+    _METADATA_FIELDS = ("version", "loaded_at")
+    # 必須設定値 (REDIRECT_URI は FUNCTION_BASE_URL から生成されるが、これも必須)
+    REQUIRED_FIELDS = (
+        "google_client_id",
+        "google_client_secret",
+        "jwt_secret_key",
+        "streamlit_app_url",
+        "function_base_url",
+        "redirect_uri",
+    )
 
-    GCP_PROJECT_ID = os.environ.get('GCP_PROJECT')
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("AuthConfig は不変です。replace() で新しいスナップショットを作成してください。")
+
+    def __delattr__(self, name):
+        raise AttributeError("AuthConfig は不変です。")
+
+    def replace(self, **changes):
+        """一部の値を差し替えた新しいスナップショットを返します。"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return AuthConfig(**values)
+
+    def same_values(self, other):
+        """メタデータ (version, loaded_at) を除いて同じ設定値かどうか。"""
+        return other is not None and all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__ if name not in self._METADATA_FIELDS
+        )
+
+    def missing_fields(self):
+        return [name.upper() for name in self.REQUIRED_FIELDS if not getattr(self, name)]
+
+    def is_complete(self):
+        return not self.missing_fields()
+
+    def __repr__(self):
+        tenant = f", tenant_id={self.tenant_id!r}" if self.tenant_id else ""
+        return (f"AuthConfig(version={self.version}, env_type={self.env_type!r}{tenant}, "
+                f"streamlit_app_url={self.streamlit_app_url!r}, function_base_url={self.function_base_url!r})")
+
+def get_config():
+    """公開中の設定スナップショットを返します (未初期化なら None)。"""
+    return _current_config
+
+def _publish_config(new_config):
+    global _current_config, _config_version
+    _config_version += 1
+    new_config = new_config.replace(version=_config_version)
+    _current_config = new_config # 参照の差し替えのみ (アトミック)
+    return new_config
+
+# --- 設定値の初期化関数 ---
+def _ensure_secret_manager_client():
+    """Secret Managerクライアントを初期化します (初期化済み、またはバックエンド差し替え時は何もしません)。"""
+    global secret_manager_client
+    if _secret_backend is not None:
+        logger.debug("差し替えられたシークレットバックエンドを使用します。")
+    elif not secret_manager_client:
+        try:
+            from google.cloud import secretmanager
+            secret_manager_client = secretmanager.SecretManagerServiceClient()
+            logger.debug("Secret Managerクライアントを初期化しました。")
+        except ImportError:
+            raise RuntimeError("google-cloud-secret-managerライブラリが見つかりません。pip install google-cloud-secret-manager を実行してください。")
+        except Exception as e:
+            raise RuntimeError(f"Secret Managerクライアントの初期化に失敗: {e}")
+    else:
+        logger.debug("Secret Managerクライアントは既に初期化済みです。")
 
-    print(f"DEBUG initialize_app_configs: Effective ENV_TYPE = {ENV_TYPE}")
-    print(f"DEBUG initialize_app_configs: Effective GCP_PROJECT_ID = {GCP_PROJECT_ID}")
-
-    if ENV_TYPE == 'local_direct':
-        print("DEBUG: 'local_direct' モード: .env から直接値を読み込みます。")
-        GOOGLE_CLIENT_ID = os.environ.get("DIRECT_GOOGLE_CLIENT_ID")
-        GOOGLE_CLIENT_SECRET = os.environ.get("DIRECT_GOOGLE_CLIENT_SECRET")
-        JWT_SECRET_KEY = os.environ.get("DIRECT_JWT_SECRET_KEY")
-        STREAMLIT_APP_URL = os.environ.get("DIRECT_STREAMLIT_APP_URL")
-        FUNCTION_BASE_URL = os.environ.get("DIRECT_FUNCTION_BASE_URL")
-        allowed_users_list_str = os.environ.get("DIRECT_ALLOWED_USERS_LIST_STR")
-    elif ENV_TYPE == 'local_sm_test' or ENV_TYPE == 'prod':
-        print(f"DEBUG: '{ENV_TYPE}' モード: Secret Manager を利用します。")
+def _secret_names():
+    """各設定値 (_read_source_values のキー) を取得する Secret Manager 上のシークレット名。"""
+    # SM上のシークレット名を取得するための環境変数キーのプレフィックス
+    sm_prefix = "SM_NAME_FOR_"
+
+    # 各設定値に対応するSM名を環境変数から取得、なければデフォルト値を使用
+    # (デフォルト値は本番用とローカルテスト用で分岐)
+    default_suffix = "_PROD_SM"
+
+    names = {
+        field: os.environ.get(f"{sm_prefix}{setting}", f"{setting}{default_suffix}")
+        for field, setting in (
+            ("google_client_id", "GOOGLE_CLIENT_ID"),
+            ("google_client_secret", "GOOGLE_CLIENT_SECRET"),
+            ("jwt_secret_key", "JWT_SECRET_KEY"),
+            ("streamlit_app_url", "STREAMLIT_APP_URL"),
+            ("function_base_url", "FUNCTION_BASE_URL"),
+            ("allowed_users_list", "ALLOWED_USERS_LIST"),
+        )
+    }
+    # CALLBACK_URI は FUNCTION_BASE_URL から動的に生成するため、専用のSM名は不要
+    # キーリング定義 (任意)。明示的に SM 名が指定された場合のみ取得し、未指定なら JWT_SECRET_KEY の HS256 を使う
+    # サービス間API (トークンのバッチ発行など) の認証用キー (任意。未指定ならそれらのAPIは無効)
+    for field, setting in (("signing_keys_spec", "JWT_SIGNING_KEYS"), ("service_api_key", "SERVICE_API_KEY")):
+        if os.environ.get(f"{sm_prefix}{setting}"):
+            names[field] = os.environ[f"{sm_prefix}{setting}"]
+    return names
+
+def _read_source_values(env_type):
+    """
+    env_type に応じた設定元 (.env の環境変数 / Secret Manager) から、加工前の設定値を dict で読み込みます。
+    キーは _secret_names() と同じです (任意の設定値は未指定なら None)。
+    """
+    if env_type == 'local_direct':
+        logger.debug("'local_direct' モード: .env から直接値を読み込みます。")
+        return {
+            "google_client_id": os.environ.get("DIRECT_GOOGLE_CLIENT_ID"),
+            "google_client_secret": os.environ.get("DIRECT_GOOGLE_CLIENT_SECRET"),
+            "jwt_secret_key": os.environ.get("DIRECT_JWT_SECRET_KEY"),
+            "streamlit_app_url": os.environ.get("DIRECT_STREAMLIT_APP_URL"),
+            "function_base_url": os.environ.get("DIRECT_FUNCTION_BASE_URL"),
+            "allowed_users_list": os.environ.get("DIRECT_ALLOWED_USERS_LIST_STR"),
+            "signing_keys_spec": os.environ.get("DIRECT_JWT_SIGNING_KEYS"), # 任意 (JSON)
+            "service_api_key": os.environ.get("DIRECT_SERVICE_API_KEY"), # 任意 (サービス間APIの認証用)
+        }
+    elif env_type == 'local_sm_test' or env_type == 'prod':
+        logger.debug("'%s' モード: Secret Manager を利用します。", env_type)
         if not GCP_PROJECT_ID:
-            raise ValueError(f"'{ENV_TYPE}' モードではGCP_PROJECT環境変数の設定が必須です。")
+            raise ValueError(f"'{env_type}' モードではGCP_PROJECT環境変数の設定が必須です。")
 
-        # Secret Managerクライアントの初期化 (必要な場合のみ)
-        if not secret_manager_client:
-            try:
-                from google.cloud import secretmanager
-                secret_manager_client = secretmanager.SecretManagerServiceClient()
-                print("DEBUG: Secret Managerクライアントを初期化しました。")
-            except ImportError:
-                raise RuntimeError("google-cloud-secret-managerライブラリが見つかりません。pip install google-cloud-secret-manager を実行してください。")
-            except Exception as e:
-                raise RuntimeError(f"Secret Managerクライアントの初期化に失敗: {e}")
-        else:
-            print("DEBUG: Secret Managerクライアントは既に初期化済みです。")
-
-        # SM上のシークレット名を取得するための環境変数キーのプレフィックス
-        sm_prefix = "SM_NAME_FOR_"
-
-        # 各設定値に対応するSM名を環境変数から取得、なければデフォルト値を使用
-        # (デフォルト値は本番用とローカルテスト用で分岐)
-        default_suffix = "_PROD_SM"
-
-        sm_gcid = os.environ.get(f"{sm_prefix}GOOGLE_CLIENT_ID", f"GOOGLE_CLIENT_ID{default_suffix}")
-        sm_gc_secret = os.environ.get(f"{sm_prefix}GOOGLE_CLIENT_SECRET", f"GOOGLE_CLIENT_SECRET{default_suffix}")
-        sm_jwt_key = os.environ.get(f"{sm_prefix}JWT_SECRET_KEY", f"JWT_SECRET_KEY{default_suffix}")
-        sm_allowed_list = os.environ.get(f"{sm_prefix}ALLOWED_USERS_LIST", f"ALLOWED_USERS_LIST{default_suffix}")
-        sm_streamlit_url = os.environ.get(f"{sm_prefix}STREAMLIT_APP_URL", f"STREAMLIT_APP_URL{default_suffix}")
-        sm_function_base_url = os.environ.get(f"{sm_prefix}FUNCTION_BASE_URL", f"FUNCTION_BASE_URL{default_suffix}")
-        # CALLBACK_URI は FUNCTION_BASE_URL から動的に生成するため、専用のSM名は不要
-
-        print(f"DEBUG: SM名解決: GCID='{sm_gcid}', SECRET='{sm_gc_secret}', JWT='{sm_jwt_key}', ALLOWED='{sm_allowed_list}', S_URL='{sm_streamlit_url}', F_URL='{sm_function_base_url}'")
-
-        # Secret Managerから実際の値を取得
-        GOOGLE_CLIENT_ID = get_secret_from_sm(sm_gcid)
-        GOOGLE_CLIENT_SECRET = get_secret_from_sm(sm_gc_secret)
-        JWT_SECRET_KEY = get_secret_from_sm(sm_jwt_key)
-        STREAMLIT_APP_URL = get_secret_from_sm(sm_streamlit_url)
-        FUNCTION_BASE_URL = get_secret_from_sm(sm_function_base_url)
-        allowed_users_list_str = get_secret_from_sm(sm_allowed_list)
+        # Secret Managerクライアントの初期化 (必要な場合のみ。バックエンド差し替え時は不要)
+        _ensure_secret_manager_client()
+
+        names = _secret_names()
+        logger.debug("SM名解決: %s", names)
+
+        # Secret Managerから実際の値を取得 (キャッシュ経由、未取得分は並行して取得)
+        secrets = get_secret_cache().get_many(list(names.values()))
+        values = {field: secrets[name] for field, name in names.items()}
+        values.setdefault("signing_keys_spec", None)
+        values.setdefault("service_api_key", None)
+        return values
     else:
-        raise ValueError(f"無効なENVタイプが指定されました: '{ENV_TYPE}'。'local_direct', 'local_sm_test', 'prod' のいずれかである必要があります。")
+        raise ValueError(f"無効なENVタイプが指定されました: '{env_type}'。'local_direct', 'local_sm_test', 'prod' のいずれかである必要があります。")
+
+def _snapshot_values(env_type):
+    """
+    設定のスナップショット (CONFIG_SNAPSHOT_FILE) の設定値を返します。
+    未設定・期限切れ・インポート時の確認で使えなかった・モードや参照先 (GCP プロジェクト・シークレット名) が現在と異なる場合は None。
+    値はインポート時に .env の内容を適用したスナップショットのものだけを使います (ファイルが更新されても読み直さない)。
+    """
+    path = os.environ.get("CONFIG_SNAPSHOT_FILE")
+    if not path:
+        return None
+    try:
+        if _snapshot is None:
+            raise _snapshot_error or config_snapshot.SnapshotError("not_loaded")
+        payload = _snapshot
+        if payload["expires_at"] <= time.time():
+            raise config_snapshot.SnapshotError("expired")
+        if payload["env_type"] != env_type:
+            raise config_snapshot.SnapshotError(f"mode_mismatch ({payload['env_type']})")
+        if env_type != 'local_direct' and (payload["gcp_project_id"] != GCP_PROJECT_ID
+                                           or payload["secret_names"] != _secret_names()):
+            raise config_snapshot.SnapshotError("source_mismatch")
+    except (config_snapshot.SnapshotError, OSError, ValueError, KeyError, ImportError) as e:
+        logger.warning("設定のスナップショット %s を使用せず、通常の設定元から読み込みます: %s", path, e)
+        return None
+    logger.debug("設定のスナップショット %s を使用します。", path)
+    return payload["values"]
+
+def _load_config_values(env_type, use_snapshot=True):
+    """
+    env_type に応じて設定値を読み込み、AuthConfig (version 未確定) を構築します。
+    モジュールの公開状態は変更しません。
+
+    Args:
+        use_snapshot (bool): 有効なスナップショットがあれば、Secret Manager の代わりにそれを使います。
+    """
+    global GCP_PROJECT_ID
+
+    GCP_PROJECT_ID = os.environ.get('GCP_PROJECT')
+
+    logger.debug("Effective ENV_TYPE = %s, GCP_PROJECT_ID = %s", env_type, GCP_PROJECT_ID)
+
+    values = _snapshot_values(env_type) if use_snapshot else None
+    if values is None:
+        values = _read_source_values(env_type)
+    return _build_config(env_type, values)
+
+def _build_config(env_type, values):
+    """_read_source_values の形式の設定値から AuthConfig (version 未確定) を構築します。"""
+    jwt_secret_key = values.get("jwt_secret_key")
+    function_base_url = values.get("function_base_url")
 
     # REDIRECT_URI の設定
-    if FUNCTION_BASE_URL:
-        REDIRECT_URI = f"{FUNCTION_BASE_URL.rstrip('/')}/auth_callback"
+    if function_base_url:
+        redirect_uri = f"{function_base_url.rstrip('/')}/auth_callback"
     else:
-        REDIRECT_URI = None # FUNCTION_BASE_URLがない場合はNone
+        redirect_uri = None # FUNCTION_BASE_URLがない場合はNone
 
     # ALLOWED_USERS_LIST の設定
-    if allowed_users_list_str:
-        ALLOWED_USERS_LIST = [email.strip() for email in allowed_users_list_str.split(',') if email.strip()]
+    # 大規模なリスト (数万件以上) は ALLOWED_USERS_LIST_FILE で指定したファイルから1行ずつ読み込む
+    allowed_users_file = os.environ.get("ALLOWED_USERS_LIST_FILE")
+    if allowed_users_file:
+        allow_list = AllowList.from_file(allowed_users_file)
     else:
-        ALLOWED_USERS_LIST = ["your-default-test-email@example.com"] # デフォルト値またはエラー
-        print(f"警告: 許可ユーザーリスト(ALLOWED_USERS_LIST)が設定されていません。デフォルト値 '{ALLOWED_USERS_LIST}' を使用します。")
-
-    # 必須設定値のチェック
-    required_vars = {
-        "GOOGLE_CLIENT_ID": GOOGLE_CLIENT_ID,
-        "GOOGLE_CLIENT_SECRET": GOOGLE_CLIENT_SECRET,
-        "JWT_SECRET_KEY": JWT_SECRET_KEY,
-        "STREAMLIT_APP_URL": STREAMLIT_APP_URL,
-        "FUNCTION_BASE_URL": FUNCTION_BASE_URL,
-        "REDIRECT_URI": REDIRECT_URI, # FUNCTION_BASE_URLから生成されるが、これも必須
-    }
-    missing = [k for k, v in required_vars.items() if not v]
+        allow_list = AllowList.from_string(values.get("allowed_users_list"))
+    if not len(allow_list):
+        allow_list = AllowList.from_string("your-default-test-email@example.com") # デフォルト値またはエラー
+        logger.warning("許可ユーザーリスト(ALLOWED_USERS_LIST)が設定されていません。デフォルト値 '%s' を使用します。", allow_list)
+
+    # OAuth stateトークンの署名鍵 (OAUTH_STATE_SECRET 未設定時は JWT署名鍵から導出)
+    oauth_state_secret = os.environ.get("OAUTH_STATE_SECRET") or jwt_secret_key
+    oauth_state_key = derive_oauth_state_key(oauth_state_secret) if oauth_state_secret else None
+
+    current = _current_config
+    key_ring = build_key_ring(values.get("signing_keys_spec"), jwt_secret_key,
+                              reusable=current.key_ring if current is not None else None)
+
+    return AuthConfig(
+        version=0,
+        env_type=env_type,
+        gcp_project_id=GCP_PROJECT_ID,
+        google_client_id=values.get("google_client_id"),
+        google_client_secret=values.get("google_client_secret"),
+        jwt_secret_key=jwt_secret_key,
+        streamlit_app_url=values.get("streamlit_app_url"),
+        function_base_url=function_base_url,
+        redirect_uri=redirect_uri,
+        allow_list=allow_list,
+        oauth_state_key=oauth_state_key,
+        key_ring=key_ring,
+        service_api_key=values.get("service_api_key"),
+        tenant_id=None, # テナント (tenants.py) の設定は、このスナップショットを元に構築する
+        loaded_at=time.time(),
+    )
+
+def build_snapshot_payload(env_type, environ, ttl_seconds):
+    """
+    設定のスナップショット (config_snapshot.py) に書き出す内容を作成します。
+    既存のスナップショットは使わずに設定元から読み込み、必須設定値が揃っていることを確認します。
+
+    Args:
+        environ (dict): 起動時に .env の代わりに適用する環境変数 (.env の内容)。
+    """
+    global GCP_PROJECT_ID
+    GCP_PROJECT_ID = os.environ.get('GCP_PROJECT')
+    values = _read_source_values(env_type)
+    missing = _build_config(env_type, values).missing_fields()
     if missing:
-        raise ValueError(f"必須設定値が不足しています: {', '.join(missing)}。 (現在のENV_TYPE: '{ENV_TYPE}')")
+        raise ValueError(f"必須設定値が不足しています: {', '.join(missing)}。 (ENV_TYPE: '{env_type}')")
+    now = time.time()
+    return {
+        "env_type": env_type,
+        "gcp_project_id": GCP_PROJECT_ID,
+        "secret_names": _secret_names() if env_type != 'local_direct' else {},
+        "source": config_snapshot.source_fingerprint(env_type, os.environ),
+        "values": values,
+        "environ": environ,
+        "created_at": now,
+        "expires_at": now + ttl_seconds,
+    }
+
+def build_key_ring(signing_keys_spec, jwt_secret_key, reusable=None):
+    """
+    キーリングを構築します。定義が reusable (以前のスナップショットのキーリング) と同じ場合は、
+    パース済みのキーリングをそのまま再利用します (鍵のパースはキーリングのバージョンごとに1回)。
+
+    Args:
+        signing_keys_spec (str | dict | None): キーリング定義 (JSON 文字列またはパース済みの dict)。
+        jwt_secret_key (str | None): 定義がない場合に HS256 の鍵として使うシークレット。
+        reusable (KeyRing | None): 再利用できるか確認するキーリング。
+    """
+    if signing_keys_spec:
+        spec = json.loads(signing_keys_spec) if isinstance(signing_keys_spec, str) else signing_keys_spec
+    elif jwt_secret_key:
+        spec = hs256_spec(jwt_secret_key)
+    else:
+        return None
+    if reusable is not None and reusable.fingerprint == spec_fingerprint(spec):
+        return reusable
+    return KeyRing.from_spec(spec)
+
+def _build_and_publish(env_type, force_refresh=False):
+    global ENV_TYPE
+    with _config_build_lock:
+        if force_refresh and _secret_cache is not None:
+            _secret_cache.invalidate()
+        with observability.timed(observability.PHASE_CONFIG_LOAD):
+            # スナップショットは起動時 (未公開時) の読み込みにのみ使い、再読み込みでは常に設定元から読み直す
+            new_config = _load_config_values(env_type, use_snapshot=_current_config is None and not force_refresh)
+
+        # 必須設定値のチェック
+        missing = new_config.missing_fields()
+        if missing:
+            raise ValueError(f"必須設定値が不足しています: {', '.join(missing)}。 (現在のENV_TYPE: '{env_type}')")
+
+        current = _current_config
+        if new_config.same_values(current):
+            logger.debug("設定値に変更はありません (version=%s)。", current.version)
+            return current
+
+        published = _publish_config(new_config)
+        ENV_TYPE = env_type
+
+    # シークレットの値は出力しない (必須値の有無は missing_fields で確認済み)
+    logger.info(
+        "設定を公開しました (version=%s, Mode: %s)。", published.version, published.env_type,
+        extra={
+            "config_version": published.version,
+            "key_ring": str(published.key_ring),
+            "streamlit_app_url": published.streamlit_app_url,
+            "function_base_url": published.function_base_url,
+            "redirect_uri": published.redirect_uri,
+            "allowed_users_list": str(published.allow_list),
+        },
+    )
+    return published
+
+def initialize_app_configs(mode_from_arg=None):
+    """
+    設定を読み込み、スナップショットとして公開します。
+
+    既に同じモードで初期化済みの場合は何もしません (リクエスト経路から呼ばれても安価)。
+    設定を強制的に読み直す場合は reload_configs() を使用してください。
+
+    Returns:
+        AuthConfig: 公開中の設定スナップショット。
+    """
+    # mode_from_arg があれば ENV_TYPE を上書き
+    # os.environ.get("ENV_ARG") はローカル実行時の引数から来る想定
+    # os.environ.get("ENV") はCloud Functions/Runの環境変数から来る想定
+    effective_mode = (mode_from_arg or os.environ.get("ENV_ARG") or os.environ.get("ENV", "prod")).lower()
+
+    current = _current_config
+    if current is not None and (not mode_from_arg or current.env_type == effective_mode):
+        return current
+
+    with _config_build_lock:
+        # バックグラウンドのウォームアップ等が先に完了していれば、その結果を使う
+        current = _current_config
+        if current is not None and (not mode_from_arg or current.env_type == effective_mode):
+            return current
+        logger.debug("initialize_app_configs: loading (mode=%s)", effective_mode)
+        return _build_and_publish(effective_mode)
 
-    # 詳細ログ（必要に応じてコメントアウト）
-    print(f"DEBUG init_configs: GOOGLE_CLIENT_ID: {'Set' if GOOGLE_CLIENT_ID else 'Not Set'}")
-    print(f"DEBUG init_configs: GOOGLE_CLIENT_SECRET: {'Set' if GOOGLE_CLIENT_SECRET else 'Not Set'}")
-    print(f"DEBUG init_configs: JWT_SECRET_KEY: {'Set' if JWT_SECRET_KEY else 'Not Set'}")
-    print(f"DEBUG init_configs: STREAMLIT_APP_URL: {STREAMLIT_APP_URL}")
-    print(f"DEBUG init_configs: FUNCTION_BASE_URL: {FUNCTION_BASE_URL}")
-    print(f"DEBUG init_configs: REDIRECT_URI: {REDIRECT_URI}")
-    print(f"DEBUG init_configs: ALLOWED_USERS_LIST: {ALLOWED_USERS_LIST}")
+def reload_configs(force_refresh=False):
+    """
+    現在のモードで設定を読み直し、変更があれば新しいスナップショットを公開します。
+    読み込みに失敗した場合は既存のスナップショットを維持します。
 
-    _app_configs_initialized = True
-    print("DEBUG: initialize_app_configs COMPLETE")
+    Args:
+        force_refresh (bool): True の場合、シークレットキャッシュを破棄してから読み込みます。
+
+    Returns:
+        AuthConfig: 公開中の設定スナップショット (失敗時は既存のもの)。
+    """
+    current = _current_config
+    env_type = current.env_type if current is not None else ENV_TYPE
+    try:
+        return _build_and_publish(env_type, force_refresh=force_refresh)
+    except Exception as e:
+        logger.error("reload_configs: 設定の再読み込みに失敗しました。既存の設定を維持します: %s", e)
+        return current
+
+def request_config_reload():
+    """
+    管理用フック: バックグラウンドで設定の強制再読み込みを開始します。
+    シグナルハンドラなど、重い処理を直接行えない場所から呼び出せます。
+    """
+    thread = threading.Thread(target=reload_configs, kwargs={"force_refresh": True},
+                              name="config-reload", daemon=True)
+    thread.start()
+    return thread
+
+def start_config_reloader(interval_seconds=None):
+    """
+    一定間隔で設定を再読み込みするデーモンスレッドを開始します (多重起動はしません)。
+    interval_seconds 省略時は CONFIG_RELOAD_INTERVAL_SECONDS 環境変数 (未設定なら開始しない)。
+    """
+    global _config_reloader_thread
+    if interval_seconds is None:
+        interval_seconds = float(os.environ.get("CONFIG_RELOAD_INTERVAL_SECONDS", "0"))
+    if interval_seconds <= 0 or _config_reloader_thread is not None:
+        return _config_reloader_thread
+
+    def _poll():
+        while True:
+            time.sleep(interval_seconds)
+            reload_configs()
+
+    _config_reloader_thread = threading.Thread(target=_poll, name="config-reloader", daemon=True)
+    _config_reloader_thread.start()
+    logger.info("設定の定期再読み込みを開始しました (間隔: %s秒)。", interval_seconds)
+    return _config_reloader_thread
+
+def install_reload_signal_handler(signum=None):
+    """
+    指定シグナル (デフォルト SIGHUP) 受信時に設定を再読み込みするハンドラを登録します。
+    メインスレッドから呼び出す必要があります。対応していない環境では False を返します。
+    """
+    import signal
+    signum = signum if signum is not None else getattr(signal, "SIGHUP", None)
+    if signum is None:
+        return False
+    try:
+        signal.signal(signum, lambda _signum, _frame: request_config_reload())
+    except ValueError: # メインスレッド以外
+        return False
+    return True
 
 def are_configs_initialized():
     """設定が初期化されたかどうかを確認する"""
-    return _app_configs_initialized
+    return _current_config is not None
+
+def warm_up_configs_in_background():
+    """
+    設定の初期読み込みをバックグラウンドスレッドで開始します (多重起動はしません)。
+    インポートをブロックせずに、最初のリクエストまでに Secret Manager へのアクセスを済ませておくためのものです。
+    最初のリクエストがウォームアップ完了前に到着した場合は、initialize_app_configs が完了を待ちます。
+    """
+    global _config_warmup_thread
+    if _config_warmup_thread is not None or _current_config is not None:
+        return _config_warmup_thread
+
+    def _warm_up():
+        try:
+            initialize_app_configs()
+            start_config_reloader()
+        except Exception as e:
+            logger.critical("config warm-up: 設定の初期読み込みに失敗しました: %s", e)
+
+    _config_warmup_thread = threading.Thread(target=_warm_up, name="config-warmup", daemon=True)
+    _config_warmup_thread.start()
+    return _config_warmup_thread
 
 # --- モジュールロード時の初期化試行 ---
 # Cloud Functionsのような環境では、モジュールがロードされた時点で初期化が必要
 # ただし、ローカル実行時 (`if __name__ == '__main__':`) は引数でモードを指定できるため、
 # ここでの呼び出しはデフォルトのENVを参照する。
 # initialize_app_configs の中で、引数なしで呼び出された場合の ENV_TYPE の解決ロジックに依存。
-try:
-    print("DEBUG config.py: Attempting initial configuration load (module scope)...")
-    initialize_app_configs() # mode_from_argなしで呼び出し
-except Exception as e:
-    print(f"CRITICAL (config.py module scope init): 設定の初期読み込みに失敗しました: {e}")
-    # ここでエラーが発生すると、このモジュールをインポートしただけで問題が起きる可能性がある。
-    # 起動を止めるか、部分的に機能するかはアプリケーションの要件による。
-    # Cloud Functions環境では、起動失敗につながる可能性が高い。
\ No newline at end of file
+#
+# CONFIG_INIT_MODE でインポート時の挙動を選択できる (コールドスタート短縮のため既定は background):
+#   background … バックグラウンドスレッドで読み込みを開始し、インポートはすぐに戻る
+#   eager      … インポート時に同期的に読み込む (従来の挙動)
+#   lazy       … インポート時には何もしない (最初のリクエストや __main__ で初期化)
+CONFIG_INIT_MODE = os.environ.get("CONFIG_INIT_MODE", "background").lower()
+
+if CONFIG_INIT_MODE == "eager":
+    try:
+        logger.debug("Attempting initial configuration load (module scope)...")
+        initialize_app_configs() # mode_from_argなしで呼び出し
+        start_config_reloader()
+    except Exception as e:
+        logger.critical("module scope init: 設定の初期読み込みに失敗しました: %s", e)
+        # ここでエラーが発生すると、このモジュールをインポートしただけで問題が起きる可能性がある。
+        # 起動を止めるか、部分的に機能するかはアプリケーションの要件による。
+        # Cloud Functions環境では、起動失敗につながる可能性が高い。
+elif CONFIG_INIT_MODE == "background":
+    logger.debug("Starting background configuration warm-up (module scope)...")
+    warm_up_configs_in_background()
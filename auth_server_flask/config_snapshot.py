@@ -0,0 +1,191 @@
+# auth_server_flask/config_snapshot.py
+
+"""
+設定のスナップショットファイル (起動時に Secret Manager・.env を読まずに設定を復元するためのもの)。
+
+- `python main.py config --mode prod --output config.snapshot` で、設定値 (Secret Manager から取得した値) と
+  .env の内容を1つのファイルに書き出します。
+- CONFIG_SNAPSHOT_FILE を設定すると、config は起動時にこのファイルを1回読むだけで設定を公開します
+  (Secret Manager のクライアントの作成・シークレットの取得・.env の解析が不要になります)。
+- ファイルは CONFIG_SNAPSHOT_KEY から導出した鍵で AES-256-GCM により暗号化・改ざん検知されます。
+  有効期限 (CONFIG_SNAPSHOT_TTL_SECONDS) を過ぎたもの、復号できないもの、モードや参照先 (GCP プロジェクト・シークレット名、
+  local_direct では DIRECT_* の値) が現在の環境と異なるものは使わず、従来どおり .env・Secret Manager から読み込みます。
+  この確認は config のインポート時、記録した .env の内容を適用する前に行います (モードは ENV_ARG / ENV)。
+- スナップショットを使うのは起動時の最初の読み込みだけです。定期・強制の再読み込みは常に Secret Manager から行います。
+- スナップショットは数KBのため、mmap ではなく1回の read で読み込みます。
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import time
+
+CONFIG_SNAPSHOT_TTL_SECONDS = float(os.environ.get("CONFIG_SNAPSHOT_TTL_SECONDS", str(24 * 3600)))
+
+MAGIC = b"AUTHCFG1" # ファイル形式のバージョンを兼ねる (GCM の追加認証データとしても使う)
+NONCE_BYTES = 12
+
+class SnapshotError(Exception):
+    """スナップショットを使えない理由 (reason) を持つ例外。"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+# 設定値の参照先を決める環境変数 (モードごとのプレフィックス)
+SOURCE_ENV_PREFIXES = {
+    "local_direct": ("DIRECT_",),
+    "local_sm_test": ("SM_NAME_FOR_",),
+    "prod": ("SM_NAME_FOR_",),
+}
+
+def source_fingerprint(env_type, environ):
+    """設定値の参照先を決める環境変数 (SOURCE_ENV_PREFIXES) のハッシュ。作成時と起動時で同じ参照先かの確認に使います。"""
+    prefixes = SOURCE_ENV_PREFIXES.get(env_type, ())
+    items = sorted((name, value) for name, value in environ.items() if name.startswith(prefixes))
+    return hashlib.sha256(json.dumps([env_type, items], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def check_source(payload, env_type, environ):
+    """
+    スナップショットが env_type のモード・現在の参照先のものか確認します。
+    記録した .env の内容 (payload["environ"]) を適用する前に、実際の環境変数 (environ) で呼び出します。
+    GCP プロジェクトはスナップショット自身の .env の内容からは取らず、実際の環境変数と比較します。
+
+    Raises:
+        SnapshotError: モード (mode_mismatch) または参照先 (source_mismatch) が異なる場合。
+    """
+    if payload.get("env_type") != env_type:
+        raise SnapshotError(f"mode_mismatch ({payload.get('env_type')})")
+    if env_type != "local_direct" and payload.get("gcp_project_id") != environ.get("GCP_PROJECT"):
+        raise SnapshotError("source_mismatch")
+    # 適用後の環境変数 (load_dotenv と同じく、既存の環境変数を優先する) の参照先が作成時と同じか
+    if payload.get("source") != source_fingerprint(env_type, {**payload.get("environ", {}), **environ}):
+        raise SnapshotError("source_mismatch")
+
+def snapshot_key(key=None):
+    """CONFIG_SNAPSHOT_KEY (任意の長さのランダムな文字列) から AES-256 の鍵を導出します。未設定なら None。"""
+    key = key if key is not None else os.environ.get("CONFIG_SNAPSHOT_KEY")
+    if not key:
+        return None
+    return hashlib.sha256(b"auth-config-snapshot\0" + key.encode("utf-8")).digest()
+
+def generate_key():
+    return secrets.token_urlsafe(32)
+
+def encode_snapshot(payload, key):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    nonce = secrets.token_bytes(NONCE_BYTES)
+    plaintext = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return MAGIC + nonce + AESGCM(key).encrypt(nonce, plaintext, MAGIC)
+
+def decode_snapshot(data, key, now=None):
+    """
+    ファイルの内容を復号・検証し、ペイロード (dict) を返します。
+
+    Raises:
+        SnapshotError: 形式が異なる・復号できない (鍵の不一致・改ざん)・有効期限切れの場合。
+    """
+    if not data.startswith(MAGIC) or len(data) <= len(MAGIC) + NONCE_BYTES:
+        raise SnapshotError("unknown_format")
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    nonce = data[len(MAGIC):len(MAGIC) + NONCE_BYTES]
+    try:
+        payload = json.loads(AESGCM(key).decrypt(nonce, data[len(MAGIC) + NONCE_BYTES:], MAGIC))
+    except InvalidTag:
+        raise SnapshotError("invalid_key_or_tampered")
+    now = time.time() if now is None else now
+    if payload.get("expires_at", 0) <= now:
+        raise SnapshotError("expired")
+    return payload
+
+def read_snapshot(path, key=None, now=None):
+    """
+    スナップショットファイルを読み込みます。
+
+    Returns:
+        dict: ペイロード。
+    Raises:
+        SnapshotError: 鍵が未設定・ファイルがない・decode_snapshot が失敗した場合。
+    """
+    key = key if key is not None else snapshot_key()
+    if key is None:
+        raise SnapshotError("no_key")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise SnapshotError("not_found")
+    return decode_snapshot(data, key, now)
+
+def write_snapshot(path, payload, key):
+    """暗号化したスナップショットを所有者のみ読み書きできるファイルとして書き出します (置き換えはアトミック)。"""
+    data = encode_snapshot(payload, key)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+def dotenv_environ():
+    """load_dotenv() が読み込む .env の内容 (値のないキーは除く)。"""
+    from dotenv import dotenv_values, find_dotenv
+    path = find_dotenv()
+    return {name: value for name, value in dotenv_values(path).items() if value is not None} if path else {}
+
+# --- python main.py config ---
+def main(argv=None):
+    """
+    設定のスナップショットを作成・確認するサブコマンド (config をインポートする前に呼び出します)。
+
+        python main.py config --mode prod --output config.snapshot [--ttl-seconds 86400]
+        python main.py config --check config.snapshot
+        python main.py config --generate-key
+    """
+    import argparse
+    # 既存のスナップショットやインポート時の設定の読み込みは使わず、.env と設定元から読み込む (config のインポート前に行う)
+    default_output = os.environ.pop("CONFIG_SNAPSHOT_FILE", None)
+    os.environ["CONFIG_INIT_MODE"] = "lazy"
+    import config
+    parser = argparse.ArgumentParser(prog="main.py config", description=main.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=['local_direct', 'local_sm_test', 'prod'],
+                        default=os.environ.get("ENV_ARG", os.environ.get("ENV", "prod")).lower())
+    parser.add_argument("--output", default=default_output, help="書き出すファイル (既定: CONFIG_SNAPSHOT_FILE)")
+    parser.add_argument("--ttl-seconds", type=float, default=CONFIG_SNAPSHOT_TTL_SECONDS)
+    parser.add_argument("--check", metavar="FILE", help="既存のスナップショットを検証し、概要 (シークレットの値は除く) を表示する")
+    parser.add_argument("--generate-key", action="store_true", help="CONFIG_SNAPSHOT_KEY に使うランダムな鍵を表示する")
+    args = parser.parse_args(argv)
+
+    if args.generate_key:
+        print(generate_key())
+        return 0
+    key = snapshot_key()
+    if key is None:
+        print("CONFIG_SNAPSHOT_KEY が設定されていません (--generate-key で生成できます)。")
+        return 2
+    if args.check:
+        try:
+            payload = read_snapshot(args.check, key)
+        except SnapshotError as e:
+            print(f"{args.check}: 使用できません ({e.reason})")
+            return 1
+        print(json.dumps({
+            "env_type": payload["env_type"],
+            "gcp_project_id": payload["gcp_project_id"],
+            "secret_names": payload["secret_names"],
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(payload["created_at"])),
+            "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(payload["expires_at"])),
+            "dotenv_keys": sorted(payload["environ"]),
+        }, indent=2, ensure_ascii=False))
+        return 0
+    if not args.output:
+        parser.error("--output または CONFIG_SNAPSHOT_FILE を指定してください。")
+
+    payload = config.build_snapshot_payload(args.mode, dotenv_environ(), args.ttl_seconds)
+    size = write_snapshot(args.output, payload, key)
+    print(f"{args.output}: {size} bytes (mode {args.mode}, expires "
+          f"{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(payload['expires_at']))})")
+    return 0
@@ -0,0 +1,247 @@
+# auth_server_flask/google_certs.py
+
+"""
+Google の ID トークン署名証明書 (JWKS) のプロセス内キャッシュと、それを使った ID トークン検証。
+
+- 証明書レスポンスの Cache-Control: max-age に従ってキャッシュします。
+- 期限が近づくとバックグラウンドで先行して再取得します (リクエスト経路では待たない)。
+- 未知の kid (鍵のローテーション直後など) は再取得を1回にまとめ (single-flight)、
+  同時に大量のリクエストが来ても証明書の取得は1回だけです。
+- 公開鍵はパース済みのオブジェクトとして保持し、ログインごとにパースし直しません。
+- ASGI モードでは、取得をイベントループ上で行う refresh_async を使います (リクエスト経路で待たない)。
+"""
+
+import os
+import re
+import threading
+import time
+
+import jwt
+
+import google_oauth
+import observability
+
+logger = observability.get_logger(__name__)
+
+GOOGLE_CERTS_URI = os.environ.get("GOOGLE_CERTS_URI", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+CERTS_DEFAULT_MAX_AGE_SECONDS = 3600 # Cache-Control がない場合のキャッシュ期間
+CERTS_REFRESH_AHEAD_RATIO = 0.1      # 期限の何割前から先行更新するか
+CERTS_UNKNOWN_KID_MIN_INTERVAL_SECONDS = 30 # 未知の kid による再取得の最小間隔 (不正な kid の連打対策)
+ID_TOKEN_LEEWAY_SECONDS = 10
+
+_MAX_AGE_RE = re.compile(r"max-age\s*=\s*(\d+)")
+
+class UnknownKeyIdError(google_oauth.GoogleOAuthError):
+    """証明書を再取得しても ID トークンの kid が見つからない場合の例外。"""
+
+def _max_age_seconds(headers):
+    match = _MAX_AGE_RE.search(headers.get("Cache-Control", "") or "")
+    if not match:
+        return CERTS_DEFAULT_MAX_AGE_SECONDS
+    try:
+        age = int(headers.get("Age", "0"))
+    except ValueError:
+        age = 0
+    return max(0, int(match.group(1)) - age)
+
+def _fetch_jwks(url):
+    """JWKS を取得し、(jwks dict, max-age 秒) を返します。"""
+    response = google_oauth.http_request("GET", url, headers={"Accept": "application/json"})
+    if response.status_code != 200:
+        raise google_oauth.GoogleOAuthError(f"Certs endpoint returned HTTP {response.status_code}")
+    return response.json(), _max_age_seconds(response.headers)
+
+async def _fetch_jwks_async(url):
+    """_fetch_jwks の非同期版。"""
+    response = await google_oauth.async_http_request("GET", url, headers={"Accept": "application/json"})
+    if response.status_code != 200:
+        raise google_oauth.GoogleOAuthError(f"Certs endpoint returned HTTP {response.status_code}")
+    return response.json(), _max_age_seconds(response.headers)
+
+class CertCache:
+    """kid -> パース済み公開鍵 のキャッシュ。"""
+
+    def __init__(self, url=GOOGLE_CERTS_URI, fetch=_fetch_jwks, clock=time.monotonic):
+        self.url = url
+        self._fetch = fetch
+        self._clock = clock
+        self._keys = {}
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._last_fetch_at = None
+        self._generation = 0 # 取得に成功するたびに増える
+        self._fetch_lock = threading.Lock()
+        self._background_refresh = None
+        self.fetch_count = 0
+
+    def _refresh(self, seen_generation):
+        """
+        証明書を再取得します。ロック待ちの間に他のスレッドが取得済みであれば何もしません (single-flight)。
+        """
+        with self._fetch_lock:
+            if self._generation != seen_generation:
+                return
+            self.fetch_count += 1
+            self._last_fetch_at = self._clock()
+            jwks, max_age = self._fetch(self.url)
+            self._install(jwks, max_age)
+
+    async def refresh_async(self, fetch=_fetch_jwks_async):
+        """
+        証明書をイベントループ上で再取得します (取得中はロックを持たない)。
+        同じループ内の同時呼び出しをまとめるのは呼び出し側の責任です (asgi_app.py では asyncio.Lock)。
+        """
+        seen_generation = self._generation
+        self._last_fetch_at = self._clock()
+        jwks, max_age = await fetch(self.url)
+        with self._fetch_lock:
+            if self._generation != seen_generation:
+                return
+            self.fetch_count += 1
+            self._install(jwks, max_age)
+
+    def _install(self, jwks, max_age):
+        """取得した JWKS をパースして公開します (_fetch_lock を保持した状態で呼び出す)。"""
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            kid = jwk.get("kid")
+            if not kid:
+                continue
+            try:
+                keys[kid] = jwt.PyJWK(jwk, algorithm=jwk.get("alg", "RS256")).key
+            except Exception as e:
+                logger.warning("kid=%s の公開鍵を読み込めませんでした: %s", kid, e)
+        now = self._clock()
+        self._keys = keys # 参照の差し替えのみ
+        self._expires_at = now + max_age
+        self._refresh_at = now + max_age * (1 - CERTS_REFRESH_AHEAD_RATIO)
+        self._generation += 1
+        logger.info("%d keys loaded (max-age=%ss).", len(keys), max_age)
+
+    def _refresh_in_background(self):
+        thread = self._background_refresh
+        if thread is not None and thread.is_alive():
+            return
+        generation = self._generation
+
+        def _run():
+            try:
+                self._refresh(generation)
+            except Exception as e:
+                logger.warning("バックグラウンドでの証明書の更新に失敗しました: %s", e)
+
+        self._background_refresh = threading.Thread(target=_run, name="google-certs-refresh", daemon=True)
+        self._background_refresh.start()
+
+    def warm_up(self):
+        """証明書が未取得または期限切れであれば同期的に取得します。"""
+        if self._clock() >= self._expires_at:
+            self._refresh(self._generation)
+
+    def is_warm(self):
+        return bool(self._keys) and self._clock() < self._expires_at
+
+    def has_key(self, kid):
+        return kid in self._keys
+
+    def cached_key(self, kid):
+        """取得済みの公開鍵を返します (再取得はしない。未知の kid は None)。"""
+        return self._keys.get(kid)
+
+    def can_refetch_for_unknown_kid(self):
+        """未知の kid による再取得の最小間隔を過ぎているか。"""
+        last_fetch_at = self._last_fetch_at
+        return last_fetch_at is None or self._clock() - last_fetch_at >= CERTS_UNKNOWN_KID_MIN_INTERVAL_SECONDS
+
+    def seconds_until_refresh(self):
+        """先行更新を始めるべき時刻までの秒数 (既に過ぎていれば 0)。"""
+        return max(0.0, self._refresh_at - self._clock())
+
+    def get_key(self, kid):
+        """
+        kid に対応する公開鍵を返します。
+
+        Raises:
+            UnknownKeyIdError: 再取得しても kid が見つからない場合。
+        """
+        now = self._clock()
+        generation = self._generation
+        if now >= self._expires_at:
+            try:
+                self._refresh(generation)
+            except Exception as e:
+                if not self._keys:
+                    raise
+                # 取得に失敗しても、期限切れの鍵で検証を続ける (次のリクエストで再試行)
+                logger.warning("証明書の再取得に失敗したため、キャッシュ済みの鍵を使用します: %s", e)
+        elif now >= self._refresh_at:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # 未知の kid: 鍵のローテーション直後の可能性があるため、1回だけ再取得する
+        generation = self._generation
+        if self.can_refetch_for_unknown_kid():
+            self._refresh(generation)
+        else:
+            # 直前に取得済みの場合でも、同時に待っていた別スレッドの取得結果は反映されている
+            with self._fetch_lock:
+                pass
+        key = self._keys.get(kid)
+        if key is None:
+            raise UnknownKeyIdError(f"Unknown key id: {kid}")
+        return key
+
+_cert_cache = None
+_cert_cache_lock = threading.Lock()
+
+def _reinit_after_fork():
+    """フォーク後の子プロセスでは、取得済みの鍵を残したままロックを作り直します。"""
+    global _cert_cache_lock
+    _cert_cache_lock = threading.Lock()
+    if _cert_cache is not None:
+        _cert_cache._fetch_lock = threading.Lock()
+        _cert_cache._background_refresh = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+def get_cert_cache():
+    """プロセス全体で共有する CertCache を返します。"""
+    global _cert_cache
+    if _cert_cache is None:
+        with _cert_cache_lock:
+            if _cert_cache is None:
+                _cert_cache = CertCache()
+    return _cert_cache
+
+def verify_google_id_token(id_token_str, audience, cert_cache=None):
+    """
+    Google の ID トークンを検証し、クレームを返します。
+
+    Raises:
+        google_oauth.GoogleOAuthError: kid が不明、または取得に失敗した場合。
+        jwt.InvalidTokenError: 署名・有効期限・audience・issuer の検証に失敗した場合。
+    """
+    cert_cache = cert_cache or get_cert_cache()
+    header = jwt.get_unverified_header(id_token_str)
+    return decode_google_id_token(id_token_str, cert_cache.get_key(header.get("kid")), audience)
+
+def decode_google_id_token(id_token_str, key, audience):
+    """取得済みの公開鍵で Google の ID トークンを検証し、クレームを返します (ネットワークアクセスなし)。"""
+    with observability.timed(observability.PHASE_ID_TOKEN_VERIFY):
+        claims = jwt.decode(
+            id_token_str,
+            key,
+            algorithms=["RS256"],
+            audience=audience,
+            leeway=ID_TOKEN_LEEWAY_SECONDS,
+            options={"require": ["exp", "iat", "iss", "aud"]},
+        )
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise jwt.InvalidIssuerError(f"Invalid issuer: {claims.get('iss')}")
+    return claims
@@ -0,0 +1,220 @@
+# auth_server_flask/google_oauth.py
+
+"""
+Google OAuth 2.0 / OpenID Connect とのやり取りをまとめたモジュール。
+
+- プロセス全体で共有する、コネクションプール・Keep-Alive 付きの HTTP セッション
+  (トークン交換と ID トークン検証の証明書取得 (google_certs) で共用し、TLS ハンドシェイクを毎回行わない)
+- クライアントID・シークレット・リダイレクトURI の組ごとに1回だけ構築する OAuth クライアント設定 (OAuthClient)
+- 接続・読み取り・全体のタイムアウト
+- ASGI モード (asgi_app.py) 用の非同期 HTTP クライアント (httpx.AsyncClient、イベントループごとに1つ)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import observability
+
+GOOGLE_AUTH_URI = os.environ.get("GOOGLE_AUTH_URI", "https://accounts.google.com/o/oauth2/auth")
+GOOGLE_TOKEN_URI = os.environ.get("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.environ.get("GOOGLE_HTTP_CONNECT_TIMEOUT", "3.05"))
+GOOGLE_HTTP_READ_TIMEOUT = float(os.environ.get("GOOGLE_HTTP_READ_TIMEOUT", "10"))
+GOOGLE_HTTP_TOTAL_TIMEOUT = float(os.environ.get("GOOGLE_HTTP_TOTAL_TIMEOUT", "15"))
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get("GOOGLE_HTTP_POOL_SIZE", "16"))
+OAUTH_CLIENT_CACHE_SIZE = int(os.environ.get("OAUTH_CLIENT_CACHE_SIZE", "1024")) # テナント (tenants.py) ごとに1つ
+
+SCOPES = ['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile']
+
+_http_session = None
+_async_http_client = None
+_oauth_clients = OrderedDict() # (client_id, client_secret, redirect_uri) -> OAuthClient
+_lock = threading.Lock()
+
+class GoogleOAuthError(Exception):
+    """Google とのトークン交換・検証に失敗した場合の例外。"""
+
+def get_http_session():
+    """プロセス全体で共有する requests.Session を返します (初回のみ作成)。"""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GOOGLE_HTTP_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+def http_request(method, url, total_timeout=None, **kwargs):
+    """
+    共有セッションで HTTP リクエストを送信します。
+
+    接続・読み取りタイムアウトに加えて、レスポンス本文の読み取り完了までの全体タイムアウトを適用します。
+
+    Raises:
+        TimeoutError: 全体タイムアウトを超えた場合。
+        requests.RequestException: 接続・読み取りタイムアウトなどの通信エラー。
+    """
+    total_timeout = GOOGLE_HTTP_TOTAL_TIMEOUT if total_timeout is None else total_timeout
+    deadline = time.monotonic() + total_timeout
+    kwargs.setdefault("timeout", (GOOGLE_HTTP_CONNECT_TIMEOUT, GOOGLE_HTTP_READ_TIMEOUT))
+    response = get_http_session().request(method, url, stream=True, **kwargs)
+    try:
+        chunks = []
+        for chunk in response.iter_content(chunk_size=16384):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"HTTP {method} {url} exceeded total timeout of {total_timeout}s")
+        response._content = b"".join(chunks)
+    finally:
+        response.close() # 本文を読み切っているため、接続はプールに戻る
+    return response
+
+def _reinit_after_fork():
+    """フォーク後の子プロセスでは、親プロセスの接続を共有しないよう HTTP セッションを作り直させます。"""
+    global _http_session, _async_http_client, _lock
+    _http_session = None
+    _async_http_client = None
+    _lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+def get_async_http_client():
+    """
+    非同期 HTTP クライアントを返します (初回のみ作成)。イベントループ上から呼び出してください。
+    httpx は ASGI モードでのみ必要なため、ここで遅延インポートします。
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("httpx ライブラリが見つかりません。pip install httpx を実行してください。")
+        _async_http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GOOGLE_HTTP_READ_TIMEOUT, connect=GOOGLE_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=GOOGLE_HTTP_POOL_SIZE * 4,
+                                max_keepalive_connections=GOOGLE_HTTP_POOL_SIZE),
+        )
+    return _async_http_client
+
+async def close_async_http_client():
+    global _async_http_client
+    client, _async_http_client = _async_http_client, None
+    if client is not None:
+        await client.aclose()
+
+async def async_http_request(method, url, total_timeout=None, **kwargs):
+    """
+    http_request の非同期版。レスポンス本文の読み取り完了までの全体タイムアウトを適用します。
+
+    Raises:
+        TimeoutError: 全体タイムアウトを超えた場合。
+        httpx.HTTPError: 接続・読み取りタイムアウトなどの通信エラー。
+    """
+    import asyncio
+    total_timeout = GOOGLE_HTTP_TOTAL_TIMEOUT if total_timeout is None else total_timeout
+    try:
+        return await asyncio.wait_for(get_async_http_client().request(method, url, **kwargs), total_timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"HTTP {method} {url} exceeded total timeout of {total_timeout}s")
+
+class OAuthClient:
+    """
+    1つの OAuth クライアント (client_id / client_secret / redirect_uri) の構成。
+    値の組ごとに1回だけ構築し、スレッド間で共有します (不変)。
+
+    google_auth_oauthlib の Flow は認可コードやトークンをインスタンスに保持するため
+    リクエスト間で共有できません。ここでは Flow が組み立てる認可URLとトークン交換の
+    リクエストを、事前に組み立てた値と共有セッションで直接発行します。
+    """
+
+    __slots__ = ("client_id", "client_secret", "redirect_uri", "auth_uri", "token_uri", "_auth_query_prefix")
+
+    def __init__(self, client_id, client_secret, redirect_uri, auth_uri=GOOGLE_AUTH_URI, token_uri=GOOGLE_TOKEN_URI):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.auth_uri = auth_uri
+        self.token_uri = token_uri
+        self._auth_query_prefix = urlencode({
+            "response_type": "code",
+            "client_id": client_id,
+            "redirect_uri": redirect_uri,
+            "scope": " ".join(SCOPES),
+            "access_type": "online",
+            "include_granted_scopes": "true",
+            "prompt": "select_account",
+        })
+
+    def authorization_url(self, state):
+        """Google の認可エンドポイントへのURLを返します。"""
+        return f"{self.auth_uri}?{self._auth_query_prefix}&{urlencode({'state': state})}"
+
+    def exchange_code(self, code):
+        """
+        認可コードをトークンに交換します。
+
+        Returns:
+            dict: トークンレスポンス (access_token, id_token, expires_in など)。
+
+        Raises:
+            GoogleOAuthError: トークンエンドポイントがエラーを返した場合。
+        """
+        with observability.timed(observability.PHASE_TOKEN_EXCHANGE):
+            response = http_request("POST", self.token_uri, data=self._token_request_form(code),
+                                    headers={"Accept": "application/json"})
+        return self._parse_token_response(response)
+
+    async def exchange_code_async(self, code):
+        """exchange_code の非同期版 (ASGI モード用)。"""
+        with observability.timed(observability.PHASE_TOKEN_EXCHANGE):
+            response = await async_http_request("POST", self.token_uri, data=self._token_request_form(code),
+                                                headers={"Accept": "application/json"})
+        return self._parse_token_response(response)
+
+    def _token_request_form(self, code):
+        return {
+            "grant_type": "authorization_code",
+            "code": code,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "redirect_uri": self.redirect_uri,
+        }
+
+    @staticmethod
+    def _parse_token_response(response):
+        if response.status_code != 200:
+            raise GoogleOAuthError(f"Token endpoint returned HTTP {response.status_code}: {response.text[:200]}")
+        token = response.json()
+        if "id_token" not in token:
+            raise GoogleOAuthError("Token response does not contain id_token.")
+        return token
+
+    def verify_id_token(self, id_token_str):
+        """Google の ID トークンを、キャッシュ済みの証明書で検証し、クレームを返します。"""
+        import google_certs # google_certs は本モジュールに依存するため遅延インポート
+        return google_certs.verify_google_id_token(id_token_str, self.client_id)
+
+def get_oauth_client(cfg):
+    """
+    設定スナップショット (既定の設定またはテナントの設定) に対応する OAuthClient を返します。
+    クライアントID・シークレット・リダイレクトURI が変わった時だけ構築します (OAUTH_CLIENT_CACHE_SIZE 件を超えたら古いものから破棄)。
+    """
+    key = (cfg.google_client_id, cfg.google_client_secret, cfg.redirect_uri)
+    client = _oauth_clients.get(key)
+    if client is not None:
+        return client
+    client = OAuthClient(*key)
+    with _lock:
+        _oauth_clients[key] = client
+        while len(_oauth_clients) > OAUTH_CLIENT_CACHE_SIZE:
+            _oauth_clients.popitem(last=False)
+    return client
@@ -0,0 +1,123 @@
+# auth_server_flask/introspection.py
+
+"""
+下流サービス向けのトークンイントロスペクション (RFC 7662)。
+
+- 署名・iss・aud の検証結果は、トークンのダイジェストをキーとする LRU キャッシュで共有します
+  (/auth/introspect と /auth/introspect:batch の両方で使用)。各エントリは検証時の (キーリング, iss, aud) を持ち、
+  別のテナント (tenants.py) や再読み込み後の設定からの問い合わせでは使いません。
+- 有効期限・失効・許可ユーザーリストは、キャッシュヒット時も含め毎回確認します。
+- 応答をキャッシュしてよい秒数 (max-age) は、トークンの exp と INTROSPECTION_MAX_AGE_SECONDS の小さい方です。
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+import auth_utils
+
+INTROSPECTION_CACHE_SIZE = int(os.environ.get("INTROSPECTION_CACHE_SIZE", "10000"))
+# 失効・許可ユーザーリストの変更が下流に反映されるまでの最大秒数
+INTROSPECTION_MAX_AGE_SECONDS = int(os.environ.get("INTROSPECTION_MAX_AGE_SECONDS", "60"))
+
+INACTIVE = {"active": False}
+
+def _same_context(a, b):
+    # キーリングは同じ定義なら再読み込み後も同じオブジェクトが使われる (config.build_key_ring)
+    return a is not None and a[0] is b[0] and a[1:] == b[1:]
+
+class TokenIntrospector:
+    """検証済みトークンの LRU キャッシュ付きイントロスペクション (スレッドセーフ)。"""
+
+    def __init__(self, cache_size=INTROSPECTION_CACHE_SIZE, max_age_seconds=INTROSPECTION_MAX_AGE_SECONDS,
+                 clock=time.time):
+        self.cache_size = cache_size
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._cache = OrderedDict() # sha256(token) -> ((key_ring, iss, aud), payload)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def introspect(self, token, cfg, is_revoked=None):
+        """
+        トークンを検証し、(RFC 7662 形式の応答 dict, キャッシュしてよい秒数) を返します。
+
+        Args:
+            token (str): 検証するトークン。
+            cfg (config.AuthConfig): 設定スナップショット (キーリング・iss・aud・許可ユーザーリスト)。
+            is_revoked (callable, optional): jti を受け取り、失効済みなら True を返す関数。
+        """
+        now = self._clock()
+        payload = self._verified_payload(token, cfg)
+        if (payload is None
+                or payload.get("exp", 0) + auth_utils.JWT_VERIFY_LEEWAY_SECONDS <= now
+                or (is_revoked is not None and payload.get("jti") and is_revoked(payload["jti"]))
+                or not cfg.allow_list.is_allowed(payload.get("email") or payload.get("sub", ""))):
+            return INACTIVE, self.max_age_seconds
+        response = {
+            "active": True,
+            "token_type": "access_token",
+            "sub": payload.get("sub"),
+            "username": payload.get("email"),
+            "email": payload.get("email"),
+            "name": payload.get("name"),
+            "iss": payload.get("iss"),
+            "aud": payload.get("aud"),
+            "exp": payload.get("exp"),
+            "iat": payload.get("iat"),
+            "jti": payload.get("jti"),
+        }
+        return response, max(0, min(self.max_age_seconds, int(payload["exp"] - now)))
+
+    def introspect_many(self, tokens, cfg, is_revoked=None):
+        """複数のトークンを検証し、(応答のリスト, 全体としてキャッシュしてよい秒数) を返します。"""
+        results, max_age = [], self.max_age_seconds
+        for token in tokens:
+            result, token_max_age = self.introspect(token, cfg, is_revoked)
+            results.append(result)
+            max_age = min(max_age, token_max_age)
+        return results, max_age
+
+    def _verified_payload(self, token, cfg):
+        """署名・iss・aud を検証したペイロード (失敗時は None)。有効期限はここでは確認しません。"""
+        if not isinstance(token, str) or not token:
+            return None
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        context = (cfg.key_ring, cfg.function_base_url, cfg.streamlit_app_url)
+        with self._lock:
+            entry = self._cache.get(digest)
+            # 鍵・iss・aud が異なる場合は検証結果を使えない
+            if entry is not None and _same_context(entry[0], context):
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        try:
+            payload = auth_utils.verify_custom_jwt(token, cfg.key_ring, cfg.function_base_url, cfg.streamlit_app_url)
+        except (jwt.PyJWTError, ValueError): # InvalidKeyError などは InvalidTokenError ではない
+            return None
+        if self.cache_size > 0 and "exp" in payload:
+            with self._lock:
+                self._cache[digest] = (context, payload)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+_introspector = TokenIntrospector()
+
+def get_introspector():
+    """プロセス全体で共有する TokenIntrospector を返します。"""
+    return _introspector
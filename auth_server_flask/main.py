@@ -1,25 +1,102 @@
 import os # Cloud Functionsエントリーポイントで os.environ.get を使うため
-import argparse # ローカル実行時の引数パースに必要
-from flask import Flask
-import config # 相対インポートに変更
-from auth_routes import auth_bp # 作成したBlueprintをインポート
+import sys
+
+if __name__ == '__main__' and sys.argv[1:2] == ["config"]:
+    # 設定のスナップショットの作成・確認 (python main.py config --help)。アプリのインポート前に処理する
+    import config_snapshot
+    sys.exit(config_snapshot.main(sys.argv[2:]))
+if __name__ == '__main__':
+    # ローカル実行では下の __main__ が --mode のモードで同期的に初期化するため、
+    # インポート時のバックグラウンドの読み込み (ENV のモード、既定は prod) は行わない
+    os.environ["CONFIG_INIT_MODE"] = "lazy"
+    # 設定のスナップショットは config のインポート時にモードを確認してから適用するため、--mode を先に ENV_ARG で渡す
+    import argparse
+    _mode_parser = argparse.ArgumentParser(add_help=False)
+    _mode_parser.add_argument("--mode", default=os.environ.get("ENV_ARG", os.environ.get("ENV", "local_direct")))
+    os.environ["ENV_ARG"] = _mode_parser.parse_known_args()[0].mode.lower()
 
-import functions_framework
+from flask import Flask, g, jsonify
+import config # 相対インポートに変更
+import observability
+import tenants
+from auth_routes import auth_bp, well_known_bp, auth_login_route, auth_callback_route # 作成したBlueprintをインポート
 
 app = Flask(__name__)
+logger = observability.get_logger(__name__)
+
+def _functions_framework_http(func):
+    """
+    functions_framework.http デコレータを、Functions Framework から読み込まれた場合のみ適用します。
+    Cloud Functions ではランタイムが既に functions_framework をインポート済みのため追加コストはなく、
+    ローカルの Flask 実行やベンチマークでは重いインポートを省略できます。
+    (HTTP シグネチャは Functions Framework の既定値のため、デコレータがなくても動作は同じです)
+    """
+    functions_framework = sys.modules.get("functions_framework")
+    if functions_framework is None:
+        return func
+    return functions_framework.http(func)
 
 # --- Blueprintの登録 ---
 app.register_blueprint(auth_bp)
+app.register_blueprint(well_known_bp)
+# REDIRECT_URI は FUNCTION_BASE_URL + "/auth_callback" で Google に登録されているため、旧パスも同じビューで受ける
+app.add_url_rule('/auth_login', endpoint='auth_login_legacy', view_func=auth_login_route)
+app.add_url_rule('/auth_callback', endpoint='auth_callback_legacy', view_func=auth_callback_route)
+# テナント (tenants.py) ごとのパス: /t/<テナントID>/auth/..., /t/<テナントID>/.well-known/..., /t/<テナントID>/auth_callback
+_TENANT_PREFIX = f"{tenants.TENANT_PATH_PREFIX}<tenant_id>"
+app.register_blueprint(auth_bp, url_prefix=f"{_TENANT_PREFIX}/auth", name="tenant_auth")
+app.register_blueprint(well_known_bp, url_prefix=f"{_TENANT_PREFIX}/.well-known", name="tenant_well_known")
+app.add_url_rule(f"{_TENANT_PREFIX}/auth_login", endpoint='tenant_auth_login_legacy', view_func=auth_login_route)
+app.add_url_rule(f"{_TENANT_PREFIX}/auth_callback", endpoint='tenant_auth_callback_legacy', view_func=auth_callback_route)
+
+@app.url_value_preprocessor
+def _pull_tenant_id(endpoint, values):
+    # ビュー関数にはテナントIDを渡さず、auth_routes.get_request_config が g から参照する
+    if values and "tenant_id" in values:
+        g.tenant_id = values.pop("tenant_id")
+
+@app.errorhandler(tenants.UnknownTenantError)
+def _unknown_tenant(e):
+    return "Unknown tenant.", 404
+
+# --- ヘルスチェック ---
+@app.route('/healthz')
+def liveness_route():
+    """プロセスが応答できるか (liveness)。"""
+    return "ok", 200
+
+@app.route('/readyz')
+def readiness_route():
+    """
+    リクエストを受け付けられるか (readiness)。設定・シークレットの読み込みと Google の証明書の取得が
+    完了するまでは 503 を返します (ロードバランサーのヘルスチェック用)。
+    """
+    import google_certs # 証明書の取得処理は使用時に遅延インポート
+    cfg = config.get_config()
+    checks = {
+        "config": bool(cfg is not None and cfg.is_complete()),
+        "google_certs": google_certs.get_cert_cache().is_warm(),
+    }
+    ready = all(checks.values())
+    response = jsonify(status="ready" if ready else "not_ready", checks=checks)
+    response.status_code = 200 if ready else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route('/metrics')
+def metrics_route():
+    """フェーズごとの処理時間など (Prometheus のテキスト形式。値はこのプロセスのもの)。"""
+    return observability.render_metrics(), 200, {"Content-Type": observability.METRICS_CONTENT_TYPE}
 
 # --- Cloud Functionsエントリーポイント ---
-@functions_framework.http
+@_functions_framework_http
 def auth_http(request_cf):
     # Cloud Functions インスタンス起動時/リクエスト処理前に必ず設定を初期化
     # config.are_configs_initialized() は config.py で定義されている想定
     # または、より単純に毎回初期化を試みる (config.py側で重複実行を抑制する)
     # 今回は initialize_app_configs が冪等性を持つ（何度呼んでも同じ結果になる）ことを期待
     try:
-        print("DEBUG (auth_http entry): Attempting to initialize/ensure configs are initialized.")
+        logger.debug("auth_http entry: Attempting to initialize/ensure configs are initialized.")
         # Cloud Functions環境では、ENV環境変数が設定されていることを期待
         # GCP_PROJECTも環境変数から取得する
         current_env_mode = os.environ.get("ENV", "prod") # デフォルトは prod
@@ -33,25 +110,28 @@ def auth_http(request_cf):
             # return "Server configuration error: GCP_PROJECT not set.", 500
         # config.GCP_PROJECT_ID = GCP_PROJECT_ID_from_env # config.py に渡す場合
 
-        config.initialize_app_configs(mode_from_arg=current_env_mode)
+        # 初期化済みなら公開中のスナップショットを返すだけ (ネットワークアクセスなし)
+        cfg = config.initialize_app_configs(mode_from_arg=current_env_mode)
 
         # 必須設定値の再チェック (config.initialize_app_configs内でも行われるが念のため)
-        if not all([config.GOOGLE_CLIENT_ID, config.GOOGLE_CLIENT_SECRET, config.JWT_SECRET_KEY,
-                    config.STREAMLIT_APP_URL, config.FUNCTION_BASE_URL, config.REDIRECT_URI]):
-            print("CRITICAL (auth_http): Essential configurations are missing after init attempt.")
+        if cfg is None or not cfg.is_complete():
+            logger.critical("auth_http: Essential configurations are missing after init attempt.")
             return "Server configuration error: Essential configurations missing.", 500
 
     except Exception as e:
-        print(f"CRITICAL (auth_http entry): Failed to initialize configs: {e}")
+        logger.critical("auth_http entry: Failed to initialize configs: %s", e)
         # 適切なエラーレスポンスを返す
         return "Server configuration error during request processing.", 500
 
     # Flaskアプリのコンテキストでリクエストを処理
     with app.request_context(request_cf.environ):
+        # このリクエストで参照するスナップショットを固定 (テナントの設定はこれを元に auth_routes で解決する)
+        g.default_auth_config = cfg
         return app.full_dispatch_request()
 
 # --- スクリプトとして直接実行された場合の処理 (ローカル開発用) ---
 if __name__ == '__main__':
+    import argparse # ローカル実行時の引数パースに必要
     parser = argparse.ArgumentParser(description="Flask OAuth Authentication Server (Local)")
     parser.add_argument(
         "--mode",
@@ -60,35 +140,60 @@ if __name__ == '__main__':
         default=os.environ.get("ENV_ARG", os.environ.get("ENV", "local_direct")).lower(),
         help="動作モードを選択します。 (例: local_direct, local_sm_test)"
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        choices=['dev', 'prod'],
+        default=os.environ.get("SERVER", "dev").lower(),
+        help="dev: Flask の開発用サーバー / prod: gunicorn によるマルチワーカーサーバー (prod_server.py)"
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=None, help="prod のワーカー数 (省略時は CPU 数から自動決定)")
+    parser.add_argument("--threads", type=int, default=None, help="prod のワーカーごとのスレッド数")
     args = parser.parse_args()
 
     try:
-        print(f"DEBUG __main__: Initializing configs with mode: {args.mode}")
-        config.initialize_app_configs(args.mode) # ★ コメントアウトを解除し、引数を渡す
+        logger.debug("__main__: Initializing configs with mode: %s", args.mode)
+        cfg = config.initialize_app_configs(args.mode) # ★ コメントアウトを解除し、引数を渡す
     except ValueError as e:
-        print(f"設定エラーが発生しました: {e}")
+        logger.critical("設定エラーが発生しました: %s", e)
         exit(1)
     except RuntimeError as e:
-        print(f"ランタイムエラーが発生しました: {e}")
+        logger.critical("ランタイムエラーが発生しました: %s", e)
         exit(1)
     except Exception as e:
-        print(f"予期せぬ初期化エラーが発生しました: {e}")
+        logger.critical("予期せぬ初期化エラーが発生しました: %s", e, exc_info=True)
         exit(1)
 
     # 起動前チェック (configモジュールの値を使って)
-    if not all([config.GOOGLE_CLIENT_ID, config.GOOGLE_CLIENT_SECRET, config.JWT_SECRET_KEY,
-                config.STREAMLIT_APP_URL, config.FUNCTION_BASE_URL, config.REDIRECT_URI]):
-        print("エラー: Flaskアプリの起動に必要な設定が完了していません。")
-        print("       config.py の initialize_app_configs のログと、環境変数/ .env ファイルを確認してください。")
-        print(f"       Current ENV_TYPE: {config.ENV_TYPE}")
+    if cfg is None or not cfg.is_complete():
+        logger.critical("Flaskアプリの起動に必要な設定が完了していません。config.py の initialize_app_configs のログと、"
+                        "環境変数/ .env ファイルを確認してください。 (Current ENV_TYPE: %s)", config.ENV_TYPE)
         # 必要に応じて他の設定値も表示
         exit(1)
     else:
-        print(f"\n--- ローカルサーバー起動準備完了 (Flask, Mode: {config.ENV_TYPE}) ---")
-        print(f"使用するGCPプロジェクト (参考): '{config.GCP_PROJECT_ID}'")
-        print(f"関数ベースURL (FUNCTION_BASE_URL): {config.FUNCTION_BASE_URL}")
-        print(f"リダイレクトURI (REDIRECT_URI): {config.REDIRECT_URI}")
-        print(f"StreamlitアプリURL (STREAMLIT_APP_URL): {config.STREAMLIT_APP_URL}")
-        print(f"Listen on http://0.0.0.0:8080")
+        logger.info(
+            "ローカルサーバー起動準備完了 (Flask, Mode: %s, Config version: %s)", cfg.env_type, cfg.version,
+            extra={
+                "gcp_project_id": cfg.gcp_project_id,
+                "function_base_url": cfg.function_base_url,
+                "redirect_uri": cfg.redirect_uri,
+                "streamlit_app_url": cfg.streamlit_app_url,
+            },
+        )
+        if args.server == 'prod':
+            import prod_server
+            # 設定の再読み込み (SIGHUP) とワーカーの管理は gunicorn のマスタープロセスが行う
+            try:
+                prod_server.run(app, args.mode, host=args.host, port=args.port, workers=args.workers,
+                                threads=args.threads)
+            except RuntimeError as e:
+                sys.exit(f"本番サーバーを起動できません: {e}")
+            sys.exit(0)
+        # SIGHUP / 定期ポーリングによる設定の再読み込み (リクエスト経路には影響しない)
+        config.install_reload_signal_handler()
+        config.start_config_reloader()
+        logger.info("Listen on http://%s:%s", args.host, args.port)
         # ★★★ app.run() の引数を具体的に指定 ★★★
-        app.run(host='0.0.0.0', port=8080, debug=True, use_reloader=False)
\ No newline at end of file
+        app.run(host=args.host, port=args.port, debug=True, use_reloader=False)
\ No newline at end of file
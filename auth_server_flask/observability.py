@@ -0,0 +1,344 @@
+# auth_server_flask/observability.py
+
+"""
+構造化ログと、フェーズごとの処理時間の計測 (/metrics)。
+
+ログ:
+- 標準の logging を使います。各モジュールは get_logger(__name__) でロガーを取得します。
+- 出力はキュー経由 (QueueHandler + QueueListener) で専用スレッドが行い、リクエスト処理のスレッドは
+  標準出力への書き込みを待ちません。キューが一杯の場合は待たずに破棄し、件数を /metrics に出します。
+- LOG_FORMAT=json で Cloud Logging が解釈する1行 JSON (severity, message, ...) を出力します
+  (未指定時は Cloud Functions / Cloud Run 上 (K_SERVICE 環境変数あり) なら json、それ以外は text)。
+- extra= で渡した値は、JSON のフィールド (text 形式では key=value) として出力します。
+- メッセージ・フィールドに含まれるトークン (JWT・Bearer・URL の ...token= など) とシークレットはマスクします。
+  マスクと整形は出力スレッドで行います。
+
+計測:
+- timed(PHASE_...) で囲んだ区間の処理時間をフェーズごとのヒストグラムに記録し、
+  render_metrics() で Prometheus のテキスト形式に出力します (main.py の /metrics)。
+- 値はプロセスごとに集計します (prod_server.py のマルチワーカー構成ではワーカーごとの値)。
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json" if os.environ.get("K_SERVICE") else "text").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000")) # 出力待ちの上限 (超えた分は破棄)
+
+ROOT_LOGGER_NAME = "auth_server"
+
+# --- 計測するフェーズ ---
+PHASE_CONFIG_LOAD = "config_load"
+PHASE_SECRET_FETCH = "secret_manager_fetch"
+PHASE_TOKEN_EXCHANGE = "google_token_exchange"
+PHASE_ID_TOKEN_VERIFY = "id_token_verification"
+PHASE_ALLOW_LIST = "allow_list_check"
+PHASE_JWT_SIGN = "jwt_signing"
+
+# --- マスク ---
+REDACTED = "[REDACTED]"
+_JWT_RE = re.compile(r"eyJ[\w-]*\.[\w-]*\.[\w-]*") # JWT (Google の ID トークンを含む)
+_BEARER_RE = re.compile(r"(?i)(bearer\s+)[^\s,;\"']+")
+_KEY_VALUE_RE = re.compile(r"([\w-]+)=([^&\s,;\"']+)") # URL のクエリ・フォームなど
+_SENSITIVE_KEY_RE = re.compile(r"(?i)(?:token|secret|password|code|key)$") # auth_token=, client_secret= など
+# extra= のフィールド名がこれに一致する場合は値全体をマスクする
+_SENSITIVE_FIELD_RE = re.compile(r"(?i)token|secret|password|authorization|api_key|cookie")
+
+def _redact_key_value(match):
+    return f"{match.group(1)}={REDACTED}" if _SENSITIVE_KEY_RE.search(match.group(1)) else match.group(0)
+
+def redact(text):
+    """文字列に含まれるトークン・シークレットらしい値をマスクします。"""
+    # 正規表現は該当しそうな文字列を含む場合だけ適用する (ほとんどのメッセージは部分文字列の確認だけで済む)
+    if "eyJ" in text:
+        text = _JWT_RE.sub(REDACTED, text)
+    if "earer" in text or "EARER" in text:
+        text = _BEARER_RE.sub(r"\1" + REDACTED, text)
+    if "=" in text:
+        text = _KEY_VALUE_RE.sub(_redact_key_value, text)
+    return text
+
+# --- 整形 ---
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+def _extra_fields(record):
+    extra_keys = record.__dict__.keys() - _RESERVED_ATTRS
+    fields = {}
+    if not extra_keys:
+        return fields
+    for key, value in record.__dict__.items(): # extra= で渡した順に出力する
+        if key not in extra_keys or key.startswith("_"):
+            continue
+        if _SENSITIVE_FIELD_RE.search(key):
+            value = REDACTED
+        elif isinstance(value, str):
+            value = redact(value)
+        fields[key] = value
+    return fields
+
+def _message_with_exception(formatter, record):
+    message = record.getMessage()
+    if record.exc_info and not record.exc_text:
+        record.exc_text = formatter.formatException(record.exc_info)
+    if record.exc_text:
+        message = f"{message}\n{record.exc_text}"
+    return redact(message)
+
+class JsonFormatter(logging.Formatter):
+    """Cloud Logging の構造化ログ (1行 JSON) 形式。"""
+
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "message": _message_with_exception(self, record),
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "logger": record.name,
+        }
+        if record.levelno >= logging.ERROR:
+            entry["logging.googleapis.com/sourceLocation"] = {
+                "file": record.pathname, "line": record.lineno, "function": record.funcName,
+            }
+        entry.update(_extra_fields(record))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """ローカル実行向けの1行テキスト形式 (時刻 レベル ロガー名: メッセージ key=value ...)。"""
+
+    def format(self, record):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        text = f"{timestamp} {record.levelname} {record.name}: {_message_with_exception(self, record)}"
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+# --- 出力 ---
+_dropped_log_records = 0 # キューが一杯で破棄したログの件数 (概数)
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯のときは待たずに破棄するハンドラ。マスク・整形は出力スレッドで行います。"""
+
+    def prepare(self, record):
+        # 引数の埋め込みと例外の文字列化だけは、呼び出し元の状態が変わる前にここで行う
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped_log_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_log_records += 1
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # キューが一杯でも、出力スレッドが追いつくまで (最大1秒) 待ってから終了の合図を積む
+        self.queue.put(self._sentinel, timeout=1.0)
+
+class _StdoutHandler(logging.StreamHandler):
+    """書き込み時点の sys.stdout に出力するハンドラ (contextlib.redirect_stdout などに追従)。"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+_listener = None
+_logging_settings = None
+
+def configure_logging(level=None, fmt=None):
+    """
+    auth_server 配下のロガーの出力を設定します。インポート時に LOG_LEVEL / LOG_FORMAT で1回実行されます。
+    再度呼び出すと、出力スレッドを作り直して設定を差し替えます。
+
+    Args:
+        level (str, optional): ログレベル (DEBUG, INFO, WARNING, ...)。
+        fmt (str, optional): "json" または "text"。
+    """
+    global _listener, _logging_settings
+    level = (level or LOG_LEVEL).upper()
+    fmt = (fmt or LOG_FORMAT).lower()
+    _stop_listener()
+
+    output = _StdoutHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = _QueueListener(log_queue, output)
+    _listener.start()
+
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_NonBlockingQueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    _logging_settings = (level, fmt)
+
+def _stop_listener():
+    """出力待ちのログを書き出してから出力スレッドを止めます。"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    try:
+        listener.stop()
+    except queue.Full:
+        pass # 出力が詰まったままの場合は待たない (残りは破棄される)
+
+def _reinit_after_fork():
+    """フォーク後の子プロセスには出力スレッドがないため、同じ設定で作り直します。"""
+    global _listener
+    if _logging_settings is not None:
+        _listener = None # 親プロセスのスレッドは子プロセスには存在しない
+        configure_logging(*_logging_settings)
+
+def get_logger(name):
+    """auth_server 配下のロガーを返します (例: get_logger(__name__) -> auth_server.config)。"""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+# --- 計測 ---
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Series:
+    __slots__ = ("counts", "total")
+
+    def __init__(self, size):
+        self.counts = [0] * size # バケットごとの件数 (累積ではない。最後は +Inf)
+        self.total = 0.0
+
+class Histogram:
+    """ラベル値ごとのヒストグラム (Prometheus の histogram 型)。observe はスレッドセーフです。"""
+
+    def __init__(self, name, documentation, label_name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value) # value <= buckets[index] となる最初のバケット
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = _Series(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.total += value
+
+    def snapshot(self):
+        """ラベル値 -> (件数, 合計秒数) を返します。"""
+        with self._lock:
+            return {label: (sum(series.counts), series.total) for label, series in self._series.items()}
+
+    def render(self):
+        """Prometheus のテキスト形式の行のリストを返します。"""
+        with self._lock:
+            series_list = [(label, list(series.counts), series.total) for label, series in sorted(self._series.items())]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for label, counts, total in series_list:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label_name}="{label}"}} {total!r}')
+            lines.append(f'{self.name}_count{{{self.label_name}="{label}"}} {cumulative}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class Counter:
+    """ラベル値ごとのカウンター (Prometheus の counter 型)。inc はスレッドセーフです。"""
+
+    def __init__(self, name, documentation, label_name):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def snapshot(self):
+        """ラベル値 -> 値 を返します。"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label, value in sorted(self.snapshot().items()):
+            lines.append(f'{self.name}{{{self.label_name}="{label}"}} {value}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+PHASE_DURATION = Histogram(
+    "auth_phase_duration_seconds",
+    "Time spent in each phase of the login flow and its dependencies.",
+    "phase",
+)
+
+RATE_LIMITED = Counter(
+    "auth_rate_limited_total",
+    "Requests rejected by the rate limiter (ratelimit.py).",
+    "scope",
+)
+
+class _PhaseTimer:
+    __slots__ = ("phase", "_started")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        PHASE_DURATION.observe(self.phase, time.perf_counter() - self._started)
+        return False
+
+def timed(phase):
+    """with timed(PHASE_JWT_SIGN): ... で囲んだ区間の処理時間を記録します (例外で抜けた場合も記録)。"""
+    return _PhaseTimer(phase)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render_metrics():
+    """/metrics の本文 (Prometheus のテキスト形式) を返します。"""
+    lines = PHASE_DURATION.render() + RATE_LIMITED.render()
+    lines += [
+        "# HELP auth_log_records_dropped_total Log records dropped because the log queue was full.",
+        "# TYPE auth_log_records_dropped_total counter",
+        f"auth_log_records_dropped_total {_dropped_log_records}",
+    ]
+    return "\n".join(lines) + "\n"
+
+configure_logging()
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
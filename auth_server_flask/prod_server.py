@@ -0,0 +1,159 @@
+# auth_server_flask/prod_server.py
+
+"""
+VM・ローカル環境向けの本番用サーバー (gunicorn によるプリフォーク型のマルチワーカー)。
+
+- 設定 (シークレット)・署名鍵・Google の証明書をフォーク前にマスタープロセスで読み込み、
+  ワーカーはそれをコピーオンライトで共有します (gc.freeze で参照カウントの更新によるページのコピーを抑える)。
+- ワーカー数は CPU 数から自動で決めます (WEB_CONCURRENCY 環境変数・--workers で上書き可能)。
+- SIGHUP で設定を読み直してから新しいワーカーを起動し、古いワーカーは処理中のリクエストを終えてから終了します
+  (待ち受けソケットはマスターが保持し続けるため、接続は切断されません)。
+- 準備状態は /readyz で確認できます (main.py)。
+- ワーカーはメモリを共有しないため、複数ワーカーの場合は全ワーカーで共有が必要な次のストアを、
+  未設定なら状態ディレクトリ (PROD_SERVER_STATE_DIR、既定は一時ディレクトリ下のユーザー・ポートごとのディレクトリ) の
+  ファイルにします。プロセス内のストアが明示的に設定されている場合は起動しません。
+    リフレッシュトークン (REFRESH_TOKEN_DB): ほかのワーカーが発行したトークンで /auth/refresh できるように
+    失効リスト (REVOCATION_FILE): ほかのワーカーで失効させたトークンを拒否するように
+    レート制限 (RATE_LIMIT_DB): 実効値が ワーカー数 × 設定値 にならないように
+
+    python main.py --mode prod --server prod [--workers 4] [--threads 8] [--port 8080]
+"""
+
+import gc
+import os
+import tempfile
+
+import config
+import google_certs
+import observability
+import ratelimit
+import refresh_tokens
+import revocation
+
+logger = observability.get_logger(__name__)
+
+PROD_SERVER_THREADS = int(os.environ.get("PROD_SERVER_THREADS", "8")) # ワーカーごとのスレッド数 (外部通信待ちの並行処理用)
+PROD_SERVER_TIMEOUT_SECONDS = int(os.environ.get("PROD_SERVER_TIMEOUT_SECONDS", "30"))
+PROD_SERVER_GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get("PROD_SERVER_GRACEFUL_TIMEOUT_SECONDS", "30"))
+PROD_SERVER_STATE_DIR = os.environ.get("PROD_SERVER_STATE_DIR") # ワーカー間で共有するストアのファイルの保存先
+
+def default_worker_count():
+    """WEB_CONCURRENCY、なければ 2 × 利用可能な CPU 数 + 1。"""
+    if os.environ.get("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    try:
+        cpus = len(os.sched_getaffinity(0)) # コンテナ・taskset で制限された CPU 数
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return 2 * cpus + 1
+
+def warm_up(mode):
+    """設定 (シークレット・署名鍵) と Google の証明書を読み込みます。証明書の取得失敗は起動を妨げません。"""
+    cfg = config.initialize_app_configs(mode)
+    try:
+        google_certs.get_cert_cache().warm_up()
+    except Exception as e:
+        logger.warning("Google の証明書を事前に取得できませんでした (最初のログイン時に再試行します): %s", e)
+    return cfg
+
+def shared_state_dir(port):
+    """
+    ワーカー間で共有するストアのファイルを置くディレクトリを返します (なければ作成)。
+    ほかのユーザーが書き込めるとリフレッシュトークンを偽造できるため、所有者のみがアクセスできることを確認します。
+
+    Raises:
+        RuntimeError: 所有者が異なる、またはほかのユーザーがアクセスできる場合。
+    """
+    path = PROD_SERVER_STATE_DIR or os.path.join(tempfile.gettempdir(), f"auth-server-{os.getuid()}-{port}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"状態ディレクトリ {path} は所有者以外もアクセスできるため使用できません (chmod 700 してください)。")
+    return path
+
+# (名前, 未設定時に state_dir のファイルを使う関数, ファイル名, 共有のストアを使う設定かを返す関数)
+_SHARED_STORES = (
+    ("リフレッシュトークン (REFRESH_TOKEN_DB)", refresh_tokens.set_default_database, "refresh_tokens.db",
+     refresh_tokens.has_shared_store),
+    ("失効リスト (REVOCATION_FILE)", revocation.set_default_file, "revoked.jsonl", revocation.has_shared_backend),
+    ("レート制限 (RATE_LIMIT_DB)", ratelimit.set_default_database, "rate_limit.db", ratelimit.has_shared_backend),
+)
+
+def use_shared_stores(state_dir):
+    """
+    ワーカー間で共有が必要なストアが未設定なら、state_dir のファイルを使うようにします
+    (接続・同期スレッドはフォーク後の各ワーカーで作成)。
+
+    Raises:
+        RuntimeError: プロセス内のストアが明示的に設定されていて、ワーカー間で共有できない場合。
+    """
+    for name, set_default, filename, _ in _SHARED_STORES:
+        path = os.path.join(state_dir, filename)
+        if set_default(path):
+            logger.info("%s として %s を使用します。", name, path)
+    unshared = [name for name, _, _, is_shared in _SHARED_STORES if not is_shared()]
+    if unshared:
+        raise RuntimeError(f"複数ワーカーではワーカー間で共有するストアが必要です: {', '.join(unshared)}")
+
+def _freeze_shared_objects():
+    # ここまでに作成したオブジェクトを GC の対象外にし、ワーカーでのページのコピーを減らす
+    gc.collect()
+    gc.freeze()
+
+def run(app, mode, host="0.0.0.0", port=8080, workers=None, threads=None):
+    """
+    gunicorn で app (main.py の Flask アプリ) を起動します (戻らない)。
+    app は呼び出し元から受け取ります (python main.py で起動した場合に main を別モジュールとして読み込み直さない)。
+
+    Raises:
+        RuntimeError: gunicorn がない、または複数ワーカーで共有するストアを用意できない場合。
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("gunicorn ライブラリが見つかりません。pip install gunicorn を実行してください。")
+
+    def on_reload(arbiter):
+        # 新しいワーカーの起動前にマスターで読み直す (失敗した場合は既存の設定を維持)
+        logger.info("SIGHUP を受信しました。設定を再読み込みします。")
+        config.reload_configs(force_refresh=True)
+        try:
+            google_certs.get_cert_cache().warm_up()
+        except Exception as e:
+            logger.warning("Google の証明書を取得できませんでした: %s", e)
+        _freeze_shared_objects()
+
+    def post_fork(arbiter, worker):
+        config.start_config_reloader() # CONFIG_RELOAD_INTERVAL_SECONDS 指定時のみ
+
+    workers = workers or default_worker_count()
+    if workers > 1:
+        use_shared_stores(shared_state_dir(port))
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": threads or PROD_SERVER_THREADS,
+        "preload_app": True,
+        "timeout": PROD_SERVER_TIMEOUT_SECONDS,
+        "graceful_timeout": PROD_SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        "keepalive": 5,
+        "on_reload": on_reload,
+        "post_fork": post_fork,
+    }
+
+    class AuthServerApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # preload_app のため、マスターでフォーク前に1回だけ呼ばれる
+            warm_up(mode)
+            _freeze_shared_objects()
+            return app
+
+    logger.info("本番サーバー起動 (gunicorn, Mode: %s, workers: %s, threads: %s)",
+                mode, options["workers"], options["threads"])
+    AuthServerApplication().run()
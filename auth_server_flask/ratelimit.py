@@ -0,0 +1,253 @@
+# auth_server_flask/ratelimit.py
+
+"""
+/auth/login, /auth/callback のレート制限 (プロセス内のトークンバケット)。
+
+- バケットはクライアントIP ごと (SCOPE_IP) と OAuth クライアントごと (SCOPE_CLIENT) に持ちます。
+  OAuth クライアントのバケットは、Google へのトークン交換・Secret Manager の読み込みがクォータを超えないための全体の上限です。
+- トークンバケットは GCRA (理論到着時刻を1つの浮動小数点数で持つ同等の方式) で、固定サイズの配列に格納します。
+  キーが増えてもメモリは table_size に比例した量から増えず、溢れた分は CLOCK 方式 (LRU の近似) で追い出します。
+- 既存のキーの判定はロックを取りません (配列要素の読み書きのみ)。同時に判定された場合は並行数分だけ多く許可することがあります。
+- インスタンス間で共有する場合は set_rate_limit_backend でバックエンド (InMemoryRateLimitBackend と同じ acquire を持つ実装) を設定します。
+  プロセス内のバケットで許可された場合のみバックエンドに問い合わせ、バックエンドの障害時は制限しません (ログインを止めない)。
+- gunicorn のワーカーごとにバケットは別になるため、共有バックエンドがない場合の実効値は ワーカー数 × 設定値 です。
+  RATE_LIMIT_DB を指定すると SQLite ファイル (SQLiteRateLimitBackend) を同一ホストのプロセス間の共有バックエンドにします
+  (prod_server.py は複数ワーカーの場合、未設定なら状態ディレクトリのファイルを使います)。
+"""
+
+import ipaddress
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+import observability
+
+logger = observability.get_logger(__name__)
+
+# 0 でその種類の制限を無効化
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", "120"))
+RATE_LIMIT_IP_BURST = int(os.environ.get("RATE_LIMIT_IP_BURST", "40"))
+RATE_LIMIT_CLIENT_PER_SECOND = float(os.environ.get("RATE_LIMIT_CLIENT_PER_SECOND", "50"))
+RATE_LIMIT_CLIENT_BURST = int(os.environ.get("RATE_LIMIT_CLIENT_BURST", "200"))
+RATE_LIMIT_TABLE_SIZE = int(os.environ.get("RATE_LIMIT_TABLE_SIZE", "65536")) # IP ごとのバケットの最大数
+# X-Forwarded-For を付与する信頼済みのプロキシの段数 (Cloud Run / Cloud Functions では Google のフロントエンドが1段)
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "1" if os.environ.get("K_SERVICE") else "0"))
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB") # 指定時は SQLite ファイルを共有バックエンドにする
+RATE_LIMIT_DB_PRUNE_INTERVAL_SECONDS = 60
+
+SCOPE_IP = "ip"
+SCOPE_CLIENT = "client"
+
+RateLimit = namedtuple("RateLimit", ["rate", "burst", "table_size"]) # rate: 1秒あたりの回数
+
+class TokenBucketTable:
+    """
+    キーごとのトークンバケット (GCRA) を固定サイズの配列で持つテーブル。
+
+    _tat[slot] はバケットが満杯に戻る時刻 (理論到着時刻) で、now 以下ならバケットは満杯です。
+    満杯のバケットは新規のキーと区別できないため、追い出しでは満杯のものを優先し、情報を失いません。
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._slots = {} # key -> slot
+        self._keys = [None] * self.size
+        self._tat = array("d", bytes(8 * self.size))
+        self._referenced = bytearray(self.size)
+        self._hand = 0
+        self._insert_lock = threading.Lock()
+
+    def acquire(self, key, rate, burst, now):
+        """key のトークンを1つ消費します。許可なら 0.0、拒否なら消費できるようになるまでの秒数を返します。"""
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._insert(key, now)
+        interval = 1.0 / rate
+        tat = self._tat[slot]
+        if tat < now:
+            tat = now
+        self._referenced[slot] = 1
+        wait = tat + interval - burst * interval - now
+        if wait > 0:
+            return wait
+        self._tat[slot] = tat + interval
+        return 0.0
+
+    def _insert(self, key, now):
+        with self._insert_lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                return slot
+            if len(self._slots) < self.size:
+                slot = len(self._slots)
+            else:
+                # 最近参照された (かつ満杯でない) スロットは参照ビットを落として1周だけ見逃す
+                hand, referenced, tats, size = self._hand, self._referenced, self._tat, self.size
+                while referenced[hand] and tats[hand] > now:
+                    referenced[hand] = 0
+                    hand = (hand + 1) % size
+                slot = hand
+                self._hand = (hand + 1) % size
+                self._slots.pop(self._keys[slot], None)
+            self._keys[slot] = key
+            self._tat[slot] = 0.0
+            self._referenced[slot] = 0
+            self._slots[key] = slot
+            return slot
+
+    def __len__(self):
+        return len(self._slots)
+
+# --- インスタンス間で共有するバックエンド ---
+class InMemoryRateLimitBackend:
+    """
+    共有バックエンドのローカル代替 (テスト・単一インスタンス用)。
+    共有ストア (Redis など) による実装も同じ acquire(key, rate, burst) を持ち、キーごとに不可分に更新します。
+    """
+
+    def __init__(self, table_size=RATE_LIMIT_TABLE_SIZE, clock=time.time):
+        self._table = TokenBucketTable(table_size)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst):
+        """許可なら 0.0、拒否なら再試行までの秒数を返します。"""
+        with self._lock:
+            return self._table.acquire(key, rate, burst, self._clock())
+
+class SQLiteRateLimitBackend:
+    """
+    SQLite ファイルによる共有バックエンド。同じファイルを共有するプロセス間 (gunicorn のワーカーなど) で使えます。
+    キーごとの理論到着時刻を1行で持ち、満杯に戻った (情報のない) 行は定期的に削除します。
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL") # 障害時に直前の消費が失われても制限が緩むだけ
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def acquire(self, key, rate, burst):
+        """許可なら 0.0、拒否なら再試行までの秒数を返します (TokenBucketTable.acquire と同じ計算)。"""
+        now = self._clock()
+        interval = 1.0 / rate
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE") # 読み取りから更新までほかのプロセスを待たせる
+            try:
+                row = conn.execute("SELECT tat FROM rate_limit WHERE key = ?", (key,)).fetchone()
+                tat = max(row[0], now) if row else now
+                wait = tat + interval - burst * interval - now
+                if wait <= 0:
+                    conn.execute("INSERT OR REPLACE INTO rate_limit (key, tat) VALUES (?, ?)", (key, tat + interval))
+                    wait = 0.0
+                if now >= self._next_prune:
+                    self._next_prune = now + RATE_LIMIT_DB_PRUNE_INTERVAL_SECONDS
+                    conn.execute("DELETE FROM rate_limit WHERE tat <= ?", (now,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+class RateLimiter:
+    """スコープ (SCOPE_IP / SCOPE_CLIENT) ごとのテーブルと共有バックエンドをまとめたもの。"""
+
+    def __init__(self, limits, backend=None, clock=time.monotonic):
+        self.limits = {scope: limit for scope, limit in limits.items() if limit.rate > 0}
+        self.backend = backend
+        self._clock = clock
+        self._tables = {scope: TokenBucketTable(limit.table_size) for scope, limit in self.limits.items()}
+
+    def retry_after(self, scope, key):
+        """scope・key のトークンを1つ消費します。許可なら 0.0、拒否なら再試行までの秒数を返します。"""
+        limit = self.limits.get(scope)
+        if limit is None or not key:
+            return 0.0
+        wait = self._tables[scope].acquire(key, limit.rate, limit.burst, self._clock())
+        if not wait and self.backend is not None:
+            try:
+                wait = self.backend.acquire(f"{scope}:{key}", limit.rate, limit.burst)
+            except Exception as e:
+                logger.warning("レート制限のバックエンドに問い合わせできませんでした (制限せずに続行します): %s", e)
+                wait = 0.0
+        if wait:
+            observability.RATE_LIMITED.inc(scope)
+        return wait
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=None):
+    """
+    レート制限に使うクライアントのIPアドレスを返します。
+
+    信頼済みのプロキシが trusted_proxies 段ある場合は X-Forwarded-For の右から trusted_proxies 番目を使います
+    (それより左はクライアントが自由に書けるため使わない)。IPv6 は /64 単位にまとめます。
+    """
+    trusted_proxies = RATE_LIMIT_TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    ip = remote_addr
+    if trusted_proxies > 0 and forwarded_for:
+        hops = forwarded_for.split(",")
+        if len(hops) >= trusted_proxies:
+            ip = hops[-trusted_proxies].strip()
+    if ip and ":" in ip:
+        try:
+            ip = str(ipaddress.IPv6Network(f"{ip}/64", strict=False).network_address)
+        except ValueError:
+            pass
+    return ip
+
+def retry_after_header(wait):
+    """Retry-After ヘッダーの値 (整数の秒数、最小1)。"""
+    return str(max(1, math.ceil(wait)))
+
+def default_limits():
+    return {
+        SCOPE_IP: RateLimit(RATE_LIMIT_IP_PER_MINUTE / 60, max(1, RATE_LIMIT_IP_BURST), RATE_LIMIT_TABLE_SIZE),
+        SCOPE_CLIENT: RateLimit(RATE_LIMIT_CLIENT_PER_SECOND, max(1, RATE_LIMIT_CLIENT_BURST), 1024),
+    }
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def set_rate_limit_backend(backend):
+    """共有バックエンドを設定します (None でプロセス内のみ)。プロセス内のバケットは作り直されます。"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = RateLimiter(default_limits(), backend=backend)
+
+def set_default_database(path):
+    """
+    共有バックエンドが未設定 (RATE_LIMIT_DB なし・set_rate_limit_backend 未使用) の場合に、path の SQLite ファイルを使うようにします。
+    接続は初回の使用時に作るため、フォーク前のマスタープロセスで呼び出せます。適用した場合は True を返します。
+    """
+    global RATE_LIMIT_DB
+    with _rate_limiter_lock:
+        if RATE_LIMIT_DB or _rate_limiter is not None:
+            return False
+        RATE_LIMIT_DB = path
+        return True
+
+def has_shared_backend():
+    """プロセス間で共有するバックエンド (InMemoryRateLimitBackend 以外) を使う設定か。"""
+    limiter = _rate_limiter
+    if limiter is not None:
+        return limiter.backend is not None and not isinstance(limiter.backend, InMemoryRateLimitBackend)
+    return bool(RATE_LIMIT_DB)
+
+def get_rate_limiter():
+    """プロセス全体で共有する RateLimiter を返します (初回に作成)。"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                backend = SQLiteRateLimitBackend(RATE_LIMIT_DB) if RATE_LIMIT_DB else None
+                _rate_limiter = RateLimiter(default_limits(), backend=backend)
+    return _rate_limiter
@@ -0,0 +1,281 @@
+# auth_server_flask/refresh_tokens.py
+
+"""
+リフレッシュトークン (長期間有効・使い捨て・ローテーション方式) の管理。
+
+- リフレッシュトークンは不透明なランダム文字列で、ストアには SHA-256 ハッシュのみを保存します。
+- /auth/refresh で使うたびに新しいトークンと交換し (ローテーション)、古いトークンは使用済みになります。
+- 使用済みのトークンが再度提示された場合は漏洩とみなし、同じログインから派生したトークン (ファミリー) をすべて無効にします。
+- 有効期限は使うたびに延長されますが (スライディング)、ログイン時点からの上限 (REFRESH_TOKEN_MAX_LIFETIME_SECONDS) は超えません。
+- ストアは差し替え可能です (InMemoryRefreshTokenStore / SQLiteRefreshTokenStore、または同じインターフェースの実装)。
+- テナント (tenants.py) のトークンは namespace (テナントID) を含めてハッシュするため、別のテナントでは使えません。
+- ログイン直後のリダイレクトには、リフレッシュトークンの代わりに短時間だけ有効な使い捨てのログインコードを付けます。
+  アプリはそれをバックエンドから /auth/refresh (grant_type=authorization_code) でトークンと交換します。
+- ストアは全プロセス・インスタンスで共有する必要があります。REFRESH_TOKEN_DB が未設定の場合、
+  Cloud Functions / Cloud Run (K_SERVICE 環境変数あり) ではリフレッシュトークンを発行しません
+  (単一インスタンスの構成では REFRESH_TOKEN_ALLOW_IN_MEMORY=1 でプロセス内のストアを使えます)。
+  prod_server.py は複数ワーカーの場合、未設定なら共有の SQLite ファイルを使います。
+"""
+
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import observability
+
+logger = observability.get_logger(__name__)
+
+REFRESH_TOKEN_TTL_SECONDS = float(os.environ.get("REFRESH_TOKEN_TTL_SECONDS", str(7 * 24 * 3600)))
+REFRESH_TOKEN_MAX_LIFETIME_SECONDS = float(os.environ.get("REFRESH_TOKEN_MAX_LIFETIME_SECONDS", str(30 * 24 * 3600)))
+REFRESH_TOKEN_DB = os.environ.get("REFRESH_TOKEN_DB") # 未設定ならプロセス内のみ (InMemoryRefreshTokenStore)
+# REFRESH_TOKEN_DB なしでプロセス内のストアを使うか (マルチインスタンスの Cloud Functions / Cloud Run では既定で使わない)
+REFRESH_TOKEN_ALLOW_IN_MEMORY = os.environ.get(
+    "REFRESH_TOKEN_ALLOW_IN_MEMORY", "0" if os.environ.get("K_SERVICE") else "1") == "1"
+LOGIN_CODE_TTL_SECONDS = float(os.environ.get("LOGIN_CODE_TTL_SECONDS", "120")) # ログインコードの有効期間
+
+class RefreshTokenError(Exception):
+    """リフレッシュトークンが使用できない場合の例外。reason は "invalid" / "expired" / "reused"。"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+class RefreshTokenRecord:
+    """ストアに保存する1トークン分の情報。"""
+
+    __slots__ = ("token_hash", "family_id", "email", "name", "expires_at", "family_expires_at", "used")
+
+    def __init__(self, token_hash, family_id, email, name, expires_at, family_expires_at, used=False):
+        self.token_hash = token_hash
+        self.family_id = family_id
+        self.email = email
+        self.name = name
+        self.expires_at = expires_at
+        self.family_expires_at = family_expires_at
+        self.used = used
+
+def hash_refresh_token(token, namespace=None):
+    if namespace:
+        token = f"{namespace}\0{token}"
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+# --- ストア ---
+class InMemoryRefreshTokenStore:
+    """プロセス内だけで保持するストア (テスト・単一インスタンス用のローカル代替)。"""
+
+    def __init__(self):
+        self._records = {}  # token_hash -> RefreshTokenRecord
+        self._families = {} # family_id -> set(token_hash)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._records[record.token_hash] = record
+            self._families.setdefault(record.family_id, set()).add(record.token_hash)
+
+    def get(self, token_hash):
+        return self._records.get(token_hash)
+
+    def mark_used(self, token_hash):
+        """未使用のトークンを使用済みにします。既に使用済み (または存在しない) 場合は False を返します。"""
+        with self._lock:
+            record = self._records.get(token_hash)
+            if record is None or record.used:
+                return False
+            record.used = True
+            return True
+
+    def revoke_family(self, family_id):
+        with self._lock:
+            for token_hash in self._families.pop(family_id, ()):
+                self._records.pop(token_hash, None)
+
+    def prune(self, now):
+        """期限切れのトークンを削除します。"""
+        with self._lock:
+            expired = [r for r in self._records.values() if r.expires_at <= now]
+            for record in expired:
+                del self._records[record.token_hash]
+                family = self._families.get(record.family_id)
+                if family is not None:
+                    family.discard(record.token_hash)
+                    if not family:
+                        del self._families[record.family_id]
+
+class SQLiteRefreshTokenStore:
+    """SQLite ファイルによるストア。同じファイルを共有するプロセス間 (ローカル・単一VM) で使えます。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS refresh_tokens ("
+                " token_hash TEXT PRIMARY KEY, family_id TEXT NOT NULL, email TEXT NOT NULL, name TEXT,"
+                " expires_at REAL NOT NULL, family_expires_at REAL NOT NULL, used INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS refresh_tokens_family ON refresh_tokens (family_id)")
+
+    def add(self, record):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO refresh_tokens VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record.token_hash, record.family_id, record.email, record.name,
+                 record.expires_at, record.family_expires_at, int(record.used)),
+            )
+
+    def get(self, token_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT token_hash, family_id, email, name, expires_at, family_expires_at, used"
+                " FROM refresh_tokens WHERE token_hash = ?", (token_hash,)
+            ).fetchone()
+        return RefreshTokenRecord(*row[:6], used=bool(row[6])) if row else None
+
+    def mark_used(self, token_hash):
+        # 条件付き UPDATE で、同じトークンの同時使用のうち1つだけが成功する
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE refresh_tokens SET used = 1 WHERE token_hash = ? AND used = 0", (token_hash,)
+            )
+        return cursor.rowcount == 1
+
+    def revoke_family(self, family_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM refresh_tokens WHERE family_id = ?", (family_id,))
+
+    def prune(self, now):
+        with self._lock:
+            self._conn.execute("DELETE FROM refresh_tokens WHERE expires_at <= ?", (now,))
+
+class RefreshTokenService:
+    """リフレッシュトークンの発行・ローテーション・無効化。"""
+
+    def __init__(self, store, ttl_seconds=REFRESH_TOKEN_TTL_SECONDS,
+                 max_lifetime_seconds=REFRESH_TOKEN_MAX_LIFETIME_SECONDS, clock=time.time):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self._clock = clock
+        self._next_prune = 0.0
+
+    def issue(self, email, name, family_id=None, family_expires_at=None, namespace=None, ttl_seconds=None):
+        """
+        新しいリフレッシュトークンを発行します (family_id 省略時は新しいログインとして扱う)。
+        namespace (テナントID) を指定したトークンは、同じ namespace でのみ使用できます。
+        ttl_seconds を省略した場合の有効期間は REFRESH_TOKEN_TTL_SECONDS です。
+        """
+        now = self._clock()
+        if family_id is None:
+            family_id = secrets.token_urlsafe(12)
+            family_expires_at = now + self.max_lifetime_seconds
+        token = secrets.token_urlsafe(32)
+        self.store.add(RefreshTokenRecord(
+            hash_refresh_token(token, namespace), family_id, email, name,
+            min(now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), family_expires_at),
+            family_expires_at,
+        ))
+        self._maybe_prune(now)
+        return token
+
+    def issue_login_code(self, email, name, namespace=None):
+        """
+        ログイン直後のリダイレクトに付ける使い捨てのログインコードを発行します。
+        ログインコードは新しいファミリーの最初のトークン (有効期間 LOGIN_CODE_TTL_SECONDS) で、
+        rotate で交換すると通常のリフレッシュトークンが得られます。2回目の使用はファミリー全体を無効にします。
+        """
+        return self.issue(email, name, namespace=namespace, ttl_seconds=LOGIN_CODE_TTL_SECONDS)
+
+    def rotate(self, token, namespace=None):
+        """
+        リフレッシュトークンを使用済みにし、(RefreshTokenRecord, 新しいトークン) を返します。
+
+        Raises:
+            RefreshTokenError: 不明・期限切れ・再利用の場合。再利用の場合はファミリー全体を無効にします。
+        """
+        if not token:
+            raise RefreshTokenError("invalid")
+        token_hash = hash_refresh_token(token, namespace)
+        record = self.store.get(token_hash)
+        if record is None:
+            raise RefreshTokenError("invalid")
+        if record.expires_at <= self._clock():
+            raise RefreshTokenError("expired")
+        if record.used or not self.store.mark_used(token_hash):
+            self.store.revoke_family(record.family_id)
+            logger.warning("使用済みのリフレッシュトークンが再利用されました。ファミリーを無効化します。",
+                           extra={"user": record.email})
+            raise RefreshTokenError("reused")
+        new_token = self.issue(record.email, record.name, record.family_id, record.family_expires_at, namespace)
+        return record, new_token
+
+    def revoke(self, token, namespace=None):
+        """トークンが属するファミリーを無効にします (ログアウト時)。不明なトークンは無視します。"""
+        record = self.store.get(hash_refresh_token(token, namespace)) if token else None
+        if record is not None:
+            self.store.revoke_family(record.family_id)
+        return record
+
+    def _maybe_prune(self, now):
+        if now >= self._next_prune:
+            self._next_prune = now + 600
+            self.store.prune(now)
+
+_refresh_token_service = None
+_refresh_token_service_resolved = False # ストアを決定済みか (リフレッシュトークンを使わない場合も True)
+_refresh_token_service_lock = threading.Lock()
+
+def set_refresh_token_store(store):
+    """ストアを差し替えます (ローカル代替の実装など)。"""
+    global _refresh_token_service, _refresh_token_service_resolved
+    with _refresh_token_service_lock:
+        _refresh_token_service = RefreshTokenService(store)
+        _refresh_token_service_resolved = True
+
+def set_default_database(path):
+    """
+    ストアが未設定 (REFRESH_TOKEN_DB なし・set_refresh_token_store 未使用) の場合に、path の SQLite ファイルを使うようにします。
+    接続は初回の使用時に作るため、フォーク前のマスタープロセスで呼び出せます。適用した場合は True を返します。
+    """
+    global REFRESH_TOKEN_DB
+    with _refresh_token_service_lock:
+        if REFRESH_TOKEN_DB or _refresh_token_service is not None:
+            return False
+        REFRESH_TOKEN_DB = path
+        return True
+
+def has_shared_store():
+    """プロセス間で共有するストア (InMemoryRefreshTokenStore 以外) を使う設定か。"""
+    service = _refresh_token_service
+    if service is not None:
+        return not isinstance(service.store, InMemoryRefreshTokenStore)
+    return bool(REFRESH_TOKEN_DB)
+
+def _create_default_store():
+    if REFRESH_TOKEN_DB:
+        return SQLiteRefreshTokenStore(REFRESH_TOKEN_DB)
+    if REFRESH_TOKEN_ALLOW_IN_MEMORY:
+        return InMemoryRefreshTokenStore()
+    logger.error("REFRESH_TOKEN_DB が未設定のため、リフレッシュトークンを発行しません "
+                 "(プロセス内のストアはインスタンス間で共有されません。単一インスタンスの構成では "
+                 "REFRESH_TOKEN_ALLOW_IN_MEMORY=1 を設定してください)。")
+    return None
+
+def get_refresh_token_service():
+    """
+    プロセス全体で共有する RefreshTokenService を返します (初回に作成)。
+    共有のストアが必要な環境で設定されていない場合は None (リフレッシュトークンを使わない) を返します。
+    """
+    global _refresh_token_service, _refresh_token_service_resolved
+    if _refresh_token_service is None and not _refresh_token_service_resolved:
+        with _refresh_token_service_lock:
+            if _refresh_token_service is None and not _refresh_token_service_resolved:
+                store = _create_default_store()
+                _refresh_token_service = RefreshTokenService(store) if store is not None else None
+                _refresh_token_service_resolved = True
+    return _refresh_token_service
@@ -0,0 +1,391 @@
+# auth_server_flask/revocation.py
+
+"""
+発行済みトークンの失効 (revocation) 管理。
+
+- 失効したトークンは jti クレームで識別します。
+- 「失効していない」という大多数のケースは、メモリ上のブルームフィルターだけで判定します。
+  ブルームフィルターが「含まれるかもしれない」と答えた場合のみ、正確な集合で確認します。
+- 各エントリはトークンの exp で自動的に期限切れとなり、メモリ使用量は有効なトークン数に比例します。
+- 失効情報はバックエンド (ローカルファイル、またはそれと同じインターフェースを持つ実装) を介して
+  インスタンス間で差分同期します。
+- ファイルのバックエンドは追記専用のため、同期スレッドが REVOCATION_COMPACT_INTERVAL_SECONDS ごとに期限切れの割合を確認し、
+  REVOCATION_COMPACT_MIN_EXPIRED_RATIO 以上なら有効なエントリだけで作り直します (読み込み側は作り直しを検知して先頭から読み直す)。
+"""
+
+import bisect
+import heapq
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows (ローカル検証用。プロセス間の排他は行わない)
+    fcntl = None
+
+import observability
+
+logger = observability.get_logger(__name__)
+
+REVOCATION_CAPACITY = int(os.environ.get("REVOCATION_CAPACITY", "1000000"))
+REVOCATION_ERROR_RATE = float(os.environ.get("REVOCATION_ERROR_RATE", "0.01"))
+REVOCATION_FILE = os.environ.get("REVOCATION_FILE") # 未設定ならプロセス内のみ (InMemoryRevocationBackend)
+REVOCATION_SYNC_INTERVAL_SECONDS = float(os.environ.get("REVOCATION_SYNC_INTERVAL_SECONDS", "2"))
+REVOCATION_COMPACT_INTERVAL_SECONDS = float(os.environ.get("REVOCATION_COMPACT_INTERVAL_SECONDS", "600"))
+REVOCATION_COMPACT_MIN_EXPIRED_RATIO = float(os.environ.get("REVOCATION_COMPACT_MIN_EXPIRED_RATIO", "0.5"))
+
+class BloomFilter:
+    """
+    固定サイズのブルームフィルター (要素の削除は不可。期限切れ分は作り直しで取り除く)。
+
+    インデックスはプロセス内の hash() を元にしたダブルハッシュで求めます。
+    ビットが0の位置を見つけた時点で打ち切るため、含まれない要素の判定は多くの場合1〜2回の参照で終わります。
+    (hash() はプロセスごとに異なるため、フィルター自体はプロセス間で共有しません)
+    """
+
+    __slots__ = ("size", "hash_count", "_bits")
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _hashes(self, item):
+        h = hash(item) & 0xFFFFFFFFFFFFFFFF
+        return h & 0xFFFFFFFF, (h >> 32) | 1
+
+    def add(self, item):
+        h1, h2 = self._hashes(item)
+        bits, size = self._bits, self.size
+        index = h1
+        for _ in range(self.hash_count):
+            index %= size
+            bits[index >> 3] |= 1 << (index & 7)
+            index += h2
+
+    def __contains__(self, item):
+        # 判定はホットパスのため _hashes を展開している
+        h = hash(item) & 0xFFFFFFFFFFFFFFFF
+        h2 = (h >> 32) | 1
+        index = h & 0xFFFFFFFF
+        bits, size = self._bits, self.size
+        for _ in range(self.hash_count):
+            index %= size
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+            index += h2
+        return True
+
+class RevocationList:
+    """
+    失効した jti の集合 (ブルームフィルター + 正確な集合 + 期限のヒープ)。
+
+    is_revoked はロックを取らずに判定します (更新は参照の差し替え・辞書への追加のみ)。
+    """
+
+    def __init__(self, capacity=REVOCATION_CAPACITY, error_rate=REVOCATION_ERROR_RATE, clock=time.time):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._clock = clock
+        self._entries = {}   # jti -> exp
+        self._expiry_heap = [] # (exp, jti)
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._bloom_count = 0 # ブルームフィルターに追加した要素数 (期限切れを含む)
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        """jti が失効済み (かつトークンがまだ有効期限内) であれば True。"""
+        if jti not in self._bloom:
+            return False
+        exp = self._entries.get(jti)
+        return exp is not None and exp > self._clock()
+
+    def revoke(self, jti, exp):
+        """jti を exp (UNIX秒) まで失効扱いにします。"""
+        with self._lock:
+            self._add_locked(jti, exp)
+            self._prune_locked()
+
+    def revoke_many(self, entries):
+        with self._lock:
+            for jti, exp in entries:
+                self._add_locked(jti, exp)
+            self._prune_locked()
+
+    def _add_locked(self, jti, exp):
+        exp = float(exp)
+        if exp <= self._clock():
+            return # 既に期限切れのトークンは失効させる必要がない
+        previous = self._entries.get(jti)
+        if previous is not None and previous >= exp:
+            return
+        self._entries[jti] = exp
+        heapq.heappush(self._expiry_heap, (exp, jti))
+        self._bloom.add(jti)
+        self._bloom_count += 1
+
+    def _prune_locked(self):
+        now = self._clock()
+        heap, entries = self._expiry_heap, self._entries
+        while heap and heap[0][0] <= now:
+            exp, jti = heapq.heappop(heap)
+            if entries.get(jti) == exp:
+                del entries[jti]
+        # 期限切れの要素がフィルターに溜まり誤検知率が上がったら、有効な要素だけで作り直す
+        if self._bloom_count > max(self.capacity, 2 * len(entries)):
+            bloom = BloomFilter(max(self.capacity, len(entries)), self.error_rate)
+            for jti in entries:
+                bloom.add(jti)
+            self._bloom = bloom # 参照の差し替えのみ
+            self._bloom_count = len(entries)
+
+    def prune(self):
+        """期限切れのエントリを削除します。"""
+        with self._lock:
+            self._prune_locked()
+
+    def __len__(self):
+        return len(self._entries)
+
+# --- 同期用バックエンド ---
+class InMemoryRevocationBackend:
+    """
+    プロセス内だけで共有するバックエンド (テスト・単一インスタンス用のローカル代替)。
+    cursor は追加の通し番号です。期限切れのエントリは、件数が前回の整理後の有効なエントリの2倍
+    (最低 compact_min_entries) に達した時点で取り除くため、メモリ使用量は有効なトークン数に比例します。
+    """
+
+    def __init__(self, clock=time.time, compact_min_entries=1024):
+        self._entries = [] # (通し番号, jti, exp)
+        self._next_seq = 0
+        self._clock = clock
+        self._compact_min_entries = compact_min_entries
+        self._compact_at = compact_min_entries
+        self._lock = threading.Lock()
+
+    def append(self, jti, exp):
+        with self._lock:
+            now = self._clock()
+            if exp <= now:
+                return # 既に期限切れのトークンは記録しない (RevocationList も無視する)
+            self._entries.append((self._next_seq, jti, exp))
+            self._next_seq += 1
+            if len(self._entries) >= self._compact_at:
+                self._entries = [entry for entry in self._entries if entry[2] > now]
+                self._compact_at = max(self._compact_min_entries, 2 * len(self._entries))
+
+    def read_since(self, cursor):
+        """cursor 以降に追加されたエントリ (期限切れで取り除いたものを除く) と、新しい cursor を返します (cursor=None は先頭から)。"""
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (cursor or 0,))
+            return [(jti, exp) for _, jti, exp in self._entries[start:]], self._next_seq
+
+    def __len__(self):
+        return len(self._entries)
+
+def _parse_lines(data):
+    """JSON Lines の完結した行から (jti, exp) のリストを作ります。"""
+    entries = []
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+            entries.append((record["jti"], record["exp"]))
+        except (ValueError, KeyError):
+            logger.warning("不正な行を無視します: %r", line[:80])
+    return entries
+
+class FileRevocationBackend:
+    """
+    追記専用の JSON Lines ファイルによるバックエンド。同じファイルを共有するプロセス間で同期できます。
+    cursor は (inode, バイトオフセット) で、ファイルが作り直された (compact) 場合は先頭から読み直します。
+
+    追記と作り直しはファイルの排他ロック (flock) で直列化し、作り直しの間に他のプロセスが追記した行を失いません。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _open_locked(self, mode):
+        """
+        ファイルを開いて排他ロックを取得します。ロックを待つ間に作り直された場合は、新しいファイルを開き直します。
+        ファイルがない場合、mode が追記 ("a") 以外なら None を返します。
+        """
+        while True:
+            try:
+                f = open(self.path, mode)
+            except FileNotFoundError:
+                if "a" in mode:
+                    raise # ディレクトリがない
+                return None
+            if fcntl is None:
+                return f
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return f # ロックは close で解放される
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def append(self, jti, exp):
+        line = (json.dumps({"jti": jti, "exp": exp}, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            with self._open_locked("ab") as f:
+                f.write(line) # 1行を1回の write で追記する
+
+    def read_since(self, cursor):
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                offset = cursor[1] if cursor and cursor[0] == stat.st_ino and cursor[1] <= stat.st_size else 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], cursor
+        # 書き込み途中の最終行は次回に読む
+        complete = data[:data.rfind(b"\n") + 1]
+        return _parse_lines(complete), (stat.st_ino, offset + len(complete))
+
+    def compact(self, now=None, min_expired_ratio=0.0):
+        """
+        期限切れのエントリを除いてファイルを作り直します (別ファイルに書いてから置き換え)。
+        期限切れのエントリの割合が min_expired_ratio 未満の場合は作り直しません。
+
+        Returns:
+            int: 取り除いたエントリ数 (作り直さなかった場合は 0)。
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            f = self._open_locked("rb")
+            if f is None:
+                return 0
+            with f: # 置き換えが終わるまで、他のプロセスの追記・作り直しはロックを待つ
+                data = f.read()
+                entries = _parse_lines(data[:data.rfind(b"\n") + 1])
+                live = [(jti, exp) for jti, exp in entries if exp > now]
+                expired = len(entries) - len(live)
+                if not expired or expired < min_expired_ratio * len(entries):
+                    return 0
+                tmp_path = f"{self.path}.tmp{os.getpid()}"
+                with open(tmp_path, "w", encoding="utf-8") as tmp:
+                    for jti, exp in live:
+                        tmp.write(json.dumps({"jti": jti, "exp": exp}, separators=(",", ":")) + "\n")
+                os.replace(tmp_path, self.path)
+        logger.debug("失効リストファイルを作り直しました (removed=%d, remaining=%d)", expired, len(live))
+        return expired
+
+class RevocationService:
+    """RevocationList とバックエンドの同期をまとめたもの。"""
+
+    def __init__(self, backend, revocation_list=None, sync_interval_seconds=REVOCATION_SYNC_INTERVAL_SECONDS,
+                 compact_interval_seconds=REVOCATION_COMPACT_INTERVAL_SECONDS,
+                 compact_min_expired_ratio=REVOCATION_COMPACT_MIN_EXPIRED_RATIO):
+        self.backend = backend
+        self.revocation_list = revocation_list or RevocationList()
+        self.sync_interval_seconds = sync_interval_seconds
+        self.compact_interval_seconds = compact_interval_seconds
+        self.compact_min_expired_ratio = compact_min_expired_ratio
+        self._next_compact = 0.0
+        self._cursor = None
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+
+    def is_revoked(self, jti):
+        return self.revocation_list.is_revoked(jti)
+
+    def revoke(self, jti, exp):
+        self.backend.append(jti, exp)
+        self.revocation_list.revoke(jti, exp) # 同期を待たずにこのインスタンスでは即時反映
+
+    def sync(self):
+        """バックエンドに追加された差分を取り込みます。取り込んだ件数を返します。"""
+        with self._sync_lock:
+            entries, self._cursor = self.backend.read_since(self._cursor)
+        if entries:
+            self.revocation_list.revoke_many(entries)
+        else:
+            self.revocation_list.prune()
+        return len(entries)
+
+    def maybe_compact(self, now=None):
+        """
+        前回の確認から compact_interval_seconds 経っていれば、バックエンドの期限切れのエントリを取り除きます
+        (compact を持つバックエンドのみ。期限切れの割合が compact_min_expired_ratio 未満なら何もしない)。
+        取り除いた件数を返します。
+        """
+        compact = getattr(self.backend, "compact", None)
+        now = now if now is not None else time.time()
+        if compact is None or self.compact_interval_seconds <= 0 or now < self._next_compact:
+            return 0
+        self._next_compact = now + self.compact_interval_seconds
+        return compact(now, min_expired_ratio=self.compact_min_expired_ratio)
+
+    def start_background_sync(self):
+        """sync_interval_seconds ごとに差分を取り込むデーモンスレッドを開始します。"""
+        if self._sync_thread is not None or self.sync_interval_seconds <= 0:
+            return self._sync_thread
+
+        def _loop():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.warning("失効リストの同期に失敗しました: %s", e)
+                try:
+                    self.maybe_compact()
+                except Exception as e:
+                    logger.warning("失効リストファイルの作り直しに失敗しました: %s", e)
+                time.sleep(self.sync_interval_seconds)
+
+        self._sync_thread = threading.Thread(target=_loop, name="revocation-sync", daemon=True)
+        self._sync_thread.start()
+        return self._sync_thread
+
+_revocation_service = None
+_revocation_service_lock = threading.Lock()
+
+def set_revocation_backend(backend):
+    """バックエンドを差し替えます (ローカル代替の実装など)。失効リストは作り直されます。"""
+    global _revocation_service
+    with _revocation_service_lock:
+        _revocation_service = RevocationService(backend)
+        _revocation_service.sync()
+        _revocation_service.start_background_sync()
+
+def set_default_file(path):
+    """
+    バックエンドが未設定 (REVOCATION_FILE なし・set_revocation_backend 未使用) の場合に、path のファイルを使うようにします。
+    同期スレッドは初回の使用時に開始するため、フォーク前のマスタープロセスで呼び出せます。適用した場合は True を返します。
+    """
+    global REVOCATION_FILE
+    with _revocation_service_lock:
+        if REVOCATION_FILE or _revocation_service is not None:
+            return False
+        REVOCATION_FILE = path
+        return True
+
+def has_shared_backend():
+    """プロセス間で共有するバックエンド (InMemoryRevocationBackend 以外) を使う設定か。"""
+    service = _revocation_service
+    if service is not None:
+        return not isinstance(service.backend, InMemoryRevocationBackend)
+    return bool(REVOCATION_FILE)
+
+def get_revocation_service():
+    """プロセス全体で共有する RevocationService を返します (初回に作成し、同期を開始)。"""
+    global _revocation_service
+    if _revocation_service is None:
+        with _revocation_service_lock:
+            if _revocation_service is None:
+                backend = FileRevocationBackend(REVOCATION_FILE) if REVOCATION_FILE else InMemoryRevocationBackend()
+                service = RevocationService(backend)
+                service.sync()
+                if REVOCATION_FILE:
+                    service.start_background_sync()
+                _revocation_service = service
+    return _revocation_service
@@ -0,0 +1,330 @@
+# auth_server_flask/tenants.py
+
+"""
+1つのデプロイで複数の Streamlit アプリ (テナント) を認証するためのテナントレジストリ。
+
+- テナントはパス (/t/<テナントID>/auth/login など) またはホスト名 (<テナントID><TENANT_HOST_SUFFIX>) で指定します。
+  どちらにも該当しないリクエストは、これまでどおり既定の設定 (config.get_config()) で処理します。
+- テナントごとの定義 (JSON) は Secret Manager のシークレット (TENANT_SECRET_TEMPLATE) から、
+  local_direct モードでは TENANTS_FILE から、最初のリクエスト時に読み込みます。
+  Secret Manager では、テナントIDの一覧 (TENANT_INDEX_SECRET、カンマ・改行区切り) にあるテナントだけを問い合わせます
+  (存在しないテナントIDを大量に指定されても Secret Manager へのアクセスは増えません)。
+- テナントの追加・定義の変更は、一覧と定義のシークレットを更新すれば
+  SECRET_CACHE_TTL_SECONDS + TENANT_CACHE_TTL_SECONDS 以内に反映されます (再デプロイ不要)。
+- 定義から既定の設定を元にしたテナントの AuthConfig を構築し、テナントID をキーとする LRU キャッシュに保持します。
+  リクエストごとの検索は辞書の参照1回です。
+
+定義の例 (省略した項目は既定の設定の値を使います。streamlit_app_url は必須):
+    {
+      "streamlit_app_url": "https://app1.example.com",    # 戻り先・JWT の aud
+      "allowed_users": "alice@example.com,@example.org",   # ALLOWED_USERS_LIST と同じ形式
+      "google_client_id": "...", "google_client_secret": "...",
+      "jwt_secret_key": "...", "jwt_signing_keys": {...},   # JWT_SIGNING_KEYS と同じ形式
+      "function_base_url": "https://auth.example.com/t/app1" # JWT の iss
+    }
+function_base_url の省略時は、TENANT_HOST_SUFFIX があれば https://<テナントID><TENANT_HOST_SUFFIX>、
+なければ <既定の FUNCTION_BASE_URL>/t/<テナントID> です。
+Google の OAuth クライアントには、テナントのリダイレクトURI (<function_base_url>/auth_callback) を登録してください。
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import observability
+from allowlist import AllowList
+from auth_utils import derive_oauth_state_key
+
+logger = observability.get_logger(__name__)
+
+TENANT_CACHE_SIZE = int(os.environ.get("TENANT_CACHE_SIZE", "1000"))
+TENANT_CACHE_TTL_SECONDS = float(os.environ.get("TENANT_CACHE_TTL_SECONDS", "60"))
+# テナントの定義を保存するシークレット名 ({tenant_id} はテナントID、大文字・"-" は "_" に変換)
+TENANT_SECRET_TEMPLATE = os.environ.get("TENANT_SECRET_TEMPLATE", "TENANT_{tenant_id}_PROD_SM")
+TENANT_INDEX_SECRET = os.environ.get("TENANT_INDEX_SECRET", "TENANT_IDS_PROD_SM") # テナントIDの一覧
+TENANTS_FILE = os.environ.get("TENANTS_FILE") # テナントID -> 定義 の JSON (local_direct モード・CI 用)
+TENANT_HOST_SUFFIX = os.environ.get("TENANT_HOST_SUFFIX") # 例: ".auth.example.com" (未設定ならホスト名では判定しない)
+
+TENANT_PATH_PREFIX = "/t/"
+
+_TENANT_ID_RE = re.compile(r"[a-z0-9][a-z0-9-]{0,62}")
+
+class UnknownTenantError(Exception):
+    """テナントが存在しない (または定義が不正な) 場合の例外。"""
+
+def is_valid_tenant_id(tenant_id):
+    return bool(tenant_id) and _TENANT_ID_RE.fullmatch(tenant_id) is not None
+
+def tenant_id_from_host(host):
+    """ホスト名 (ポート付きでも可) からテナントIDを返します。TENANT_HOST_SUFFIX に該当しなければ None。"""
+    if not TENANT_HOST_SUFFIX or not host:
+        return None
+    hostname = host.partition(":")[0].lower()
+    if hostname.endswith(TENANT_HOST_SUFFIX) and len(hostname) > len(TENANT_HOST_SUFFIX):
+        return hostname[:-len(TENANT_HOST_SUFFIX)]
+    return None
+
+def split_tenant_path(path):
+    """"/t/<テナントID>/rest" を (テナントID, "/rest") に分割します。該当しなければ (None, path)。"""
+    if not path.startswith(TENANT_PATH_PREFIX):
+        return None, path
+    tenant_id, _, rest = path[len(TENANT_PATH_PREFIX):].partition("/")
+    return tenant_id, "/" + rest
+
+# --- テナントの定義の取得元 ---
+class SecretManagerTenantSource:
+    """
+    Secret Manager のシークレットから定義を取得します (config のシークレットキャッシュ経由)。
+    一覧 (index_secret) にないテナントは問い合わせずに None を返します。
+    """
+
+    def __init__(self, template=TENANT_SECRET_TEMPLATE, index_secret=TENANT_INDEX_SECRET,
+                 index_refresh_seconds=TENANT_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.template = template
+        self.index_secret = index_secret
+        self.index_refresh_seconds = index_refresh_seconds
+        self._clock = clock
+        self._tenant_ids = frozenset()
+        self._index_expires_at = 0.0
+
+    def tenant_ids(self):
+        """テナントIDの集合。一覧の確認は index_refresh_seconds に1回まで (取得できない場合は前回の一覧を使う)。"""
+        now = self._clock()
+        if now >= self._index_expires_at:
+            self._index_expires_at = now + self.index_refresh_seconds
+            raw = config.get_secret_from_sm(self.index_secret)
+            if raw is not None:
+                self._tenant_ids = frozenset(item.strip() for item in raw.replace("\n", ",").split(",") if item.strip())
+        return self._tenant_ids
+
+    def get(self, tenant_id):
+        """定義 (dict) を返します。存在しない場合は None。"""
+        if tenant_id not in self.tenant_ids():
+            return None
+        secret_name = self.template.format(tenant_id=tenant_id.upper().replace("-", "_"))
+        raw = config.get_secret_from_sm(secret_name)
+        return json.loads(raw) if raw else None
+
+class FileTenantSource:
+    """テナントID -> 定義 の JSON ファイル。ファイルが更新されたら読み直します。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._tenants = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._tenants = json.load(f)
+                    self._mtime = mtime
+        return self._tenants.get(tenant_id)
+
+class InMemoryTenantSource:
+    """テスト・ベンチマーク用のプロセス内の定義。"""
+
+    def __init__(self, tenants=None):
+        self._tenants = dict(tenants or {})
+
+    def set_tenant(self, tenant_id, definition):
+        self._tenants[tenant_id] = definition
+
+    def delete_tenant(self, tenant_id):
+        self._tenants.pop(tenant_id, None)
+
+    def get(self, tenant_id):
+        return self._tenants.get(tenant_id)
+
+def default_tenant_source(env_type):
+    if TENANTS_FILE:
+        return FileTenantSource(TENANTS_FILE)
+    if env_type in ("local_sm_test", "prod"):
+        return SecretManagerTenantSource()
+    return InMemoryTenantSource() # local_direct で TENANTS_FILE がなければテナントなし
+
+def build_tenant_config(tenant_id, definition, base, previous=None):
+    """
+    テナントの定義と既定の設定 (base) から、テナントの AuthConfig を構築します。
+    previous (同じテナントの以前の設定) のキーリングは、定義が同じなら再利用します。
+
+    Raises:
+        ValueError: 定義が不正、または必須の値が揃わない場合。
+    """
+    if not isinstance(definition, dict):
+        raise ValueError("tenant definition must be a JSON object")
+    if not definition.get("streamlit_app_url"):
+        raise ValueError("streamlit_app_url is required")
+
+    function_base_url = definition.get("function_base_url")
+    if not function_base_url:
+        if TENANT_HOST_SUFFIX:
+            function_base_url = f"https://{tenant_id}{TENANT_HOST_SUFFIX}"
+        else:
+            function_base_url = f"{base.function_base_url.rstrip('/')}{TENANT_PATH_PREFIX}{tenant_id}"
+    function_base_url = function_base_url.rstrip("/")
+
+    jwt_secret_key = definition.get("jwt_secret_key") or base.jwt_secret_key
+    if definition.get("jwt_signing_keys") or definition.get("jwt_secret_key"):
+        key_ring = config.build_key_ring(definition.get("jwt_signing_keys"), jwt_secret_key,
+                                         reusable=previous.key_ring if previous is not None else None)
+    else:
+        key_ring = base.key_ring
+    allowed_users = definition.get("allowed_users")
+    # state の署名鍵はテナントごとに分ける (別のテナントのコールバックでは使えない)
+    state_secret = os.environ.get("OAUTH_STATE_SECRET") or jwt_secret_key
+
+    tenant_config = base.replace(
+        google_client_id=definition.get("google_client_id") or base.google_client_id,
+        google_client_secret=definition.get("google_client_secret") or base.google_client_secret,
+        jwt_secret_key=jwt_secret_key,
+        streamlit_app_url=definition["streamlit_app_url"],
+        function_base_url=function_base_url,
+        redirect_uri=f"{function_base_url}/auth_callback",
+        allow_list=AllowList.from_string(allowed_users) if allowed_users else base.allow_list,
+        oauth_state_key=derive_oauth_state_key(f"{tenant_id}:{state_secret}"),
+        key_ring=key_ring,
+        tenant_id=tenant_id,
+        loaded_at=time.time(),
+    )
+    missing = tenant_config.missing_fields()
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return tenant_config
+
+class _TenantEntry:
+    __slots__ = ("config", "definition", "base", "expires_at")
+
+    def __init__(self, tenant_config, definition, base, expires_at):
+        self.config = tenant_config # 定義が不正なテナントは None
+        self.definition = definition
+        self.base = base
+        self.expires_at = expires_at
+
+class TenantRegistry:
+    """
+    テナントID -> テナントの AuthConfig の LRU キャッシュ。
+
+    キャッシュ済み (かつ期限内で、既定の設定が再読み込みされていない) 場合はロックを取らずに返します。
+    期限切れの場合は定義を取得し直し、変更がなければ構築済みの設定をそのまま使います。
+    存在しないテナントはキャッシュしません (存在しないテナントIDで既存のテナントが追い出されないように)。
+    """
+
+    def __init__(self, source, cache_size=TENANT_CACHE_SIZE, ttl_seconds=TENANT_CACHE_TTL_SECONDS,
+                 clock=time.monotonic):
+        self.source = source
+        self.cache_size = max(1, cache_size)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict() # tenant_id -> _TenantEntry
+        self._lock = threading.Lock()
+
+    def is_cached(self, tenant_id, base):
+        """get_config が定義の取得なしで応答できるかどうか (ASGI モードでスレッドに逃がすかの判定用)。"""
+        entry = self._entries.get(tenant_id)
+        return entry is not None and entry.base is base and self._clock() < entry.expires_at
+
+    def get_config(self, tenant_id, base):
+        """
+        テナントの AuthConfig を返します。
+
+        Raises:
+            UnknownTenantError: テナントが存在しない、または定義が不正な場合。
+        """
+        entry = self._entries.get(tenant_id)
+        if entry is None or entry.base is not base or self._clock() >= entry.expires_at:
+            entry = self._load(tenant_id, base, entry)
+        else:
+            try:
+                self._entries.move_to_end(tenant_id)
+            except KeyError: # 他のスレッドが追い出した直後
+                pass
+        if entry.config is None:
+            raise UnknownTenantError(tenant_id)
+        return entry.config
+
+    def _load(self, tenant_id, base, previous):
+        if not is_valid_tenant_id(tenant_id):
+            raise UnknownTenantError(tenant_id)
+        try:
+            definition = self.source.get(tenant_id)
+        except Exception as e:
+            # 取得に失敗した場合は、以前の定義があればそれを使い続ける
+            logger.warning("テナント '%s' の定義を取得できませんでした: %s", tenant_id, e)
+            definition = previous.definition if previous is not None else None
+        if definition is None:
+            if previous is not None:
+                self.invalidate(tenant_id) # 削除されたテナント
+            raise UnknownTenantError(tenant_id)
+
+        tenant_config = None
+        if previous is not None and previous.base is base and previous.definition == definition:
+            tenant_config = previous.config
+        else:
+            try:
+                tenant_config = build_tenant_config(
+                    tenant_id, definition, base, previous.config if previous is not None else None)
+                logger.info("テナント '%s' の設定を読み込みました。", tenant_id,
+                            extra={"tenant_id": tenant_id, "streamlit_app_url": tenant_config.streamlit_app_url,
+                                   "function_base_url": tenant_config.function_base_url})
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error("テナント '%s' の定義が不正です: %s", tenant_id, e)
+        entry = _TenantEntry(tenant_config, definition, base, self._clock() + self.ttl_seconds)
+        with self._lock:
+            self._entries[tenant_id] = entry
+            self._entries.move_to_end(tenant_id)
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, tenant_id=None):
+        """キャッシュを破棄します (tenant_id 省略時は全件)。"""
+        with self._lock:
+            if tenant_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(tenant_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+_tenant_registry = None
+_tenant_registry_lock = threading.Lock()
+
+def set_tenant_source(source):
+    """テナントの定義の取得元を差し替えます。キャッシュは破棄されます。"""
+    global _tenant_registry
+    with _tenant_registry_lock:
+        _tenant_registry = TenantRegistry(source)
+
+def get_tenant_registry(env_type=None):
+    """プロセス全体で共有する TenantRegistry を返します (初回に、env_type に応じた取得元で作成)。"""
+    global _tenant_registry
+    if _tenant_registry is None:
+        with _tenant_registry_lock:
+            if _tenant_registry is None:
+                _tenant_registry = TenantRegistry(default_tenant_source(env_type or config.ENV_TYPE))
+    return _tenant_registry
+
+def resolve_config(base, path_tenant_id=None, host=None):
+    """
+    リクエストで使う設定スナップショットを返します。
+    テナントの指定 (パス・ホスト名) がなければ base (既定の設定) をそのまま返します。
+
+    Raises:
+        UnknownTenantError: 指定されたテナントが存在しない場合。
+    """
+    tenant_id = path_tenant_id or tenant_id_from_host(host)
+    if tenant_id is None or base is None:
+        return base
+    return get_tenant_registry(base.env_type).get_config(tenant_id, base)
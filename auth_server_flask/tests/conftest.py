@@ -0,0 +1,55 @@
+# auth_server_flask/tests/conftest.py
+
+"""
+認証サーバーのテスト用の共通フィクスチャ。
+
+- モジュールは auth_server_flask/ 直下からインポートします (main.py と同じ)。
+- インポート時の設定の読み込み (ウォームアップ)・スナップショットは使わず、各テストで AuthConfig を構築して公開します。
+- 定数と AuthConfig の構築は support.py にあります (各テストからも使用)。
+- 失効リスト・リフレッシュトークン・レート制限・イントロスペクションのキャッシュはテストごとに作り直します。
+"""
+
+import os
+import sys
+
+# config などのインポート前に設定する (インポート時のウォームアップと外部への通信を行わない)
+os.environ["CONFIG_INIT_MODE"] = "lazy"
+os.environ.pop("CONFIG_SNAPSHOT_FILE", None)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest  # noqa: E402
+
+import config  # noqa: E402
+import introspection  # noqa: E402
+import ratelimit  # noqa: E402
+import refresh_tokens  # noqa: E402
+import revocation  # noqa: E402
+
+from support import make_config  # noqa: E402
+
+@pytest.fixture
+def auth_config():
+    return make_config()
+
+@pytest.fixture(autouse=True)
+def fresh_services(monkeypatch):
+    """プロセス全体で共有するサービスを、テストごとにプロセス内のストアで作り直します。"""
+    monkeypatch.setattr(refresh_tokens, "_refresh_token_service",
+                        refresh_tokens.RefreshTokenService(refresh_tokens.InMemoryRefreshTokenStore()))
+    monkeypatch.setattr(revocation, "_revocation_service",
+                        revocation.RevocationService(revocation.InMemoryRevocationBackend()))
+    monkeypatch.setattr(ratelimit, "_rate_limiter", ratelimit.RateLimiter(ratelimit.default_limits()))
+    monkeypatch.setattr(introspection, "_introspector", introspection.TokenIntrospector())
+
+@pytest.fixture
+def published_config(monkeypatch, auth_config):
+    """auth_config を公開中の設定にします。"""
+    monkeypatch.setattr(config, "_current_config", auth_config)
+    return auth_config
+
+@pytest.fixture
+def client(published_config):
+    """Flask アプリ (main.app) のテストクライアント。"""
+    import main
+    return main.app.test_client()
@@ -0,0 +1,25 @@
+# auth_server_flask/tests/support.py
+
+"""テストで共通に使う定数と設定の構築 (conftest.py と各テストから使用)。"""
+
+import config
+
+APP_URL = "https://app.example.com/app"
+FUNCTION_BASE_URL = "https://auth.example.com"
+JWT_SECRET = "test-jwt-secret-0123456789abcdef0123456789"
+SERVICE_API_KEY = "test-service-api-key"
+
+def make_config(**overrides):
+    """local_direct モードと同じ形の設定値から AuthConfig を構築します (公開はしません)。"""
+    values = {
+        "google_client_id": "test-client.apps.googleusercontent.com",
+        "google_client_secret": "test-client-secret",
+        "jwt_secret_key": JWT_SECRET,
+        "streamlit_app_url": APP_URL,
+        "function_base_url": FUNCTION_BASE_URL,
+        "allowed_users_list": "alice@example.com,@example.org,!blocked@example.org",
+        "signing_keys_spec": None,
+        "service_api_key": SERVICE_API_KEY,
+    }
+    values.update(overrides)
+    return config._build_config("local_direct", values)
@@ -0,0 +1,51 @@
+# auth_server_flask/tests/test_allowlist.py
+
+import pytest
+
+from allowlist import AllowList
+
+RULES = """
+alice@example.com, @example.org   # 個別のユーザーとドメイン
+@*.corp.example.net
+!blocked@example.org
+!@evil.corp.example.net
+"""
+
+@pytest.fixture
+def allow_list():
+    return AllowList.from_string(RULES)
+
+@pytest.mark.parametrize("email", [
+    "alice@example.com",
+    " ALICE@Example.COM ",
+    "bob@example.org",
+    "carol@dev.corp.example.net",
+    "dave@a.b.corp.example.net",
+])
+def test_allowed(allow_list, email):
+    assert allow_list.is_allowed(email)
+
+@pytest.mark.parametrize("email", [
+    "mallory@example.com",           # 同じドメインでも個別に許可したユーザーのみ
+    "blocked@example.org",           # 拒否ルールはドメインの許可より優先
+    "x@evil.corp.example.net",       # 拒否ドメイン
+    "x@corp.example.net",            # @*. はサブドメインのみ
+    "bob@example.org.evil.com",
+    "bob@sub.example.org",           # @example.org はサブドメインを含まない
+    "alice@example.com@evil.com",
+    "@example.org",
+    "example.org",
+    "",
+    None,
+])
+def test_not_allowed(allow_list, email):
+    assert not allow_list.is_allowed(email)
+
+def test_from_file_matches_from_string(tmp_path):
+    path = tmp_path / "allowed_users.txt"
+    path.write_text(RULES, encoding="utf-8")
+    assert AllowList.from_file(str(path)) == AllowList.from_string(RULES)
+
+def test_unparsable_rules_are_ignored():
+    allow_list = AllowList.from_string("example.org, alice@example.com")
+    assert len(allow_list) == 1 and not allow_list.is_allowed("bob@example.org")
@@ -0,0 +1,134 @@
+# auth_server_flask/tests/test_auth_utils.py
+
+import json
+import time
+
+import jwt
+import pytest
+
+import auth_utils
+from support import APP_URL, FUNCTION_BASE_URL
+from signing_keys import KeyRing
+
+def key_ring(*keys, primary="current"):
+    return KeyRing.from_spec({"primary": primary, "keys": list(keys)})
+
+CURRENT = {"kid": "current", "alg": "HS256", "secret": "current-secret-0123456789abcdef0123"}
+RETIRED = {"kid": "retired", "alg": "HS256", "secret": "retired-secret-0123456789abcdef0123",
+           "verify_only": True, "not_after": time.time() - 60}
+
+def test_verify_custom_jwt_round_trip():
+    ring = key_ring(CURRENT)
+    token = auth_utils.create_custom_jwt("alice@example.com", "Alice", FUNCTION_BASE_URL, APP_URL, ring)
+    payload = auth_utils.verify_custom_jwt(token, ring, FUNCTION_BASE_URL, APP_URL)
+    assert payload["sub"] == "alice@example.com"
+    assert jwt.get_unverified_header(token)["kid"] == "current"
+
+@pytest.mark.parametrize("kid", ["unknown", "retired"])
+def test_verify_custom_jwt_unknown_or_retired_kid_is_invalid_token(kid):
+    secret = RETIRED["secret"] if kid == "retired" else "other-secret-0123456789abcdef01234567"
+    token = jwt.encode({"sub": "alice@example.com", "iss": FUNCTION_BASE_URL, "aud": APP_URL,
+                        "exp": int(time.time()) + 60}, secret, algorithm="HS256", headers={"kid": kid})
+    with pytest.raises(jwt.InvalidTokenError):
+        auth_utils.verify_custom_jwt(token, key_ring(CURRENT, RETIRED), FUNCTION_BASE_URL, APP_URL)
+    with pytest.raises(auth_utils.UnknownSigningKeyError):
+        auth_utils.verify_custom_jwt(token, key_ring(CURRENT, RETIRED), FUNCTION_BASE_URL, APP_URL)
+
+def test_verify_custom_jwt_rejects_revoked_token():
+    ring = key_ring(CURRENT)
+    token = auth_utils.create_custom_jwt("alice@example.com", "Alice", FUNCTION_BASE_URL, APP_URL, ring)
+    jti = jwt.decode(token, options={"verify_signature": False})["jti"]
+
+    class Revoked:
+        def is_revoked(self, revoked_jti):
+            return revoked_jti == jti
+
+    with pytest.raises(auth_utils.TokenRevokedError):
+        auth_utils.verify_custom_jwt(token, ring, FUNCTION_BASE_URL, APP_URL, revocation_list=Revoked())
+
+
+def es256_ring(kid):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    pem = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    return key_ring({"kid": kid, "alg": "ES256", "private_key_pem": pem}, primary=kid)
+
+def test_mint_tokens_batch_pool_is_safe_under_concurrent_key_changes():
+    from concurrent.futures import ThreadPoolExecutor
+    rings = [es256_ring("key-a"), es256_ring("key-b")]
+    subjects = [f"user{i}@example.com" for i in range(8)]
+
+    def mint(i):
+        ring = rings[i % 2]
+        tokens = auth_utils.mint_tokens_batch(subjects, FUNCTION_BASE_URL, APP_URL, ring, processes=2)
+        return [auth_utils.verify_custom_jwt(token, ring, FUNCTION_BASE_URL, APP_URL)["sub"] for token in tokens]
+
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(mint, range(6)))
+        assert all(result == subjects for result in results)
+        assert auth_utils._mint_pool is not None
+    finally:
+        with auth_utils._mint_pool_lock:
+            if auth_utils._mint_pool is not None:
+                auth_utils._mint_pool[1].shutdown()
+                auth_utils._mint_pool = None
+
+# --- state トークン ---
+STATE_KEY = auth_utils.derive_oauth_state_key("state-secret")
+NOW = 1_000_000
+
+def test_state_token_round_trip():
+    token = auth_utils.create_oauth_state_token(STATE_KEY, return_to=APP_URL, now=NOW)
+    payload = auth_utils.verify_oauth_state_token(token, STATE_KEY, now=NOW + 1)
+    assert payload["r"] == APP_URL and payload["exp"] == NOW + auth_utils.OAUTH_STATE_TTL_SECONDS
+
+def _tamper_return_to(token):
+    body, signature = token.split(".")
+    payload = json.loads(auth_utils._b64url_decode(body))
+    payload["r"] = "https://evil.example.net/"
+    return auth_utils._b64url_encode(json.dumps(payload).encode()) + "." + signature
+
+@pytest.mark.parametrize("make_token, reason", [
+    (lambda t: _tamper_return_to(t), "invalid_signature"),
+    (lambda t: auth_utils.create_oauth_state_token(auth_utils.derive_oauth_state_key("other"), now=NOW),
+     "invalid_signature"),
+    (lambda t: t.split(".")[0] + ".!!!", "invalid_signature"),
+    (lambda t: t.replace(".", ""), "malformed"),
+    (lambda t: "", "malformed"),
+])
+def test_state_token_rejects_forged_tokens(make_token, reason):
+    token = make_token(auth_utils.create_oauth_state_token(STATE_KEY, return_to=APP_URL, now=NOW))
+    with pytest.raises(auth_utils.OAuthStateError) as e:
+        auth_utils.verify_oauth_state_token(token, STATE_KEY, now=NOW + 1)
+    assert str(e.value) == reason
+
+def test_state_token_expires():
+    token = auth_utils.create_oauth_state_token(STATE_KEY, ttl_seconds=60, now=NOW)
+    with pytest.raises(auth_utils.OAuthStateError, match="expired"):
+        auth_utils.verify_oauth_state_token(token, STATE_KEY, now=NOW + 60)
+
+def test_state_token_replay_is_rejected():
+    cache = auth_utils.NonceReplayCache()
+    token = auth_utils.create_oauth_state_token(STATE_KEY, now=NOW)
+    auth_utils.verify_oauth_state_token(token, STATE_KEY, replay_cache=cache, now=NOW + 1)
+    with pytest.raises(auth_utils.OAuthStateError, match="replayed"):
+        auth_utils.verify_oauth_state_token(token, STATE_KEY, replay_cache=cache, now=NOW + 2)
+
+def test_nonce_replay_cache_drops_expired_and_oldest_entries():
+    cache = auth_utils.NonceReplayCache(max_entries=3)
+    assert cache.add("a", NOW + 10, now=NOW)
+    assert cache.add("b", NOW + 20, now=NOW)
+    assert not cache.add("a", NOW + 10, now=NOW + 5)
+    assert cache.add("a", NOW + 10, now=NOW + 15) # 期限切れの nonce は削除済み (トークン自体も期限切れ)
+    assert cache.add("c", NOW + 30, now=NOW + 15)
+    assert cache.add("d", NOW + 40, now=NOW + 15) and len(cache) <= 3
+    assert cache.add("b", NOW + 20, now=NOW + 16) # 上限超過で最古の "b" は破棄済み (トークンの有効期限で保護)
+
+def test_callback_rejects_replayed_state(client, auth_config):
+    state = auth_utils.create_oauth_state_token(auth_config.oauth_state_key, return_to=APP_URL)
+    first = client.get("/auth/callback", query_string={"state": state, "error": "access_denied"})
+    assert first.status_code == 302 and "auth_error=access_denied" in first.headers["Location"]
+    replay = client.get("/auth/callback", query_string={"state": state, "error": "access_denied"})
+    assert replay.status_code == 400
@@ -0,0 +1,142 @@
+# auth_server_flask/tests/test_config_snapshot.py
+
+import json
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+import config_snapshot
+
+pytest.importorskip("cryptography")
+
+NOW = 1_000_000.0
+PAYLOAD = {"env_type": "prod", "values": {"jwt_secret_key": "secret"}, "created_at": NOW, "expires_at": NOW + 60}
+
+@pytest.fixture
+def key():
+    return config_snapshot.snapshot_key("test-snapshot-key")
+
+def test_round_trip(key):
+    data = config_snapshot.encode_snapshot(PAYLOAD, key)
+    assert b"secret" not in data
+    assert config_snapshot.decode_snapshot(data, key, now=NOW) == PAYLOAD
+
+@pytest.mark.parametrize("offset", [len(config_snapshot.MAGIC), len(config_snapshot.MAGIC) + 12, -1])
+def test_tampered_data_is_rejected(key, offset):
+    data = bytearray(config_snapshot.encode_snapshot(PAYLOAD, key))
+    data[offset] ^= 0x01 # nonce・暗号文・認証タグのいずれかを1ビット変更
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.decode_snapshot(bytes(data), key, now=NOW)
+    assert e.value.reason == "invalid_key_or_tampered"
+
+def test_wrong_key_is_rejected(key):
+    data = config_snapshot.encode_snapshot(PAYLOAD, key)
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.decode_snapshot(data, config_snapshot.snapshot_key("other-key"), now=NOW)
+    assert e.value.reason == "invalid_key_or_tampered"
+
+def test_expired_snapshot_is_rejected(key):
+    data = config_snapshot.encode_snapshot(PAYLOAD, key)
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.decode_snapshot(data, key, now=PAYLOAD["expires_at"])
+    assert e.value.reason == "expired"
+
+@pytest.mark.parametrize("data", [b"", b"AUTHCFG0" + b"\0" * 40, config_snapshot.MAGIC + b"\0" * 12])
+def test_unknown_format_is_rejected(key, data):
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.decode_snapshot(data, key, now=NOW)
+    assert e.value.reason == "unknown_format"
+
+def test_read_requires_key(monkeypatch, tmp_path):
+    monkeypatch.delenv("CONFIG_SNAPSHOT_KEY", raising=False)
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.read_snapshot(str(tmp_path / "config.snapshot"))
+    assert e.value.reason == "no_key"
+
+def test_written_file_is_owner_only(key, tmp_path):
+    path = str(tmp_path / "config.snapshot")
+    config_snapshot.write_snapshot(path, PAYLOAD, key)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert config_snapshot.read_snapshot(path, key, now=NOW) == PAYLOAD
+
+# --- 参照先の確認 (config のインポート時、.env の内容を適用する前) ---
+DIRECT_ENVIRON = {"DIRECT_JWT_SECRET_KEY": "secret", "DIRECT_FUNCTION_BASE_URL": "http://localhost:8080"}
+
+def source_payload(env_type, environ, gcp_project_id=None):
+    return {"env_type": env_type, "gcp_project_id": gcp_project_id, "environ": environ,
+            "source": config_snapshot.source_fingerprint(env_type, environ)}
+
+def test_check_source_accepts_same_source():
+    config_snapshot.check_source(source_payload("local_direct", DIRECT_ENVIRON), "local_direct", {"ENV": "local_direct"})
+    payload = source_payload("prod", {"SM_NAME_FOR_JWT_SECRET_KEY": "jwt"}, gcp_project_id="project")
+    config_snapshot.check_source(payload, "prod", {"GCP_PROJECT": "project"})
+
+def test_check_source_rejects_other_mode():
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.check_source(source_payload("local_direct", DIRECT_ENVIRON), "prod", {})
+    assert e.value.reason == "mode_mismatch (local_direct)"
+
+def test_check_source_rejects_changed_direct_value():
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.check_source(source_payload("local_direct", DIRECT_ENVIRON), "local_direct",
+                                     {"DIRECT_FUNCTION_BASE_URL": "https://auth.example.com"})
+    assert e.value.reason == "source_mismatch"
+
+@pytest.mark.parametrize("environ", [{}, {"GCP_PROJECT": "other-project"}])
+def test_check_source_takes_gcp_project_from_real_environ(environ):
+    # スナップショット自身の .env の内容にある GCP_PROJECT は参照先の確認に使わない
+    payload = source_payload("prod", {"GCP_PROJECT": "project"}, gcp_project_id="project")
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.check_source(payload, "prod", environ)
+    assert e.value.reason == "source_mismatch"
+
+def test_check_source_rejects_changed_secret_name():
+    payload = source_payload("prod", {}, gcp_project_id="project")
+    with pytest.raises(config_snapshot.SnapshotError) as e:
+        config_snapshot.check_source(payload, "prod", {"GCP_PROJECT": "project", "SM_NAME_FOR_JWT_SECRET_KEY": "other"})
+    assert e.value.reason == "source_mismatch"
+
+IMPORT_CONFIG = """
+import json, os, sys
+import config
+print(json.dumps({"applied": os.environ.get("SNAPSHOT_MARKER"), "dotenv_loaded": "dotenv" in sys.modules,
+                  "values": config._snapshot_values(os.environ.get("ENV", "prod"))}))
+"""
+
+def import_config(tmp_path, payload, env):
+    """新しいプロセスで config をインポートし、.env の内容の適用と設定値の使用を確認します。"""
+    key = "test-snapshot-key"
+    path = str(tmp_path / "config.snapshot")
+    config_snapshot.write_snapshot(path, payload, config_snapshot.snapshot_key(key))
+    env = {**{k: v for k, v in os.environ.items() if not k.startswith(("DIRECT_", "SM_NAME_FOR_", "ENV", "GCP_PROJECT"))},
+           "CONFIG_INIT_MODE": "lazy", "CONFIG_SNAPSHOT_KEY": key, "CONFIG_SNAPSHOT_FILE": path, **env}
+    proc = subprocess.run([sys.executable, "-c", IMPORT_CONFIG], cwd=os.path.join(os.path.dirname(__file__), ".."),
+                          env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def direct_snapshot():
+    environ = {**DIRECT_ENVIRON, "SNAPSHOT_MARKER": "1"}
+    return {**source_payload("local_direct", environ), "secret_names": {}, "values": {"jwt_secret_key": "secret"},
+            "created_at": 0, "expires_at": 2 ** 40}
+
+def test_import_applies_snapshot_for_same_mode_and_source(tmp_path):
+    result = import_config(tmp_path, direct_snapshot(), {"ENV": "local_direct"})
+    assert result == {"applied": "1", "dotenv_loaded": False, "values": {"jwt_secret_key": "secret"}}
+
+@pytest.mark.parametrize("env", [
+    {"ENV": "prod"}, # モードが異なる
+    {"ENV": "prod", "ENV_ARG": "local_sm_test"}, # ENV_ARG (main.py の --mode) を優先する
+    {"ENV": "local_direct", "DIRECT_JWT_SECRET_KEY": "changed"}, # DIRECT_* の値が異なる
+])
+def test_import_uses_dotenv_when_snapshot_is_rejected(tmp_path, env):
+    result = import_config(tmp_path, direct_snapshot(), env)
+    assert result == {"applied": None, "dotenv_loaded": True, "values": None}
+
+def test_import_rejects_gcp_project_from_snapshot_only(tmp_path):
+    payload = {**source_payload("prod", {"GCP_PROJECT": "project", "SNAPSHOT_MARKER": "1"}, gcp_project_id="project"),
+               "secret_names": {}, "values": {}, "created_at": 0, "expires_at": 2 ** 40}
+    result = import_config(tmp_path, payload, {"ENV": "prod"})
+    assert result == {"applied": None, "dotenv_loaded": True, "values": None}
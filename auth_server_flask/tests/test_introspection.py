@@ -0,0 +1,77 @@
+# auth_server_flask/tests/test_introspection.py
+
+import asyncio
+import threading
+import time
+
+import jwt
+import pytest
+
+import auth_utils
+import introspection
+from support import APP_URL, FUNCTION_BASE_URL, SERVICE_API_KEY
+
+SERVICE_AUTH = {"Authorization": f"Bearer {SERVICE_API_KEY}"}
+
+def unknown_kid_token():
+    return jwt.encode({"sub": "alice@example.com", "iss": FUNCTION_BASE_URL, "aud": APP_URL,
+                       "exp": int(time.time()) + 60}, "other-secret-0123456789abcdef01234567",
+                      algorithm="HS256", headers={"kid": "unknown"})
+
+def valid_token(cfg):
+    return auth_utils.create_custom_jwt("alice@example.com", "Alice", FUNCTION_BASE_URL, APP_URL, cfg.key_ring)
+
+def test_introspect_valid_token_is_active(client, auth_config):
+    response = client.post("/auth/introspect", data={"token": valid_token(auth_config)}, headers=SERVICE_AUTH)
+    assert response.status_code == 200
+    assert response.get_json()["active"] is True and response.get_json()["sub"] == "alice@example.com"
+
+def test_introspect_unknown_kid_is_inactive(client):
+    response = client.post("/auth/introspect", data={"token": unknown_kid_token()}, headers=SERVICE_AUTH)
+    assert response.status_code == 200
+    assert response.get_json() == {"active": False}
+
+def test_introspect_batch_unknown_kid_is_inactive(client, auth_config):
+    response = client.post("/auth/introspect:batch", headers=SERVICE_AUTH,
+                           json={"tokens": [unknown_kid_token(), valid_token(auth_config)]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0] == {"active": False} and results[1]["active"] is True
+
+def asgi_introspect(token):
+    httpx = pytest.importorskip("httpx")
+    pytest.importorskip("asgiref")
+    import asgi_app
+
+    async def post():
+        transport = httpx.ASGITransport(app=asgi_app.AuthASGIApp(asgi_app.flask_app))
+        async with httpx.AsyncClient(transport=transport, base_url=FUNCTION_BASE_URL) as http:
+            return await http.post("/auth/introspect", data={"token": token}, headers=SERVICE_AUTH)
+
+    return asyncio.run(post())
+
+def test_asgi_introspect_unknown_kid_is_inactive(published_config):
+    response = asgi_introspect(unknown_kid_token())
+    assert response.status_code == 200
+    assert response.json() == {"active": False}
+
+def test_asgi_introspect_verifies_off_the_event_loop(published_config, monkeypatch):
+    introspector = introspection.get_introspector()
+    original, threads = introspector.introspect, []
+
+    def recording_introspect(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(introspector, "introspect", recording_introspect)
+    response = asgi_introspect(valid_token(published_config))
+    assert response.json()["active"] is True
+    assert threads and threads[0] is not threading.main_thread()
+
+def test_introspector_treats_any_jwt_error_as_inactive(auth_config, monkeypatch):
+    # InvalidKeyError などは PyJWTError だが InvalidTokenError ではない
+    def raise_invalid_key(*args, **kwargs):
+        raise jwt.InvalidKeyError("unusable key")
+    monkeypatch.setattr(auth_utils, "verify_custom_jwt", raise_invalid_key)
+    result, _ = introspection.TokenIntrospector().introspect("a.b.c", auth_config, lambda jti: False)
+    assert result == {"active": False}
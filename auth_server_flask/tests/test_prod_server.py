@@ -0,0 +1,72 @@
+# auth_server_flask/tests/test_prod_server.py
+
+import os
+import sys
+import types
+
+import pytest
+
+import prod_server
+import ratelimit
+import refresh_tokens
+import revocation
+
+@pytest.fixture
+def unconfigured_stores(monkeypatch, tmp_path):
+    """共有のストアがどれも未設定の状態 (環境変数なし・初回の使用前)。"""
+    monkeypatch.setattr(refresh_tokens, "_refresh_token_service", None)
+    monkeypatch.setattr(refresh_tokens, "_refresh_token_service_resolved", False)
+    monkeypatch.setattr(refresh_tokens, "REFRESH_TOKEN_DB", None)
+    monkeypatch.setattr(revocation, "_revocation_service", None)
+    monkeypatch.setattr(revocation, "REVOCATION_FILE", None)
+    monkeypatch.setattr(ratelimit, "_rate_limiter", None)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_DB", None)
+    monkeypatch.setattr(prod_server, "PROD_SERVER_STATE_DIR", str(tmp_path / "state"))
+    return tmp_path / "state"
+
+def test_use_shared_stores_defaults_every_store_to_state_dir(unconfigured_stores):
+    prod_server.use_shared_stores(prod_server.shared_state_dir(8080))
+    assert refresh_tokens.REFRESH_TOKEN_DB == str(unconfigured_stores / "refresh_tokens.db")
+    assert revocation.REVOCATION_FILE == str(unconfigured_stores / "revoked.jsonl")
+    assert ratelimit.RATE_LIMIT_DB == str(unconfigured_stores / "rate_limit.db")
+    assert isinstance(ratelimit.get_rate_limiter().backend, ratelimit.SQLiteRateLimitBackend)
+
+def test_use_shared_stores_keeps_configured_paths(unconfigured_stores, monkeypatch, tmp_path):
+    monkeypatch.setattr(revocation, "REVOCATION_FILE", str(tmp_path / "shared-revoked.jsonl"))
+    prod_server.use_shared_stores(prod_server.shared_state_dir(8080))
+    assert revocation.REVOCATION_FILE == str(tmp_path / "shared-revoked.jsonl")
+
+def test_use_shared_stores_refuses_explicit_in_process_store(unconfigured_stores, monkeypatch):
+    monkeypatch.setattr(revocation, "_revocation_service",
+                        revocation.RevocationService(revocation.InMemoryRevocationBackend()))
+    with pytest.raises(RuntimeError, match="REVOCATION_FILE"):
+        prod_server.use_shared_stores(prod_server.shared_state_dir(8080))
+
+def test_shared_state_dir_rejects_directory_accessible_by_others(monkeypatch, tmp_path):
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    os.chmod(state_dir, 0o777)
+    monkeypatch.setattr(prod_server, "PROD_SERVER_STATE_DIR", str(state_dir))
+    with pytest.raises(RuntimeError):
+        prod_server.shared_state_dir(8080)
+
+def test_run_serves_the_callers_app(monkeypatch):
+    class FakeBaseApplication:
+        def __init__(self):
+            self.cfg = types.SimpleNamespace(set=lambda key, value: None)
+            self.load_config()
+
+        def run(self):
+            loaded.append(self.load()) # preload_app と同じく、マスターで1回だけ読み込む
+
+    loaded = []
+    base = types.ModuleType("gunicorn.app.base")
+    base.BaseApplication = FakeBaseApplication
+    monkeypatch.setitem(sys.modules, "gunicorn", types.ModuleType("gunicorn"))
+    monkeypatch.setitem(sys.modules, "gunicorn.app", types.ModuleType("gunicorn.app"))
+    monkeypatch.setitem(sys.modules, "gunicorn.app.base", base)
+    monkeypatch.setattr(prod_server, "warm_up", lambda mode: None)
+    monkeypatch.setattr(prod_server, "_freeze_shared_objects", lambda: None)
+    app = object()
+    prod_server.run(app, "local_direct", workers=1)
+    assert loaded == [app]
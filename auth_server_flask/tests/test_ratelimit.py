@@ -0,0 +1,122 @@
+# auth_server_flask/tests/test_ratelimit.py
+
+import asyncio
+import threading
+
+import pytest
+
+import auth_routes
+import ratelimit
+from support import FUNCTION_BASE_URL
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_sqlite_backend_is_shared_between_processes(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "rate_limit.db")
+    # 同じファイルを開いた2つのバックエンド (gunicorn の2ワーカーに相当) で1つのバケットを共有する
+    workers = [ratelimit.SQLiteRateLimitBackend(path, clock=clock) for _ in range(2)]
+    results = [workers[i % 2].acquire("ip:203.0.113.1", 1.0, 3) for i in range(4)]
+    assert results[:3] == [0.0, 0.0, 0.0]
+    assert results[3] > 0
+    clock.now += 1.0
+    assert workers[1].acquire("ip:203.0.113.1", 1.0, 3) == 0.0
+
+def test_sqlite_backend_prunes_full_buckets(tmp_path):
+    clock = FakeClock()
+    backend = ratelimit.SQLiteRateLimitBackend(str(tmp_path / "rate_limit.db"), clock=clock)
+    backend.acquire("ip:203.0.113.1", 1.0, 3)
+    clock.now += ratelimit.RATE_LIMIT_DB_PRUNE_INTERVAL_SECONDS
+    backend.acquire("ip:203.0.113.2", 1.0, 3)
+    keys = [row[0] for row in backend._conn.execute("SELECT key FROM rate_limit")]
+    assert keys == ["ip:203.0.113.2"]
+
+def test_bucket_allows_burst_then_one_per_interval():
+    table = ratelimit.TokenBucketTable(16)
+    now = 1000.0
+    assert [table.acquire("k", 2.0, 5, now) for _ in range(5)] == [0.0] * 5
+    assert table.acquire("k", 2.0, 5, now) == pytest.approx(0.5) # 次のトークンまで 1/rate 秒
+    assert table.acquire("k", 2.0, 5, now + 0.5) == 0.0
+    assert table.acquire("k", 2.0, 5, now + 0.5) == pytest.approx(0.5)
+    assert table.acquire("other", 2.0, 5, now) == 0.0 # キーごとに独立
+
+def test_bucket_refills_to_burst_only():
+    table = ratelimit.TokenBucketTable(16)
+    table.acquire("k", 1.0, 3, 1000.0)
+    later = 10_000.0 # 長時間空いてもバケットは burst を超えて貯まらない
+    assert [table.acquire("k", 1.0, 3, later) == 0.0 for _ in range(4)] == [True, True, True, False]
+
+def test_table_eviction_prefers_full_buckets():
+    table = ratelimit.TokenBucketTable(2)
+    now = 1000.0
+    table.acquire("idle", 1.0, 2, now - 100) # 満杯に戻っている
+    for _ in range(2):
+        table.acquire("busy", 1.0, 2, now)   # 使い切っている
+    assert table.acquire("busy", 1.0, 2, now) > 0
+    table.acquire("new", 1.0, 2, now)
+    assert len(table) == 2
+    assert table.acquire("busy", 1.0, 2, now) > 0 # 使い切った状態を失わない
+
+def test_limiter_checks_backend_and_fails_open():
+    class FailingBackend:
+        def acquire(self, key, rate, burst):
+            raise ConnectionError("backend down")
+
+    class DenyingBackend:
+        def acquire(self, key, rate, burst):
+            return 7.0
+
+    limits = {ratelimit.SCOPE_IP: ratelimit.RateLimit(1.0, 5, 16)}
+    assert ratelimit.RateLimiter(limits, backend=FailingBackend()).retry_after(ratelimit.SCOPE_IP, "k") == 0.0
+    assert ratelimit.RateLimiter(limits, backend=DenyingBackend()).retry_after(ratelimit.SCOPE_IP, "k") == 7.0
+    assert ratelimit.RateLimiter(limits).retry_after(ratelimit.SCOPE_CLIENT, "k") == 0.0 # 無効なスコープ
+
+@pytest.mark.parametrize("remote_addr, forwarded_for, trusted_proxies, expected", [
+    ("10.0.0.1", "198.51.100.7", 0, "10.0.0.1"),                  # プロキシを信頼しない
+    ("10.0.0.1", "1.2.3.4, 198.51.100.7", 1, "198.51.100.7"),     # 左端はクライアントが偽装できる
+    ("10.0.0.1", "1.2.3.4, 198.51.100.7, 10.0.0.2", 2, "198.51.100.7"),
+    ("10.0.0.1", "198.51.100.7", 2, "10.0.0.1"),                  # 段数が足りない
+    ("2001:db8:1:2:3:4:5:6", None, 0, "2001:db8:1:2::"),          # IPv6 は /64 単位
+])
+def test_client_ip(remote_addr, forwarded_for, trusted_proxies, expected):
+    assert ratelimit.client_ip(remote_addr, forwarded_for, trusted_proxies) == expected
+
+@pytest.mark.parametrize("wait, expected", [(0.01, "1"), (1.0, "1"), (1.2, "2")])
+def test_retry_after_header(wait, expected):
+    assert ratelimit.retry_after_header(wait) == expected
+
+def test_login_is_rate_limited_per_ip(client, monkeypatch):
+    monkeypatch.setattr(ratelimit, "_rate_limiter", ratelimit.RateLimiter(
+        {ratelimit.SCOPE_IP: ratelimit.RateLimit(1 / 60, 2, 16)}))
+    statuses = [client.get("/auth/login").status_code for _ in range(3)]
+    assert statuses == [302, 302, 429]
+
+@pytest.mark.parametrize("backend, off_loop", [(None, False), (ratelimit.InMemoryRateLimitBackend(), False),
+                                               ("sqlite", True)])
+def test_asgi_checks_shared_backend_off_the_event_loop(published_config, monkeypatch, tmp_path, backend, off_loop):
+    httpx = pytest.importorskip("httpx")
+    pytest.importorskip("asgiref")
+    import asgi_app
+    if backend == "sqlite":
+        backend = ratelimit.SQLiteRateLimitBackend(str(tmp_path / "rate_limit.db"))
+    monkeypatch.setattr(ratelimit, "_rate_limiter", ratelimit.RateLimiter(ratelimit.default_limits(), backend=backend))
+    original, threads = auth_routes.rate_limit_retry_after, []
+
+    def recording_retry_after(*args):
+        threads.append(threading.current_thread())
+        return original(*args)
+
+    monkeypatch.setattr(auth_routes, "rate_limit_retry_after", recording_retry_after)
+
+    async def login():
+        transport = httpx.ASGITransport(app=asgi_app.AuthASGIApp(asgi_app.flask_app))
+        async with httpx.AsyncClient(transport=transport, base_url=FUNCTION_BASE_URL) as http:
+            return await http.get("/auth/login")
+
+    assert asyncio.run(login()).status_code == 302
+    assert len(threads) == 1 and (threads[0] is not threading.main_thread()) == off_loop
@@ -0,0 +1,112 @@
+# auth_server_flask/tests/test_refresh_tokens.py
+
+import pytest
+
+import refresh_tokens
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def service(clock):
+    return refresh_tokens.RefreshTokenService(refresh_tokens.InMemoryRefreshTokenStore(), ttl_seconds=3600,
+                                              max_lifetime_seconds=86400, clock=clock)
+
+def test_login_code_expires_quickly(service, clock):
+    code = service.issue_login_code("alice@example.com", "Alice")
+    clock.now += refresh_tokens.LOGIN_CODE_TTL_SECONDS
+    with pytest.raises(refresh_tokens.RefreshTokenError) as e:
+        service.rotate(code)
+    assert e.value.reason == "expired"
+
+def test_login_code_exchange_issues_regular_refresh_token(service, clock):
+    code = service.issue_login_code("alice@example.com", "Alice")
+    record, refresh_token = service.rotate(code)
+    assert record.email == "alice@example.com"
+    clock.now += refresh_tokens.LOGIN_CODE_TTL_SECONDS + 60 # ログインコードより長く有効
+    assert service.rotate(refresh_token)[0].family_id == record.family_id
+
+def test_set_default_database_only_when_unset(monkeypatch, tmp_path):
+    monkeypatch.setattr(refresh_tokens, "_refresh_token_service", None)
+    monkeypatch.setattr(refresh_tokens, "_refresh_token_service_resolved", False)
+    monkeypatch.setattr(refresh_tokens, "REFRESH_TOKEN_DB", None)
+    path = str(tmp_path / "refresh_tokens.db")
+
+    assert refresh_tokens.set_default_database(path)
+    assert not refresh_tokens.set_default_database(str(tmp_path / "other.db"))
+    store = refresh_tokens.get_refresh_token_service().store
+    assert isinstance(store, refresh_tokens.SQLiteRefreshTokenStore) and store.path == path
+
+def test_set_default_database_keeps_configured_store(monkeypatch, tmp_path):
+    # conftest.py の fresh_services でプロセス内のストアを設定済み
+    assert not refresh_tokens.set_default_database(str(tmp_path / "refresh_tokens.db"))
+    assert isinstance(refresh_tokens.get_refresh_token_service().store, refresh_tokens.InMemoryRefreshTokenStore)
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return refresh_tokens.InMemoryRefreshTokenStore()
+    return refresh_tokens.SQLiteRefreshTokenStore(str(tmp_path / "refresh_tokens.db"))
+
+def test_rotation_issues_new_token_and_consumes_old(store, clock):
+    service = refresh_tokens.RefreshTokenService(store, ttl_seconds=3600, max_lifetime_seconds=86400, clock=clock)
+    first = service.issue("alice@example.com", "Alice")
+    record, second = service.rotate(first)
+    assert second != first and record.email == "alice@example.com"
+    assert store.get(refresh_tokens.hash_refresh_token(first)).used
+    assert service.rotate(second)[0].family_id == record.family_id
+
+def test_reuse_revokes_whole_family(store, clock):
+    service = refresh_tokens.RefreshTokenService(store, ttl_seconds=3600, max_lifetime_seconds=86400, clock=clock)
+    first = service.issue("alice@example.com", "Alice")
+    _, second = service.rotate(first)
+    with pytest.raises(refresh_tokens.RefreshTokenError) as e:
+        service.rotate(first) # 盗まれたトークンの再利用
+    assert e.value.reason == "reused"
+    with pytest.raises(refresh_tokens.RefreshTokenError) as e:
+        service.rotate(second) # 正規のクライアントのトークンも無効
+    assert e.value.reason == "invalid"
+
+def test_sliding_expiry_is_capped_by_max_lifetime(service, clock):
+    logged_in_at = clock.now
+    token = service.issue("alice@example.com", "Alice")
+    while clock.now + 3000 < logged_in_at + 86400: # 有効期間 (1時間) 内に使えば延長される
+        clock.now += 3000
+        _, token = service.rotate(token)
+    clock.now = logged_in_at + 86400 # 最後のトークンの有効期間内だが、ログインから max_lifetime_seconds を超える
+    with pytest.raises(refresh_tokens.RefreshTokenError) as e:
+        service.rotate(token)
+    assert e.value.reason == "expired"
+
+def test_token_is_bound_to_namespace(service):
+    token = service.issue("alice@example.com", "Alice", namespace="tenant-a")
+    with pytest.raises(refresh_tokens.RefreshTokenError):
+        service.rotate(token) # 既定の設定
+    with pytest.raises(refresh_tokens.RefreshTokenError):
+        service.rotate(token, namespace="tenant-b")
+    assert service.rotate(token, namespace="tenant-a")[0].email == "alice@example.com"
+
+def test_revoke_invalidates_family(service):
+    token = service.issue("alice@example.com", "Alice")
+    _, newer = service.rotate(token)
+    assert service.revoke(token) is not None
+    with pytest.raises(refresh_tokens.RefreshTokenError):
+        service.rotate(newer)
+    assert service.revoke("unknown") is None
+
+def test_sqlite_mark_used_succeeds_once_across_connections(tmp_path, clock):
+    path = str(tmp_path / "refresh_tokens.db")
+    service = refresh_tokens.RefreshTokenService(refresh_tokens.SQLiteRefreshTokenStore(path), clock=clock)
+    token = service.issue("alice@example.com", "Alice")
+    token_hash = refresh_tokens.hash_refresh_token(token)
+    other_worker = refresh_tokens.SQLiteRefreshTokenStore(path)
+    assert other_worker.mark_used(token_hash)
+    assert not service.store.mark_used(token_hash)
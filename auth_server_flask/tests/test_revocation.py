@@ -0,0 +1,116 @@
+# auth_server_flask/tests/test_revocation.py
+
+import threading
+
+import revocation
+
+NOW = 1_000_000.0
+
+class FakeClock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_revocation_list_expires_entries():
+    clock = FakeClock()
+    revocations = revocation.RevocationList(capacity=100, clock=clock)
+    revocations.revoke("a", NOW + 10)
+    revocations.revoke("expired", NOW - 1)
+    assert revocations.is_revoked("a")
+    assert not revocations.is_revoked("expired")
+    assert not revocations.is_revoked("other")
+    clock.now = NOW + 11
+    revocations.prune()
+    assert not revocations.is_revoked("a")
+    assert len(revocations) == 0
+
+def test_in_memory_backend_drops_expired_entries():
+    clock = FakeClock()
+    backend = revocation.InMemoryRevocationBackend(clock=clock, compact_min_entries=16)
+    for i in range(1000):
+        backend.append(f"expired-{i}", NOW - 1) # 既に期限切れ
+    assert len(backend) == 0
+    entries, cursor = backend.read_since(None)
+    for i in range(1000):
+        backend.append(f"short-{i}", clock.now + 1)
+        clock.now += 1 # 追加したエントリはすぐに期限切れになる
+    backend.append("live", clock.now + 3600)
+    assert len(backend) <= 16
+    entries, cursor = backend.read_since(cursor)
+    assert entries[-1] == ("live", clock.now + 3600)
+    backend.append("next", clock.now + 3600)
+    assert backend.read_since(cursor) == ([("next", clock.now + 3600)], cursor + 1)
+
+def test_file_backend_reads_only_appended_entries(tmp_path):
+    backend = revocation.FileRevocationBackend(str(tmp_path / "revoked.jsonl"))
+    assert backend.read_since(None) == ([], None)
+    backend.append("a", NOW + 10)
+    entries, cursor = backend.read_since(None)
+    assert entries == [("a", NOW + 10)]
+    backend.append("b", NOW + 20)
+    entries, cursor = backend.read_since(cursor)
+    assert entries == [("b", NOW + 20)]
+    assert backend.read_since(cursor)[0] == []
+
+def test_file_backend_compact_respects_expired_ratio(tmp_path):
+    path = tmp_path / "revoked.jsonl"
+    backend = revocation.FileRevocationBackend(str(path))
+    backend.append("expired", NOW - 1)
+    for i in range(3):
+        backend.append(f"live{i}", NOW + 10)
+    assert backend.compact(NOW, min_expired_ratio=0.5) == 0 # 1/4 < 0.5
+    assert backend.compact(NOW, min_expired_ratio=0.25) == 1
+    assert [jti for jti, _ in backend.read_since(None)[0]] == ["live0", "live1", "live2"]
+    assert backend.compact(NOW) == 0 # 期限切れがなければ作り直さない
+
+def test_service_rereads_compacted_file_without_losing_entries(tmp_path):
+    path = str(tmp_path / "revoked.jsonl")
+    writer = revocation.FileRevocationBackend(path)
+    reader = revocation.RevocationService(revocation.FileRevocationBackend(path), sync_interval_seconds=0)
+    writer.append("expired", NOW - 1)
+    writer.append("a", 4_000_000_000)
+    reader.sync()
+    assert writer.compact(NOW) == 1
+    writer.append("b", 4_000_000_000)
+    reader.sync()
+    assert reader.is_revoked("a") and reader.is_revoked("b")
+
+def test_service_compacts_on_schedule(tmp_path):
+    backend = revocation.FileRevocationBackend(str(tmp_path / "revoked.jsonl"))
+    service = revocation.RevocationService(backend, sync_interval_seconds=0, compact_interval_seconds=60,
+                                           compact_min_expired_ratio=0.5)
+    backend.append("expired1", NOW - 2)
+    backend.append("expired2", NOW - 1)
+    backend.append("live", NOW + 3600)
+    assert service.maybe_compact(NOW) == 2
+    backend.append("expires_soon", NOW + 1)
+    assert service.maybe_compact(NOW + 30) == 0 # 間隔内は確認しない
+    backend.append("live2", NOW + 3600)
+    assert service.maybe_compact(NOW + 61) == 0 # 期限切れは 1/3 (min_expired_ratio 未満)
+    assert [jti for jti, _ in backend.read_since(None)[0]] == ["live", "expires_soon", "live2"]
+
+def test_compact_does_not_drop_concurrent_appends(tmp_path):
+    path = str(tmp_path / "revoked.jsonl")
+    compactor = revocation.FileRevocationBackend(path)
+    writer = revocation.FileRevocationBackend(path) # 別プロセスの代わり (別々に開いたファイルのロックは競合する)
+    for i in range(50):
+        compactor.append(f"expired{i}", NOW - 1)
+    stop = threading.Event()
+
+    def compact_repeatedly():
+        while not stop.is_set():
+            compactor.append("expired", NOW - 1)
+            compactor.compact(NOW)
+
+    thread = threading.Thread(target=compact_repeatedly)
+    thread.start()
+    try:
+        for i in range(300):
+            writer.append(f"live{i}", 4_000_000_000)
+    finally:
+        stop.set()
+        thread.join()
+    live = {jti for jti, _ in writer.read_since(None)[0] if jti.startswith("live")}
+    assert live == {f"live{i}" for i in range(300)}
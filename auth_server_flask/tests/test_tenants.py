@@ -0,0 +1,76 @@
+# auth_server_flask/tests/test_tenants.py
+
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import auth_routes
+import auth_utils
+import refresh_tokens
+import tenants
+from support import FUNCTION_BASE_URL
+
+TENANT_APP_URL = "https://tenant-a.example.com"
+TENANTS = {
+    "tenant-a": {"streamlit_app_url": TENANT_APP_URL, "allowed_users": "bob@example.net"},
+    "broken": {"allowed_users": "bob@example.net"}, # streamlit_app_url がない
+}
+
+@pytest.fixture(autouse=True)
+def tenant_source(monkeypatch):
+    source = tenants.InMemoryTenantSource(TENANTS)
+    monkeypatch.setattr(tenants, "_tenant_registry", tenants.TenantRegistry(source))
+    return source
+
+@pytest.mark.parametrize("path, expected", [
+    ("/t/tenant-a/auth/login", ("tenant-a", "/auth/login")),
+    ("/t/tenant-a", ("tenant-a", "/")),
+    ("/auth/login", (None, "/auth/login")),
+])
+def test_split_tenant_path(path, expected):
+    assert tenants.split_tenant_path(path) == expected
+
+@pytest.mark.parametrize("tenant_id", ["", "Tenant-A", "-a", "a/b", "..", "a" * 64, "a_b"])
+def test_invalid_tenant_ids(tenant_id):
+    assert not tenants.is_valid_tenant_id(tenant_id)
+
+def test_tenant_config_is_isolated_from_default(auth_config):
+    tenant = tenants.resolve_config(auth_config, "tenant-a")
+    assert tenant.tenant_id == "tenant-a"
+    assert tenant.function_base_url == f"{FUNCTION_BASE_URL}/t/tenant-a"
+    assert tenant.streamlit_app_url == TENANT_APP_URL
+    assert tenant.oauth_state_key != auth_config.oauth_state_key
+    assert tenant.allow_list.is_allowed("bob@example.net") and not tenant.allow_list.is_allowed("alice@example.com")
+
+@pytest.mark.parametrize("tenant_id", ["unknown", "broken", "Bad"])
+def test_unknown_or_invalid_tenant_is_rejected(auth_config, tenant_id):
+    with pytest.raises(tenants.UnknownTenantError):
+        tenants.resolve_config(auth_config, tenant_id)
+
+def test_unknown_tenant_route_is_404(client):
+    assert client.get("/t/unknown/auth/login").status_code == 404
+
+def test_state_from_one_tenant_is_rejected_by_another(client, auth_config):
+    response = client.get("/t/tenant-a/auth/login")
+    assert response.status_code == 302
+    state = parse_qs(urlsplit(response.headers["Location"]).query)["state"][0]
+    tenant = tenants.resolve_config(auth_config, "tenant-a")
+    assert auth_utils.verify_oauth_state_token(state, tenant.oauth_state_key)["r"] == TENANT_APP_URL
+    assert client.get("/auth/callback", query_string={"state": state, "code": "x"}).status_code == 400
+
+def test_tenant_tokens_are_not_accepted_by_default_config(client, auth_config):
+    tenant = tenants.resolve_config(auth_config, "tenant-a")
+    bob = {"email": "bob@example.net", "email_verified": True, "name": "Bob"}
+    location, issued = auth_routes.complete_login(tenant, bob, TENANT_APP_URL)
+    login_code = parse_qs(urlsplit(location).query)["login_code"][0]
+    assert issued
+    # ほかのテナント (既定の設定) ではログインコードもリフレッシュトークンも使えない
+    rejected = client.post("/auth/refresh", data={"grant_type": "authorization_code", "code": login_code})
+    assert rejected.status_code == 400 and rejected.get_json()["error"] == "invalid_grant"
+    accepted = client.post("/t/tenant-a/auth/refresh", data={"grant_type": "authorization_code", "code": login_code})
+    assert accepted.status_code == 200
+    payload = auth_utils.verify_custom_jwt(accepted.get_json()["access_token"], tenant.key_ring,
+                                           tenant.function_base_url, tenant.streamlit_app_url)
+    assert payload["sub"] == "bob@example.net"
+    with pytest.raises(refresh_tokens.RefreshTokenError):
+        refresh_tokens.get_refresh_token_service().rotate(accepted.get_json()["refresh_token"])
@@ -0,0 +1,57 @@
+# benchmarks/bench_allowlist.py
+"""
+AllowList の判定コストのマイクロベンチマーク。
+
+エントリ数を 10 から 1,000,000 まで増やしても、1回あたりの判定時間がほぼ一定であることを確認します。
+
+    python benchmarks/bench_allowlist.py [--sizes 10,1000,100000,1000000] [--lookups 200000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+
+from allowlist import AllowList  # noqa: E402
+
+def build_rules(size):
+    # 完全一致のアドレスが大半で、ドメイン/サブドメイン/拒否ルールを少数含む構成
+    yield "@corp.example.com"
+    yield "@*.partner.example.org"
+    yield "!blocked@corp.example.com"
+    for i in range(size):
+        yield f"user{i}@tenant{i % 997}.example.net"
+
+def bench(size, lookups):
+    allow_list = AllowList.from_rules(build_rules(size))
+    cases = {
+        "exact_hit": f"USER{size // 2}@tenant{(size // 2) % 997}.example.net",
+        "domain_hit": "someone@corp.example.com",
+        "subdomain_hit": "someone@eu.dev.partner.example.org",
+        "deny_hit": "blocked@corp.example.com",
+        "miss": "nobody@unknown.example.com",
+    }
+    results = {}
+    for name, email in cases.items():
+        seconds = min(timeit.repeat(lambda: allow_list.is_allowed(email), number=lookups, repeat=3))
+        results[name] = seconds / lookups * 1e9
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,1000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    header = None
+    for size in sizes:
+        results = bench(size, args.lookups)
+        if header is None:
+            header = list(results)
+            print(f"{'entries':>10} " + " ".join(f"{name + ' (ns)':>18}" for name in header))
+        print(f"{size:>10} " + " ".join(f"{results[name]:>18.1f}" for name in header))
+
+if __name__ == "__main__":
+    main()
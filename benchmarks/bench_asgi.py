@@ -0,0 +1,128 @@
+# benchmarks/bench_asgi.py
+"""
+/auth/callback の同時実行スループットを、WSGI モード (Flask + スレッド方式のサーバー) と
+ASGI モード (asgi_app.py + uvicorn) で比較します。Google はローカルのスタブサーバーで代替し、
+トークンエンドポイントの応答に --google-latency-ms の遅延を入れて外部通信の待ち時間を再現します。
+
+サーバーはそれぞれ別プロセスで起動し、このプロセスから同時に --concurrency 件のコールバックを送ります。
+スタブと負荷生成はこのプロセスで動くため、CPU コアが少ないマシンではそちらが律速になり、差は出にくくなります。
+
+    python benchmarks/bench_asgi.py [--requests 500] [--concurrency 64] [--google-latency-ms 100]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "auth_server_flask")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+from stub_google import StubGoogleServer  # noqa: E402
+
+JWT_SECRET_KEY = "bench-secret-" + "x" * 32
+STREAMLIT_APP_URL = "http://localhost:8501"
+
+WSGI_SERVER = (
+    "import sys, config, main; config.initialize_app_configs('local_direct'); "
+    "from werkzeug.serving import run_simple; "
+    "run_simple('127.0.0.1', int(sys.argv[1]), main.app, threaded=True)"
+)
+ASGI_SERVER = (
+    "import sys, uvicorn, asgi_app; "
+    "uvicorn.run(asgi_app.app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')"
+)
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_until_ready(base_url, timeout=30):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base_url}/.well-known/jwks.json", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+def run(label, server_code, env, args):
+    import requests
+    import auth_utils
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(env, DIRECT_FUNCTION_BASE_URL=base_url)
+    server = subprocess.Popen([sys.executable, "-c", server_code, str(port)], cwd=SERVER_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until_ready(base_url)
+        state_key = auth_utils.derive_oauth_state_key(JWT_SECRET_KEY)
+        states = [auth_utils.create_oauth_state_token(state_key) for _ in range(args.requests + args.concurrency)]
+        local = threading.local()
+        latencies = []
+
+        def one(state):
+            session = getattr(local, "session", None)
+            if session is None:
+                session = local.session = requests.Session()
+            t0 = time.perf_counter()
+            response = session.get(f"{base_url}/auth/callback", params={"state": state, "code": "bench"},
+                                   allow_redirects=False, timeout=60)
+            latencies.append(time.perf_counter() - t0)
+            assert response.status_code == 302 and "auth_token=" in response.headers["Location"], \
+                (response.status_code, response.headers.get("Location"))
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, states[:args.concurrency])) # ウォームアップ (接続の確立・証明書の取得)
+            latencies.clear()
+            t0 = time.perf_counter()
+            list(pool.map(one, states[args.concurrency:]))
+            elapsed = time.perf_counter() - t0
+        latencies.sort()
+        print(f"{label:>5}: {args.requests / elapsed:8.1f} callbacks/s  "
+              f"p50={statistics.median(latencies) * 1000:7.1f} ms  "
+              f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--google-latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    with StubGoogleServer(token_delay_seconds=args.google_latency_ms / 1000) as stub:
+        env = dict(
+            os.environ,
+            CONFIG_INIT_MODE="lazy",
+            ENV="local_direct",
+            GOOGLE_AUTH_URI=f"{stub.base_url}/auth",
+            GOOGLE_TOKEN_URI=f"{stub.base_url}/token",
+            GOOGLE_CERTS_URI=f"{stub.base_url}/certs",
+            DIRECT_GOOGLE_CLIENT_ID=stub.client_id,
+            DIRECT_GOOGLE_CLIENT_SECRET="stub-secret",
+            DIRECT_JWT_SECRET_KEY=JWT_SECRET_KEY,
+            DIRECT_STREAMLIT_APP_URL=STREAMLIT_APP_URL,
+            DIRECT_ALLOWED_USERS_LIST_STR="@example.com",
+            RATE_LIMIT_IP_PER_MINUTE="0", # 全リクエストが同じIP・OAuth クライアントのため、レート制限は無効にして計測する
+            RATE_LIMIT_CLIENT_PER_SECOND="0",
+        )
+        print(f"{args.requests} callbacks, concurrency {args.concurrency}, "
+              f"Google token endpoint latency {args.google_latency_ms:.0f} ms")
+        run("wsgi", WSGI_SERVER, env, args)
+        run("asgi", ASGI_SERVER, env, args)
+
+if __name__ == "__main__":
+    main()
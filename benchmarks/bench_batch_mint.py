@@ -0,0 +1,70 @@
+# benchmarks/bench_batch_mint.py
+"""
+トークン発行のスループット (tokens/sec) をアルゴリズム・バッチサイズごとに計測します。
+
+- single: create_custom_jwt を1件ずつ呼び出す従来方式 (ログ出力は /dev/null へ)
+- batch: auth_utils.mint_tokens_batch (共通ヘッダー・時刻、準備済みの鍵)
+- batch xN: 非対称鍵の署名を N プロセスで並列化
+
+乱数シードを固定した鍵は使わないため、絶対値はマシンに依存します。比較は同一マシン上で行ってください。
+
+    python benchmarks/bench_batch_mint.py [--algorithms HS256,ES256,RS256,EdDSA] [--batch-sizes 10,100,1000]
+                                          [--processes 4]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+import auth_utils  # noqa: E402
+from bench_jwt_signing import AUDIENCE, ISSUER, key_spec  # noqa: E402
+from signing_keys import KeyRing  # noqa: E402
+
+def tokens_per_second(func, count, min_seconds=0.5):
+    iterations = 0
+    t0 = time.perf_counter()
+    while True:
+        func()
+        iterations += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_seconds:
+            return iterations * count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--algorithms", default="HS256,ES256,RS256,EdDSA")
+    parser.add_argument("--batch-sizes", default="10,100,1000")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print(f"{'alg':>6} {'batch':>6} {'single/s':>10} {'batch/s':>10} {f'batch x{args.processes}/s':>14}")
+    for algorithm in args.algorithms.split(","):
+        spec = key_spec(algorithm)
+        key_ring = KeyRing.from_spec({"primary": spec["kid"], "keys": [spec]})
+        for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+            subjects = [f"user{i}@example.com" for i in range(batch_size)]
+
+            def single():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for email in subjects:
+                        auth_utils.create_custom_jwt(email, email, ISSUER, AUDIENCE, key_ring)
+
+            def batch():
+                auth_utils.mint_tokens_batch(subjects, ISSUER, AUDIENCE, key_ring)
+
+            def batch_parallel():
+                auth_utils.mint_tokens_batch(subjects, ISSUER, AUDIENCE, key_ring, processes=args.processes)
+
+            batch_parallel() # プロセスプールの起動をウォームアップ
+            results = [tokens_per_second(f, batch_size) for f in (single, batch, batch_parallel)]
+            print(f"{algorithm:>6} {batch_size:>6} " + " ".join(f"{r:>10.0f}" for r in results[:2])
+                  + f" {results[2]:>14.0f}")
+
+if __name__ == "__main__":
+    main()
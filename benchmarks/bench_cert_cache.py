@@ -0,0 +1,68 @@
+# benchmarks/bench_cert_cache.py
+"""
+google_certs.CertCache の動作確認とベンチマーク (ローカルの鍵ローテーション可能な証明書エンドポイントを使用)。
+
+1. キャッシュ済みの鍵での ID トークン検証のコスト
+2. 鍵のローテーション後、多数のスレッドが同時に未知の kid を持つトークンを検証しても、
+   証明書の取得が1回だけであること (single-flight)
+
+    python benchmarks/bench_cert_cache.py [--verifications 2000] [--threads 64]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+from stub_google import StubGoogleServer  # noqa: E402
+import google_certs  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verifications", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=64)
+    args = parser.parse_args()
+
+    with StubGoogleServer() as stub:
+        cache = google_certs.CertCache(url=f"{stub.base_url}/certs")
+        token = stub.issue_id_token()
+        google_certs.verify_google_id_token(token, stub.client_id, cache) # ウォームアップ
+
+        t0 = time.perf_counter()
+        for _ in range(args.verifications):
+            google_certs.verify_google_id_token(token, stub.client_id, cache)
+        elapsed = time.perf_counter() - t0
+        print(f"cached verify: {elapsed / args.verifications * 1e6:.1f} us/token "
+              f"(cert fetches so far: {stub.requests['certs']})")
+
+        # 鍵のローテーション: 新しい kid で署名されたトークンを同時に検証する
+        stub.rotate_keys()
+        rotated_token = stub.issue_id_token()
+        fetches_before = stub.requests["certs"]
+        barrier = threading.Barrier(args.threads)
+        errors = []
+
+        def verify():
+            barrier.wait()
+            try:
+                google_certs.verify_google_id_token(rotated_token, stub.client_id, cache)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=verify) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        fetches = stub.requests["certs"] - fetches_before
+        print(f"after rotation: {args.threads} concurrent verifications -> {fetches} cert fetch(es), "
+              f"{len(errors)} error(s)")
+        if fetches != 1 or errors:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/bench_config_snapshot.py
+"""
+設定のスナップショット (config_snapshot.py) による起動時間の比較。
+
+新しいPythonプロセスで、インポート開始から auth_http の最初のレスポンスまでの時間を経路ごとに計測します
+(CONFIG_INIT_MODE=lazy のため、設定の読み込みは最初のリクエストで行われます)。
+
+    secret_manager  local_sm_test モード。Secret Manager の代わりに 1 シークレットあたり --secret-latency-ms 待つ
+                    インメモリのバックエンドを使い、クライアントライブラリ (google.cloud.secretmanager) のインポートも含めます
+    snapshot        同じ設定から作成したスナップショット (CONFIG_SNAPSHOT_FILE) から読み込みます
+    local_direct    local_direct モード (環境変数から読み込み、.env の読み込み処理を含む)
+    direct_snapshot local_direct モードのスナップショット (DIRECT_* は環境変数ではなく、.env の内容として記録したもの)
+
+    python benchmarks/bench_config_snapshot.py [--runs 5] [--secret-latency-ms 30] [--algorithm HS256]
+"""
+import argparse
+import json
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "auth_server_flask")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+GCP_PROJECT = "bench-project"
+DIRECT_ENV = {
+    "DIRECT_GOOGLE_CLIENT_ID": "bench-client-id",
+    "DIRECT_GOOGLE_CLIENT_SECRET": "bench-client-secret",
+    "DIRECT_JWT_SECRET_KEY": "bench-jwt-secret-0123456789abcdef0123456789",
+    "DIRECT_STREAMLIT_APP_URL": "http://localhost:8501",
+    "DIRECT_FUNCTION_BASE_URL": "http://localhost:8080",
+    "DIRECT_ALLOWED_USERS_LIST_STR": "@example.com",
+}
+
+# 別プロセスで実行する、インポートから最初のレスポンスまでの計測スクリプト
+CHILD_SCRIPT = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+import config
+if os.environ.get("BENCH_SECRETS"):
+    from google.cloud import secretmanager # 実際の経路と同じくクライアントライブラリを読み込む
+    latency = float(os.environ["BENCH_SECRET_LATENCY_MS"]) / 1000
+
+    class SlowInMemorySecretBackend(config.InMemorySecretBackend):
+        def access(self, secret_name):
+            time.sleep(latency)
+            return super().access(secret_name)
+
+    config.set_secret_backend(SlowInMemorySecretBackend(json.loads(os.environ["BENCH_SECRETS"])))
+import main
+t_import = time.perf_counter()
+from werkzeug.test import EnvironBuilder
+class _Request:
+    pass
+request_cf = _Request()
+request_cf.environ = EnvironBuilder(path="/auth/login", base_url="http://localhost:8080").get_environ()
+response = main.auth_http(request_cf)
+t_response = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t_import - t0) * 1000, "first_response_ms": (t_response - t0) * 1000,
+    "status": getattr(response, "status_code", None),
+    "dotenv_loaded": "dotenv" in sys.modules, "secret_manager_loaded": "google.cloud.secretmanager" in sys.modules,
+}))
+"""
+
+def sm_secrets(algorithm):
+    values = {
+        "GOOGLE_CLIENT_ID_PROD_SM": "bench-client.apps.googleusercontent.com",
+        "GOOGLE_CLIENT_SECRET_PROD_SM": "bench-client-secret",
+        "JWT_SECRET_KEY_PROD_SM": "bench-secret-0123456789abcdef0123456789",
+        "STREAMLIT_APP_URL_PROD_SM": "http://localhost:8501",
+        "FUNCTION_BASE_URL_PROD_SM": "http://localhost:8080",
+        "ALLOWED_USERS_LIST_PROD_SM": "@example.com",
+    }
+    if algorithm != "HS256":
+        from bench_jwt_signing import key_spec
+        spec = key_spec(algorithm)
+        values["JWT_SIGNING_KEYS_PROD_SM"] = json.dumps({"primary": spec["kid"], "keys": [spec]})
+    return values
+
+def base_env(algorithm):
+    env = dict(os.environ)
+    env.pop("CONFIG_SNAPSHOT_FILE", None)
+    env.update({"CONFIG_INIT_MODE": "lazy", "PYTHONDONTWRITEBYTECODE": "1", "GCP_PROJECT": GCP_PROJECT,
+                "RATE_LIMIT_IP_PER_MINUTE": "0", "RATE_LIMIT_CLIENT_PER_SECOND": "0"})
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if algorithm != "HS256":
+        env["SM_NAME_FOR_JWT_SIGNING_KEYS"] = "JWT_SIGNING_KEYS_PROD_SM"
+    return env
+
+def write_snapshots(tmp, algorithm, key):
+    """この (親) プロセスで各モードの設定を読み込み、スナップショットを書き出します。"""
+    os.environ.update({**base_env(algorithm), **DIRECT_ENV}) # 子プロセスと同じシークレット名・GCP プロジェクト
+    import config
+    import config_snapshot
+    paths = {}
+    config.set_secret_backend(config.InMemorySecretBackend(sm_secrets(algorithm)))
+    for mode, environ in (("local_sm_test", {}), ("local_direct", DIRECT_ENV)):
+        paths[mode] = os.path.join(tmp, f"{mode}.snapshot")
+        config_snapshot.write_snapshot(paths[mode], config.build_snapshot_payload(mode, environ, 3600),
+                                       config_snapshot.snapshot_key(key))
+    return paths
+
+def measure(env, runs):
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], cwd=SERVER_DIR, env=env,
+                              capture_output=True, text=True)
+        if proc.returncode:
+            raise RuntimeError(proc.stderr)
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--secret-latency-ms", type=float, default=30)
+    parser.add_argument("--algorithm", default="HS256", choices=["HS256", "RS256", "ES256", "EdDSA"])
+    args = parser.parse_args()
+
+    key = secrets.token_urlsafe(32)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_snapshots(tmp, args.algorithm, key)
+        env = base_env(args.algorithm)
+        paths_env = {"CONFIG_SNAPSHOT_KEY": key}
+        cases = {
+            "secret_manager": {**env, "ENV": "local_sm_test", "BENCH_SECRETS": json.dumps(sm_secrets(args.algorithm)),
+                               "BENCH_SECRET_LATENCY_MS": str(args.secret_latency_ms)},
+            "snapshot": {**env, **paths_env, "ENV": "local_sm_test", "CONFIG_SNAPSHOT_FILE": paths["local_sm_test"]},
+            "local_direct": {**env, **DIRECT_ENV, "ENV": "local_direct"},
+            "direct_snapshot": {**env, **paths_env, "ENV": "local_direct", "CONFIG_SNAPSHOT_FILE": paths["local_direct"]},
+        }
+        print(f"time to first auth_http response (median of {args.runs}, {args.algorithm}, "
+              f"secret latency {args.secret_latency_ms:g} ms)")
+        print(f"{'path':>16} {'import ms':>10} {'first response ms':>18}  status  dotenv  secretmanager")
+        for label, case_env in cases.items():
+            samples = measure(case_env, args.runs)
+            last = samples[-1]
+            print(f"{label:>16} {statistics.median(s['import_ms'] for s in samples):10.1f} "
+                  f"{statistics.median(s['first_response_ms'] for s in samples):18.1f}  {last['status']:>6}  "
+                  f"{str(last['dotenv_loaded']):>6}  {str(last['secret_manager_loaded']):>13}")
+
+if __name__ == "__main__":
+    main()
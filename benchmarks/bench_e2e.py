@@ -0,0 +1,415 @@
+# benchmarks/bench_e2e.py
+"""
+ログイン → コールバック → Streamlit でのトークン検証 までのエンドツーエンドの負荷試験 (オフラインで完結)。
+
+- Google: stub_google.StubGoogleServer (認可・トークン・証明書。RS256 で署名した ID トークンを発行)
+- Secret Manager: config.InMemorySecretBackend を config.set_secret_backend で差し替えます (local_sm_test モード)。
+  設定の読み込み・config.get_secret_from_sm ともにこのバックエンドを通ります。--secret-latency-ms で遅延を再現します。
+- 認証サーバー: このプロセスのスレッドで起動します (--server flask: Flask アプリを wsgiref のスレッド方式で / asgi: uvicorn)。
+- クライアント: ブラウザと同じ順にリダイレクトをたどる BrowserClient
+    login             GET /auth/login        → Google の認可URLへの 302
+    google_authorize  GET (スタブ) /auth      → /auth_callback への 302 (code, state)
+    callback          GET /auth_callback     → Streamlit への 302 (auth_token, login_code)
+    streamlit_verify  Streamlit 側の検証 (jwt_verifier.TokenVerifier。非対称鍵の場合は JWKS を認証サーバーから取得)
+
+結果:
+- フロー全体のスループット、ステップごとのレイテンシ (p50/p90/p99)
+- サーバー側のフェーズごとの処理時間 (observability のヒストグラム)
+- ステップごとのメモリ割り当て (tracemalloc を有効にした別パスで、1ステップ中の増加量のピークと残った量の中央値)
+
+--output で JSON に保存し、--compare で以前の結果 (別のコミットなど) と比較します。
+悪化が --max-regression (割合) を超えた項目があれば終了コード 1 で終了します。
+クライアントとサーバーが同じプロセス・CPU を使うため、絶対値ではなく同じマシンでの比較に使ってください。
+
+    python benchmarks/bench_e2e.py [--flows 500] [--concurrency 8] [--server flask|asgi] [--algorithm ES256]
+        [--google-latency-ms 0] [--secret-latency-ms 0] [--alloc-flows 20]
+        [--output result.json] [--compare baseline.json] [--max-regression 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "streamlit_app"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+from stub_google import StubGoogleServer  # noqa: E402
+
+STEPS = ("login", "google_authorize", "callback", "streamlit_verify")
+STREAMLIT_APP_URL = "http://localhost:8501"
+GCP_PROJECT = "bench-project"
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _percentile(sorted_values, ratio):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+# --- Secret Manager の代替 ---
+def make_secret_backend(stub, function_base_url, signing_key_spec, latency_seconds):
+    """local_sm_test モードの既定のシークレット名 (*_PROD_SM) で値を持つインメモリバックエンド。"""
+    import config
+
+    class SlowInMemorySecretBackend(config.InMemorySecretBackend):
+        def access(self, secret_name):
+            if latency_seconds:
+                time.sleep(latency_seconds)
+            return super().access(secret_name)
+
+    return SlowInMemorySecretBackend({
+        "GOOGLE_CLIENT_ID_PROD_SM": stub.client_id,
+        "GOOGLE_CLIENT_SECRET_PROD_SM": "stub-secret",
+        "JWT_SECRET_KEY_PROD_SM": "bench-secret-" + "x" * 32,
+        "STREAMLIT_APP_URL_PROD_SM": STREAMLIT_APP_URL,
+        "FUNCTION_BASE_URL_PROD_SM": function_base_url,
+        "ALLOWED_USERS_LIST_PROD_SM": "@example.com",
+        "JWT_SIGNING_KEYS_PROD_SM": json.dumps({"primary": signing_key_spec["kid"], "keys": [signing_key_spec]}),
+    })
+
+# --- 認証サーバー ---
+class ServerThread:
+    """認証サーバーをこのプロセスのスレッドで起動します。"""
+
+    def __init__(self, kind, port):
+        self.kind = kind
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self.kind == "flask":
+            # werkzeug の開発サーバーはリクエストごとに 10MB の読み込みバッファを確保し、
+            # メモリ割り当ての計測値がそれで埋もれるため、標準ライブラリの wsgiref をスレッドで動かす
+            from socketserver import ThreadingMixIn
+            from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+            from main import app
+
+            class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+                daemon_threads = True
+                request_queue_size = 128
+
+            class QuietRequestHandler(WSGIRequestHandler):
+                def log_message(self, *args): # リクエストごとのアクセスログを出さない
+                    pass
+
+            self._server = make_server("127.0.0.1", self.port, app, server_class=ThreadingWSGIServer,
+                                       handler_class=QuietRequestHandler)
+            target = self._server.serve_forever
+        else:
+            import uvicorn
+            import asgi_app
+            asgi_app.app.mode = "local_sm_test"
+            self._server = uvicorn.Server(uvicorn.Config(asgi_app.app, host="127.0.0.1", port=self.port,
+                                                         log_level="warning", lifespan="on"))
+            target = self._server.run
+        self._thread = threading.Thread(target=target, name=f"{self.kind}-server", daemon=True)
+        self._thread.start()
+        self._wait_until_ready()
+        return self
+
+    def _wait_until_ready(self, timeout=30):
+        import requests
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"{self.base_url}/healthz", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f"server at {self.base_url} did not start")
+
+    def stop(self):
+        if self.kind == "flask":
+            self._server.shutdown()
+        else:
+            self._server.should_exit = True
+        self._thread.join(10)
+
+# --- クライアント ---
+class FlowError(Exception):
+    def __init__(self, step, message):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+
+class BrowserClient:
+    """
+    ブラウザと同じ順にリダイレクトをたどってログインし、Streamlit アプリと同じ方法でトークンを検証します。
+    スレッドごとに1つ作成します (Keep-Alive の接続と Cookie をフロー間で保持)。
+    """
+
+    def __init__(self, auth_base_url, verifier):
+        import requests
+        self.auth_base_url = auth_base_url
+        self.verifier = verifier
+        self.session = requests.Session()
+
+    def _redirect(self, step, url, **kwargs):
+        response = self.session.get(url, allow_redirects=False, timeout=60, **kwargs)
+        if response.status_code != 302:
+            raise FlowError(step, f"HTTP {response.status_code}")
+        return response.headers["Location"]
+
+    def login_flow(self, record):
+        """
+        1回のログインを行います。record(step, func) は各ステップを実行して計測する関数です。
+
+        Returns:
+            dict: Streamlit 側で検証したトークンのペイロード。
+        """
+        google_url = record("login", lambda: self._redirect(
+            "login", f"{self.auth_base_url}/auth/login", params={"return_to": STREAMLIT_APP_URL}))
+        callback_url = record("google_authorize", lambda: self._redirect("google_authorize", google_url))
+        app_url = record("callback", lambda: self._redirect("callback", callback_url))
+        query = parse_qs(urlsplit(app_url).query)
+        if "auth_token" not in query:
+            raise FlowError("callback", f"no auth_token ({query.get('auth_error')})")
+        result = record("streamlit_verify", lambda: self.verifier.verify(query["auth_token"][0]))
+        if not result.ok:
+            raise FlowError("streamlit_verify", result.reason)
+        return result.payload
+
+def make_verifier(auth_base_url, signing_key_spec):
+    """app_v1.get_token_verifier と同じ設定の TokenVerifier。"""
+    import jwt_verifier
+    if signing_key_spec["alg"] == "HS256":
+        settings = jwt_verifier.VerifierSettings(audience=STREAMLIT_APP_URL, issuer=auth_base_url,
+                                                 secret_key=signing_key_spec["secret"])
+    else:
+        settings = jwt_verifier.VerifierSettings(audience=STREAMLIT_APP_URL, issuer=auth_base_url,
+                                                 jwks_url=f"{auth_base_url}/.well-known/jwks.json")
+    return jwt_verifier.TokenVerifier(settings, cache_size=4096)
+
+# --- 計測 ---
+def run_load(auth_base_url, verifier, flows, concurrency):
+    """concurrency 個のクライアントで flows 回のログインを行い、(ステップ -> 秒のリスト, エラー数, 経過秒) を返します。"""
+    latencies = {step: [] for step in STEPS + ("flow",)}
+    errors = {}
+    local = threading.local()
+
+    def timed_step(step, func):
+        t0 = time.perf_counter()
+        result = func()
+        latencies[step].append(time.perf_counter() - t0)
+        return result
+
+    def one(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = BrowserClient(auth_base_url, verifier)
+        t0 = time.perf_counter()
+        try:
+            client.login_flow(timed_step)
+        except Exception as e:
+            step = e.step if isinstance(e, FlowError) else "client"
+            errors[step] = errors.get(step, 0) + 1
+            return
+        latencies["flow"].append(time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        t0 = time.perf_counter()
+        list(pool.map(one, range(flows)))
+        elapsed = time.perf_counter() - t0
+    return latencies, errors, elapsed
+
+def measure_allocations(auth_base_url, verifier, flows):
+    """tracemalloc を有効にして1フローずつ実行し、ステップごとのメモリ割り当て (バイト) の中央値を返します。"""
+    client = BrowserClient(auth_base_url, verifier)
+    samples = {step: ([], []) for step in STEPS}
+
+    def traced_step(step, func):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        samples[step][0].append(peak - before)
+        samples[step][1].append(current - before)
+        return result
+
+    client.login_flow(lambda step, func: func()) # 接続の確立を計測に含めない
+    tracemalloc.start()
+    try:
+        for _ in range(flows):
+            client.login_flow(traced_step)
+    finally:
+        tracemalloc.stop()
+    return {
+        step: {"peak_kib": round(statistics.median(peaks) / 1024, 1), "retained_bytes": int(statistics.median(kept))}
+        for step, (peaks, kept) in samples.items()
+    }
+
+def summarize(latencies, errors, elapsed, flows):
+    steps = {}
+    for step, values in latencies.items():
+        if not values:
+            continue
+        values = sorted(values)
+        steps[step] = {
+            "count": len(values),
+            "mean_ms": round(statistics.fmean(values) * 1000, 3),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+            "p90_ms": round(_percentile(values, 0.90) * 1000, 3),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return {
+        "throughput_flows_per_sec": round(len(latencies["flow"]) / elapsed, 2),
+        "flows": flows,
+        "errors": errors,
+        "steps": steps,
+    }
+
+def server_phases():
+    import observability
+    return {
+        phase: {"count": count, "mean_ms": round(total / count * 1000, 3)}
+        for phase, (count, total) in sorted(observability.PHASE_DURATION.snapshot().items()) if count
+    }
+
+# --- 比較 ---
+def compare(baseline, current, max_regression):
+    """(指標, 基準値, 今回, 変化率, 悪化したか) のリストを返します。変化率は「悪化」を正とします。"""
+    rows = []
+
+    def add(name, base, now, higher_is_better=False):
+        if base is None or now is None or base == 0:
+            return
+        change = (base - now) / base if higher_is_better else (now - base) / base
+        rows.append((name, base, now, change, change > max_regression))
+
+    add("throughput_flows_per_sec", baseline.get("throughput_flows_per_sec"),
+        current.get("throughput_flows_per_sec"), higher_is_better=True)
+    for step, stats in current["steps"].items():
+        for key in ("p50_ms", "p99_ms"):
+            add(f"{step}.{key}", baseline.get("steps", {}).get(step, {}).get(key), stats[key])
+    for step, stats in current.get("allocations", {}).items():
+        add(f"{step}.peak_kib", baseline.get("allocations", {}).get(step, {}).get("peak_kib"), stats["peak_kib"])
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flows", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--algorithm", default="ES256", choices=["HS256", "RS256", "ES256", "EdDSA"])
+    parser.add_argument("--google-latency-ms", type=float, default=0)
+    parser.add_argument("--secret-latency-ms", type=float, default=0)
+    parser.add_argument("--alloc-flows", type=int, default=20, help="メモリ割り当ての計測に使うフロー数 (0 で省略)")
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--compare", help="比較対象の JSON ファイル (以前の --output)")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    port = _free_port()
+    auth_base_url = f"http://127.0.0.1:{port}"
+    with StubGoogleServer(token_delay_seconds=args.google_latency_ms / 1000) as stub:
+        os.environ.update({
+            "CONFIG_INIT_MODE": "lazy",
+            "ENV": "local_sm_test",
+            "GCP_PROJECT": GCP_PROJECT,
+            "SM_NAME_FOR_JWT_SIGNING_KEYS": "JWT_SIGNING_KEYS_PROD_SM",
+            "GOOGLE_AUTH_URI": f"{stub.base_url}/auth",
+            "GOOGLE_TOKEN_URI": f"{stub.base_url}/token",
+            "GOOGLE_CERTS_URI": f"{stub.base_url}/certs",
+        })
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        # 全フローが同じIP・OAuth クライアントのため、既定ではレート制限を無効にして計測する
+        os.environ.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0")
+        os.environ.setdefault("RATE_LIMIT_CLIENT_PER_SECOND", "0")
+        from bench_jwt_signing import key_spec
+        import config
+
+        spec = key_spec(args.algorithm)
+        backend = make_secret_backend(stub, auth_base_url, spec, args.secret_latency_ms / 1000)
+        config.set_secret_backend(backend)
+        cfg = config.initialize_app_configs("local_sm_test")
+        assert config.get_secret_from_sm("FUNCTION_BASE_URL_PROD_SM") == auth_base_url # 同じバックエンドを通る
+
+        server = ServerThread(args.server, port).start()
+        try:
+            import observability
+            verifier = make_verifier(auth_base_url, spec)
+            run_load(auth_base_url, verifier, 1, 1) # ウォームアップ (JWKS・Google の証明書の取得を1回で済ませる)
+            run_load(auth_base_url, verifier, args.concurrency, args.concurrency)
+            observability.PHASE_DURATION.clear()
+            latencies, errors, elapsed = run_load(auth_base_url, verifier, args.flows, args.concurrency)
+            phases = server_phases()
+            allocations = measure_allocations(auth_base_url, verifier, args.alloc_flows) if args.alloc_flows else {}
+        finally:
+            server.stop()
+
+    result = {
+        "benchmark": "e2e_login",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {
+            "server": args.server, "algorithm": args.algorithm, "flows": args.flows,
+            "concurrency": args.concurrency, "google_latency_ms": args.google_latency_ms,
+            "secret_latency_ms": args.secret_latency_ms, "config_version": cfg.version,
+        },
+        **summarize(latencies, errors, elapsed, args.flows),
+        "server_phases": phases,
+        "allocations": allocations,
+        "stub_google_requests": dict(stub.requests),
+        "secret_backend_accesses": backend.access_count,
+    }
+
+    print(f"{args.flows} flows, concurrency {args.concurrency}, server {args.server}, {args.algorithm}, "
+          f"commit {result['git_commit']}")
+    print(f"throughput: {result['throughput_flows_per_sec']:.1f} flows/s  errors: {errors or 0}")
+    print(f"{'step':>18} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'alloc peak KiB':>15} {'retained B':>11}")
+    for step, stats in result["steps"].items():
+        alloc = allocations.get(step, {})
+        print(f"{step:>18} {stats['p50_ms']:9.2f} {stats['p90_ms']:9.2f} {stats['p99_ms']:9.2f} "
+              f"{alloc.get('peak_kib', ''):>15} {alloc.get('retained_bytes', ''):>11}")
+    print("server phases (mean ms): " + ", ".join(f"{phase}={stats['mean_ms']:.3f} (n={stats['count']})"
+                                                  for phase, stats in phases.items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"saved: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, result, args.max_regression)
+        print(f"\ncompared with {args.compare} (commit {baseline.get('git_commit')}), "
+              f"regression threshold {args.max_regression:.0%} (change: + = worse)")
+        for name, base, now, change, regressed in rows:
+            print(f"{name:>34} {base:>10} -> {now:>10} {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if errors or any(regressed for *_, regressed in rows):
+            sys.exit(1)
+    elif errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/bench_introspect.py
+"""
+/auth/introspect (1トークン/リクエスト) と /auth/introspect:batch (N トークン/リクエスト) の
+検証スループット (verifications/sec) を、Flask アプリに対して計測します (Flask のテストクライアント経由)。
+
+- cold: 検証済みトークンのキャッシュが空の状態 (署名の検証を含む)
+- warm: 同じトークンを再度検証 (キャッシュヒット。失効・許可ユーザーリスト・有効期限の確認のみ)
+
+    python benchmarks/bench_introspect.py [--tokens 2000] [--batch-size 200] [--algorithm ES256]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+from bench_jwt_signing import AUDIENCE, ISSUER, key_spec  # noqa: E402
+
+SERVICE_API_KEY = "bench-service-key"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--algorithm", default="ES256")
+    args = parser.parse_args()
+
+    spec = key_spec(args.algorithm)
+    os.environ.update({
+        "DIRECT_GOOGLE_CLIENT_ID": "bench-client",
+        "DIRECT_GOOGLE_CLIENT_SECRET": "bench-secret",
+        "DIRECT_JWT_SECRET_KEY": "bench-secret-" + "x" * 32,
+        "DIRECT_JWT_SIGNING_KEYS": json.dumps({"primary": spec["kid"], "keys": [spec]}),
+        "DIRECT_STREAMLIT_APP_URL": AUDIENCE,
+        "DIRECT_FUNCTION_BASE_URL": ISSUER,
+        "DIRECT_ALLOWED_USERS_LIST_STR": "@example.com",
+        "DIRECT_SERVICE_API_KEY": SERVICE_API_KEY,
+    })
+    with contextlib.redirect_stdout(io.StringIO()): # 設定読み込み・発行時のログ出力を除外
+        import auth_utils
+        import config
+        import introspection
+        from main import app
+        cfg = config.initialize_app_configs("local_direct")
+        tokens = auth_utils.mint_tokens_batch(
+            [f"user{i}@example.com" for i in range(args.tokens)], ISSUER, AUDIENCE, cfg.key_ring
+        )
+
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {SERVICE_API_KEY}"}
+
+    def single():
+        for token in tokens:
+            response = client.post("/auth/introspect", data={"token": token}, headers=headers)
+            assert response.get_json()["active"], response.get_json()
+
+    def bulk():
+        for i in range(0, len(tokens), args.batch_size):
+            response = client.post("/auth/introspect:batch", json={"tokens": tokens[i:i + args.batch_size]},
+                                   headers=headers)
+            assert all(result["active"] for result in response.get_json()["results"])
+
+    print(f"{args.tokens} tokens ({args.algorithm}), batch size {args.batch_size}")
+    for label, run in (("single", single), (f"bulk x{args.batch_size}", bulk)):
+        for cache_state in ("cold", "warm"):
+            if cache_state == "cold":
+                introspection.get_introspector().clear()
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run()
+            elapsed = time.perf_counter() - t0
+            print(f"{label:>10} {cache_state}: {len(tokens) / elapsed:10,.0f} verifications/s")
+
+if __name__ == "__main__":
+    main()
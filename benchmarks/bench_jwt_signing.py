@@ -0,0 +1,62 @@
+# benchmarks/bench_jwt_signing.py
+"""
+アルゴリズムごとのカスタムJWTの署名・検証コスト (キーリング経由、鍵はパース済み)。
+
+    python benchmarks/bench_jwt_signing.py [--iterations 2000] [--algorithms HS256,RS256,ES256,EdDSA]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa  # noqa: E402
+
+import auth_utils  # noqa: E402
+from signing_keys import KeyRing  # noqa: E402
+
+ISSUER = "http://localhost:8080"
+AUDIENCE = "http://localhost:8501"
+
+def _pem(private_key):
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+def key_spec(algorithm):
+    if algorithm == "HS256":
+        return {"kid": "hs", "alg": "HS256", "secret": "bench-secret-" + "x" * 32}
+    if algorithm == "RS256":
+        return {"kid": "rs", "alg": "RS256", "private_key_pem": _pem(rsa.generate_private_key(65537, 2048))}
+    if algorithm == "ES256":
+        return {"kid": "es", "alg": "ES256", "private_key_pem": _pem(ec.generate_private_key(ec.SECP256R1()))}
+    if algorithm == "EdDSA":
+        return {"kid": "ed", "alg": "EdDSA", "private_key_pem": _pem(ed25519.Ed25519PrivateKey.generate())}
+    raise ValueError(algorithm)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--algorithms", default="HS256,RS256,ES256,EdDSA")
+    args = parser.parse_args()
+
+    print(f"{'alg':>6} {'sign (us)':>10} {'verify (us)':>12} {'token bytes':>12}")
+    for algorithm in args.algorithms.split(","):
+        spec = key_spec(algorithm)
+        key_ring = KeyRing.from_spec({"primary": spec["kid"], "keys": [spec]})
+
+        t0 = time.perf_counter()
+        for i in range(args.iterations):
+            token = auth_utils.create_custom_jwt(f"user{i}@example.com", "Bench User", ISSUER, AUDIENCE, key_ring)
+        sign_us = (time.perf_counter() - t0) / args.iterations * 1e6
+
+        t0 = time.perf_counter()
+        for _ in range(args.iterations):
+            auth_utils.verify_custom_jwt(token, key_ring, ISSUER, AUDIENCE)
+        verify_us = (time.perf_counter() - t0) / args.iterations * 1e6
+        print(f"{algorithm:>6} {sign_us:>10.1f} {verify_us:>12.1f} {len(token):>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_oauth_state.py
+"""
+OAuth state の生成・検証コストの比較。
+
+- cookie: uuid4 を生成して Set-Cookie ヘッダーを組み立て、コールバックで Cookie ヘッダーを解析して比較する従来方式
+- stateless: HMAC 署名付き state トークンの生成と定数時間検証
+- stateless+replay: 上記に加えて使用済み nonce キャッシュで再利用を検査
+
+    python benchmarks/bench_oauth_state.py [--iterations 100000]
+"""
+import argparse
+import hmac
+import os
+import sys
+import timeit
+import uuid
+from http.cookies import SimpleCookie
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+
+import auth_utils  # noqa: E402
+
+STATE_COOKIE_NAME = "myappstate"
+RETURN_TO = "https://streamlit.example.com/app?page=home"
+
+def cookie_round_trip():
+    state = str(uuid.uuid4()) # 従来の state パラメータ
+    # /auth/login: Set-Cookie ヘッダーの生成
+    cookie = SimpleCookie()
+    cookie[STATE_COOKIE_NAME] = state
+    morsel = cookie[STATE_COOKIE_NAME]
+    morsel["httponly"] = True
+    morsel["secure"] = True
+    morsel["samesite"] = "Lax"
+    morsel["max-age"] = auth_utils.OAUTH_STATE_TTL_SECONDS
+    morsel.OutputString()
+    # /auth/callback: Cookie ヘッダーの解析と比較
+    received = SimpleCookie(f"{STATE_COOKIE_NAME}={state}; other=value")
+    return hmac.compare_digest(received[STATE_COOKIE_NAME].value, state)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    key = auth_utils.derive_oauth_state_key("bench-secret")
+    replay_cache = auth_utils.NonceReplayCache(max_entries=10000)
+
+    def stateless_round_trip():
+        token = auth_utils.create_oauth_state_token(key, return_to=RETURN_TO)
+        return auth_utils.verify_oauth_state_token(token, key)
+
+    def stateless_with_replay_cache():
+        token = auth_utils.create_oauth_state_token(key, return_to=RETURN_TO)
+        return auth_utils.verify_oauth_state_token(token, key, replay_cache=replay_cache)
+
+    token = auth_utils.create_oauth_state_token(key, return_to=RETURN_TO)
+    print(f"stateless token length: {len(token)} bytes (cookie approach additionally needs a Set-Cookie/Cookie round trip)")
+    for name, func in (("cookie", cookie_round_trip),
+                       ("stateless", stateless_round_trip),
+                       ("stateless+replay", stateless_with_replay_cache)):
+        seconds = min(timeit.repeat(func, number=args.iterations, repeat=3))
+        print(f"{name:>18}: {seconds / args.iterations * 1e6:8.2f} us/login (create + verify)")
+    print(f"replay cache entries (bounded): {len(replay_cache)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_ratelimit.py
+"""
+レート制限 (ratelimit.py) のリクエストあたりのコスト。
+
+クライアントIP の種類数を変えて、/auth/login, /auth/callback と同じ判定
+(client_ip + IP ごとのバケット + OAuth クライアントのバケット) の1回あたりの時間を計測します。
+種類数がテーブルサイズ (--table-size) を超える場合は、毎回のように追い出し (CLOCK) が発生します。
+--threads を指定すると、同じ RateLimiter を複数スレッドから呼び出した場合の合計スループットも表示します。
+
+    python benchmarks/bench_ratelimit.py [--checks 1000000] [--table-size 65536] [--keys 1,1000,65536,1000000] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+
+import ratelimit  # noqa: E402
+
+def make_limiter(table_size):
+    # 制限に掛からない (常に許可する) 設定で、判定そのもののコストを計測する
+    return ratelimit.RateLimiter({
+        ratelimit.SCOPE_IP: ratelimit.RateLimit(1e9, 1e9, table_size),
+        ratelimit.SCOPE_CLIENT: ratelimit.RateLimit(1e9, 1e9, 1024),
+    })
+
+def check(limiter, remote_addr, client_id="bench-client.apps.googleusercontent.com"):
+    if limiter.retry_after(ratelimit.SCOPE_IP, ratelimit.client_ip(remote_addr, None, 0)):
+        return False
+    return not limiter.retry_after(ratelimit.SCOPE_CLIENT, client_id)
+
+def addresses(count):
+    return [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(count)] # 2^24 種類まで
+
+def run(limiter, addrs, checks):
+    n = len(addrs)
+    t0 = time.perf_counter()
+    for i in range(checks):
+        check(limiter, addrs[i % n])
+    return time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=1000000)
+    parser.add_argument("--table-size", type=int, default=65536)
+    parser.add_argument("--keys", default="1,1000,65536,1000000")
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    limiter = make_limiter(args.table_size)
+    for addr in addresses(args.table_size):
+        check(limiter, addr)
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"table size {args.table_size}: {table_bytes / 1024 / 1024:.1f} MiB when full "
+          f"({table_bytes / args.table_size:.0f} B/key, including key strings)")
+
+    print(f"{'distinct IPs':>12} {'ns/check':>9} {'entries':>8}" + (f" {f'{args.threads} threads (checks/s)':>24}" if args.threads > 1 else ""))
+    for count in (int(k) for k in args.keys.split(",")):
+        addrs = addresses(count)
+        limiter = make_limiter(args.table_size)
+        run(limiter, addrs, min(count, args.checks)) # 1周目 (テーブルへの追加) は計測しない
+        elapsed = run(limiter, addrs, args.checks)
+        line = f"{count:>12} {elapsed / args.checks * 1e9:9.0f} {len(limiter._tables[ratelimit.SCOPE_IP]):>8}"
+        if args.threads > 1:
+            per_thread = args.checks // args.threads
+            threads = [threading.Thread(target=run, args=(limiter, addrs[i::args.threads] or addrs, per_thread))
+                       for i in range(args.threads)]
+            t0 = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            line += f" {per_thread * args.threads / (time.perf_counter() - t0):24,.0f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# benchmarks/bench_refresh.py
+"""
+/auth/refresh 1回あたりのサーバー側コスト (リフレッシュトークンのローテーション + アクセストークンの署名) を
+ストアごとに計測します。Google とのトークン交換 (数百ms) を伴う再ログインとの比較に使います。
+
+    python benchmarks/bench_refresh.py [--sessions 10000] [--algorithm HS256]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+import auth_utils  # noqa: E402
+import refresh_tokens  # noqa: E402
+from bench_jwt_signing import AUDIENCE, ISSUER, key_spec  # noqa: E402
+from signing_keys import KeyRing  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--algorithm", default="HS256")
+    args = parser.parse_args()
+
+    spec = key_spec(args.algorithm)
+    key_ring = KeyRing.from_spec({"primary": spec["kid"], "keys": [spec]})
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "memory": refresh_tokens.InMemoryRefreshTokenStore(),
+            "sqlite": refresh_tokens.SQLiteRefreshTokenStore(os.path.join(tmp, "refresh_tokens.db")),
+        }
+        for label, store in stores.items():
+            service = refresh_tokens.RefreshTokenService(store)
+            tokens = [service.issue(f"user{i}@example.com", f"User {i}") for i in range(args.sessions)]
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # create_custom_jwt のログ出力を除外
+                for token in tokens:
+                    record, _ = service.rotate(token)
+                    auth_utils.create_custom_jwt(record.email, record.name, ISSUER, AUDIENCE, key_ring)
+            elapsed = time.perf_counter() - t0
+            print(f"{label:>7} ({args.algorithm}): {elapsed / len(tokens) * 1e6:8.1f} us/refresh "
+                  f"({len(tokens) / elapsed:,.0f} refresh/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# benchmarks/bench_revocation.py
+"""
+失効リストの判定コスト。1,000,000 件の失効済みトークンがある状態で、
+失効していないトークン (ブルームフィルターのみで判定) と失効済みトークン (正確な集合で確認) の
+1回あたりの判定時間を計測します。
+
+    python benchmarks/bench_revocation.py [--revoked 1000000] [--lookups 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+
+import revocation  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--revoked", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=1000000)
+    args = parser.parse_args()
+
+    exp = time.time() + 3600
+    revocation_list = revocation.RevocationList(capacity=args.revoked)
+    t0 = time.perf_counter()
+    revocation_list.revoke_many((f"revoked-{i:09d}", exp) for i in range(args.revoked))
+    print(f"loaded {len(revocation_list)} revoked jtis in {time.perf_counter() - t0:.1f} s "
+          f"(bloom: {revocation_list._bloom.size / 8 / 1024 / 1024:.1f} MiB, k={revocation_list._bloom.hash_count})")
+
+    # 実際の検証と同様、毎回新しく生成された文字列 (hash がキャッシュされていない) で判定する
+    fresh = [f"active-{i:09d}" for i in range(min(args.lookups, 100000))]
+    revoked = [f"revoked-{i:09d}" for i in range(0, args.revoked, max(1, args.revoked // 100000))]
+    false_positives = sum(1 for jti in fresh if jti in revocation_list._bloom)
+
+    for label, jtis in (("not revoked", fresh), ("revoked", revoked)):
+        jtis = [("" + jti[:1]) + jti[1:] for jti in jtis]
+        repeat = max(1, args.lookups // len(jtis))
+        seconds = min(timeit.repeat(lambda: [revocation_list.is_revoked(j) for j in jtis], number=repeat, repeat=3))
+        print(f"{label:>12}: {seconds / (repeat * len(jtis)) * 1e9:7.0f} ns/verify")
+    print(f"bloom false positives: {false_positives}/{len(fresh)} ({false_positives / len(fresh):.2%})")
+
+if __name__ == "__main__":
+    main()
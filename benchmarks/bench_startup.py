@@ -0,0 +1,122 @@
+# benchmarks/bench_startup.py
+"""
+auth_server_flask のコールドスタート計測。
+
+新しいPythonプロセスで `python -X importtime` を使って `import main` のコストを計測し、
+さらに別プロセスでインポート開始から auth_http の最初のレスポンスまでの時間を計測します。
+予算 (ミリ秒) を超えた場合は終了コード 1 で終了するため、CI のゲートとして使えます。
+
+    python benchmarks/bench_startup.py [--import-budget-ms 800] [--first-response-budget-ms 1500]
+                                       [--init-mode background] [--runs 5] [--top 15]
+
+予算は環境変数 STARTUP_IMPORT_BUDGET_MS / STARTUP_FIRST_RESPONSE_BUDGET_MS でも指定できます。
+設定は local_direct モードのダミー値を使うため、ネットワークアクセスは発生しません。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask")
+
+DUMMY_ENV = {
+    "ENV": "local_direct",
+    "DIRECT_GOOGLE_CLIENT_ID": "bench-client-id",
+    "DIRECT_GOOGLE_CLIENT_SECRET": "bench-client-secret",
+    "DIRECT_JWT_SECRET_KEY": "bench-jwt-secret",
+    "DIRECT_STREAMLIT_APP_URL": "http://localhost:8501",
+    "DIRECT_FUNCTION_BASE_URL": "http://localhost:8080",
+    "DIRECT_ALLOWED_USERS_LIST_STR": "bench@example.com",
+}
+
+# 別プロセスで実行する、インポートから最初のレスポンスまでの計測スクリプト
+FIRST_RESPONSE_SCRIPT = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter()
+from werkzeug.test import EnvironBuilder
+environ = EnvironBuilder(path="/auth/login", base_url="http://localhost:8080").get_environ()
+class _Request:
+    pass
+request_cf = _Request()
+request_cf.environ = environ
+response = main.auth_http(request_cf)
+t_response = time.perf_counter()
+status = getattr(response, "status_code", None)
+if status is None and isinstance(response, tuple):
+    status = response[1]
+print(json.dumps({"import_ms": (t_import - t0) * 1000, "first_response_ms": (t_response - t0) * 1000, "status": status}))
+"""
+
+def _child_env(init_mode):
+    env = dict(os.environ)
+    env.update(DUMMY_ENV)
+    env["CONFIG_INIT_MODE"] = init_mode
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def measure_importtime(init_mode, top):
+    """-X importtime の出力を解析し、main の累積インポート時間と重いモジュールの一覧を返します。"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SERVER_DIR, env=_child_env(init_mode), capture_output=True, text=True, check=True,
+    )
+    modules = []
+    main_cumulative_us = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        name = name[1:] # 先頭の区切りスペースを除去。残りの字下げはネストの深さを表す
+        modules.append((int(cumulative_us), int(self_us), name))
+        if name == "main":
+            main_cumulative_us = int(cumulative_us)
+    top_level = sorted((m for m in modules if not m[2].startswith(" ")), reverse=True)[:top]
+    return (main_cumulative_us or 0) / 1000, top_level
+
+def measure_first_response(init_mode):
+    proc = subprocess.run(
+        [sys.executable, "-c", FIRST_RESPONSE_SCRIPT],
+        cwd=SERVER_DIR, env=_child_env(init_mode), capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-budget-ms", type=float,
+                        default=float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", "800")))
+    parser.add_argument("--first-response-budget-ms", type=float,
+                        default=float(os.environ.get("STARTUP_FIRST_RESPONSE_BUDGET_MS", "1500")))
+    parser.add_argument("--init-mode", choices=["background", "eager", "lazy"], default="background")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    import_ms, top_level = measure_importtime(args.init_mode, args.top)
+    print(f"-X importtime: import main = {import_ms:.1f} ms (CONFIG_INIT_MODE={args.init_mode})")
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+    for cumulative_us, self_us, name in top_level:
+        print(f"{cumulative_us / 1000:>15.1f} {self_us / 1000:>10.1f}  {name.strip()}")
+
+    samples = [measure_first_response(args.init_mode) for _ in range(args.runs)]
+    import_median = statistics.median(s["import_ms"] for s in samples)
+    first_median = statistics.median(s["first_response_ms"] for s in samples)
+    print(f"\nimport (wall, median of {args.runs}): {import_median:.1f} ms")
+    print(f"time to first auth_http response (median of {args.runs}): {first_median:.1f} ms "
+          f"(status: {samples[-1]['status']})")
+
+    failures = []
+    if import_median > args.import_budget_ms:
+        failures.append(f"import {import_median:.1f} ms > budget {args.import_budget_ms:.1f} ms")
+    if first_median > args.first_response_budget_ms:
+        failures.append(f"first response {first_median:.1f} ms > budget {args.first_response_budget_ms:.1f} ms")
+    if failures:
+        print("\nFAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK: within startup budget")
+
+if __name__ == "__main__":
+    main()
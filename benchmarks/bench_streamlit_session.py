@@ -0,0 +1,109 @@
+# benchmarks/bench_streamlit_session.py
+"""
+Streamlit アプリの再読み込み (新しい Streamlit セッション) から認証済みになるまでの時間。
+
+- ログインのやり直し: サーバー側セッションがない場合。bench_e2e と同じ構成 (スタブの Google + このプロセスの Flask サーバー) で
+  /auth/login → Google → /auth/callback → トークンの検証 をたどります。
+- Cookie からの復元: app_v1.restore_server_session と同じ処理 (ストアの参照 + 失効リストの確認)。
+  --sessions 件のセッションが入ったストアから、ランダムなセッションを引きます。
+  memory: MemorySessionStore / sqlite: SQLiteSessionStore (一時ファイル。別プロセスとの共有を想定)
+
+    python benchmarks/bench_streamlit_session.py [--sessions 10000] [--restores 100000] [--logins 200] [--algorithm ES256]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "streamlit_app"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+import session_store  # noqa: E402
+
+def session_data(i):
+    """ログイン直後に app_v1 が保存する内容と同じ形 (ペイロード + アクセストークン + リフレッシュトークン)。"""
+    now = time.time()
+    user_info = {"sub": f"user{i}@example.com", "email": f"user{i}@example.com", "name": f"User {i}",
+                 "iss": "http://127.0.0.1:8080", "aud": "http://localhost:8501", "iat": int(now),
+                 "exp": int(now) + 3600, "jti": f"{i:032x}"}
+    return {"user_info": user_info, "auth_token": "e" * 420, "refresh_token": "r" * 43}
+
+def time_restores(store, session_ids, restores, is_revoked):
+    rng = random.Random(0)
+    order = [rng.choice(session_ids) for _ in range(restores)]
+    t0 = time.perf_counter()
+    for session_id in order:
+        data = store.get(session_id)
+        assert data is not None and not is_revoked(data["user_info"]["jti"])
+    return (time.perf_counter() - t0) / restores
+
+def time_logins(logins, algorithm):
+    """サーバー側セッションがない場合の再読み込み (ログインのやり直し) の時間。"""
+    import bench_e2e
+    from stub_google import StubGoogleServer
+
+    port = bench_e2e._free_port()
+    auth_base_url = f"http://127.0.0.1:{port}"
+    with StubGoogleServer() as stub:
+        os.environ.update({
+            "CONFIG_INIT_MODE": "lazy",
+            "ENV": "local_sm_test",
+            "GCP_PROJECT": bench_e2e.GCP_PROJECT,
+            "SM_NAME_FOR_JWT_SIGNING_KEYS": "JWT_SIGNING_KEYS_PROD_SM",
+            "GOOGLE_AUTH_URI": f"{stub.base_url}/auth",
+            "GOOGLE_TOKEN_URI": f"{stub.base_url}/token",
+            "GOOGLE_CERTS_URI": f"{stub.base_url}/certs",
+        })
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0")
+        os.environ.setdefault("RATE_LIMIT_CLIENT_PER_SECOND", "0")
+        from bench_jwt_signing import key_spec
+        import config
+
+        spec = key_spec(algorithm)
+        config.set_secret_backend(bench_e2e.make_secret_backend(stub, auth_base_url, spec, 0))
+        config.initialize_app_configs("local_sm_test")
+        server = bench_e2e.ServerThread("flask", port).start()
+        try:
+            verifier = bench_e2e.make_verifier(auth_base_url, spec)
+            bench_e2e.run_load(auth_base_url, verifier, 1, 1) # ウォームアップ
+            latencies, errors, _ = bench_e2e.run_load(auth_base_url, verifier, logins, 1)
+        finally:
+            server.stop()
+    assert not errors, errors
+    flows = sorted(latencies["flow"])
+    return sum(flows) / len(flows), bench_e2e._percentile(flows, 0.99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--restores", type=int, default=100000)
+    parser.add_argument("--logins", type=int, default=200, help="ログインのやり直しの計測回数 (0 で省略)")
+    parser.add_argument("--algorithm", default="ES256", choices=["HS256", "RS256", "ES256", "EdDSA"])
+    args = parser.parse_args()
+
+    revoked = {}
+    is_revoked = revoked.__contains__ # RevocationFileFollower の判定 (辞書の参照) の代わり
+    print(f"reload -> authenticated ({args.sessions} sessions in the store)")
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = (("memory", session_store.MemorySessionStore(max_sessions=args.sessions)),
+                  ("sqlite", session_store.SQLiteSessionStore(os.path.join(tmp, "sessions.db"),
+                                                              max_sessions=args.sessions)))
+        for label, store in stores:
+            t0 = time.perf_counter()
+            session_ids = [store.create(session_data(i)) for i in range(args.sessions)]
+            create = (time.perf_counter() - t0) / args.sessions
+            restore = time_restores(store, session_ids, args.restores, is_revoked)
+            print(f"  cookie restore ({label:>6}): {restore * 1e6:9.1f} us  (create {create * 1e6:.1f} us/session)")
+
+    if args.logins:
+        mean, p99 = time_logins(args.logins, args.algorithm)
+        print(f"  full re-login ({args.algorithm:>6}): {mean * 1e6:9.1f} us  (p99 {p99 * 1e6:.1f} us, "
+              "local stub Google, no network latency)")
+
+if __name__ == "__main__":
+    main()
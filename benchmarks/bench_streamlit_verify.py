@@ -0,0 +1,66 @@
+# benchmarks/bench_streamlit_verify.py
+"""
+Streamlit の再実行 (rerun) ごとの認証コストを、検証済みトークンのキャッシュあり/なしで比較します。
+
+多数のセッションがそれぞれ自分のトークンで何度も再実行される状況を模擬します。
+
+    python benchmarks/bench_streamlit_verify.py [--sessions 200] [--reruns 50] [--algorithm HS256]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "streamlit_app"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+import auth_utils  # noqa: E402
+import jwt_verifier  # noqa: E402
+from bench_jwt_signing import AUDIENCE, ISSUER, key_spec  # noqa: E402
+from signing_keys import KeyRing  # noqa: E402
+
+class _StaticKeySettings(jwt_verifier.VerifierSettings):
+    """JWKS エンドポイントの代わりにキーリングの公開鍵を直接使う設定 (ベンチマーク用)。"""
+
+    def __init__(self, key_ring, **kwargs):
+        super().__init__(**kwargs)
+        self.algorithms = [key_ring.primary.algorithm]
+        self._key = key_ring.primary.verification_key
+
+    def is_complete(self):
+        return True
+
+    def key_for(self, token):
+        return self._key
+
+def run(verifier, tokens, reruns):
+    order = [token for token in tokens for _ in range(reruns)]
+    random.Random(0).shuffle(order)
+    t0 = time.perf_counter()
+    for token in order:
+        assert verifier.verify(token).ok
+    return (time.perf_counter() - t0) / len(order) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--reruns", type=int, default=50)
+    parser.add_argument("--algorithm", default="HS256")
+    args = parser.parse_args()
+
+    spec = key_spec(args.algorithm)
+    key_ring = KeyRing.from_spec({"primary": spec["kid"], "keys": [spec]})
+    tokens = auth_utils.mint_tokens_batch([f"user{i}@example.com" for i in range(args.sessions)],
+                                          ISSUER, AUDIENCE, key_ring)
+
+    for label, cache_size in (("no cache", 0), ("LRU cache", 4096)):
+        settings = _StaticKeySettings(key_ring, audience=AUDIENCE, issuer=ISSUER, secret_key=spec.get("secret"))
+        verifier = jwt_verifier.TokenVerifier(settings, cache_size=cache_size)
+        per_rerun_us = run(verifier, tokens, args.reruns)
+        print(f"{args.algorithm} {label:>10}: {per_rerun_us:8.2f} us/rerun (hits={verifier.hits}, misses={verifier.misses})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/bench_tenants.py
+"""
+テナントレジストリ (tenants.py) のコスト。1,000 テナントを Secret Manager (InMemorySecretBackend) に登録し、
+
+- 初回の読み込み (定義の取得 + テナントの AuthConfig の構築) の1テナントあたりの時間とメモリ
+- キャッシュ済みの検索 (tenants.resolve_config) の1回あたりの時間 (テナント指定なしとの比較)
+- キャッシュがテナント数より小さい場合 (--cache-size) の、追い出しと再構築を含む検索の時間
+- /t/<テナントID>/auth/login (Flask の test_client) のテナントを順に変えた場合と、テナント指定なしのリクエスト時間
+
+を計測します。--algorithm で各テナントに個別の署名鍵 (ES256 など) を持たせると、鍵のパースも初回の読み込みに含まれます。
+
+    python benchmarks/bench_tenants.py [--tenants 1000] [--lookups 200000] [--cache-size 100] [--algorithm HS256] [--requests 5000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "auth_server_flask"))
+
+os.environ.update({"CONFIG_INIT_MODE": "lazy", "ENV": "local_sm_test", "GCP_PROJECT": "bench-project"})
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0") # 全リクエストが同じIPのため
+os.environ.setdefault("RATE_LIMIT_CLIENT_PER_SECOND", "0")
+
+import config  # noqa: E402
+import tenants  # noqa: E402
+
+def tenant_definition(i, algorithm):
+    definition = {
+        "streamlit_app_url": f"https://app-{i:04d}.example.com",
+        "allowed_users": f"owner-{i}@example.com,@team-{i}.example.com",
+        "google_client_id": f"client-{i:04d}.apps.googleusercontent.com",
+        "google_client_secret": f"client-secret-{i:04d}",
+    }
+    if algorithm == "HS256":
+        definition["jwt_secret_key"] = f"tenant-{i:04d}-secret-0123456789abcdef0123456789"
+    else:
+        from bench_jwt_signing import key_spec
+        definition["jwt_signing_keys"] = json.loads(key_spec(algorithm))
+    return definition
+
+def make_backend(tenant_ids, algorithm):
+    backend = config.InMemorySecretBackend({
+        "GOOGLE_CLIENT_ID_PROD_SM": "default-client.apps.googleusercontent.com",
+        "GOOGLE_CLIENT_SECRET_PROD_SM": "default-client-secret",
+        "JWT_SECRET_KEY_PROD_SM": "default-secret-0123456789abcdef0123456789",
+        "STREAMLIT_APP_URL_PROD_SM": "https://app.example.com",
+        "FUNCTION_BASE_URL_PROD_SM": "https://auth.example.com",
+        "ALLOWED_USERS_LIST_PROD_SM": "@example.com",
+        tenants.TENANT_INDEX_SECRET: "\n".join(tenant_ids),
+    })
+    for i, tenant_id in enumerate(tenant_ids):
+        secret_name = tenants.TENANT_SECRET_TEMPLATE.format(tenant_id=tenant_id.upper().replace("-", "_"))
+        backend.set_secret(secret_name, json.dumps(tenant_definition(i, algorithm)))
+    return backend
+
+def time_lookups(base, ids, lookups):
+    t0 = time.perf_counter()
+    for i in range(lookups):
+        tenants.resolve_config(base, ids[i % len(ids)])
+    return (time.perf_counter() - t0) / lookups
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--cache-size", type=int, default=100, help="テナント数より小さいキャッシュでの計測 (0 で省略)")
+    parser.add_argument("--algorithm", default="HS256", choices=["HS256", "RS256", "ES256", "EdDSA"])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    tenant_ids = [f"tenant-{i:04d}" for i in range(args.tenants)]
+    backend = make_backend(tenant_ids, args.algorithm)
+    config.set_secret_backend(backend)
+    base = config.initialize_app_configs("local_sm_test")
+    registry = tenants.TenantRegistry(tenants.SecretManagerTenantSource(), cache_size=args.tenants)
+    tenants._tenant_registry = registry
+
+    shuffled = tenant_ids[:]
+    random.Random(0).shuffle(shuffled)
+    accesses_before = backend.access_count
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for tenant_id in shuffled:
+        tenants.resolve_config(base, tenant_id)
+    cold = (time.perf_counter() - t0) / args.tenants
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{args.tenants} tenants ({args.algorithm}), cache size {registry.cache_size}")
+    print(f"  first load:        {cold * 1e3:8.3f} ms/tenant  ({memory / args.tenants / 1024:.1f} KiB/tenant, "
+          f"{backend.access_count - accesses_before} secret accesses)")
+
+    no_tenant = time_lookups(base, [None], args.lookups)
+    cached = time_lookups(base, shuffled, args.lookups)
+    print(f"  lookup (no tenant):{no_tenant * 1e9:8.0f} ns")
+    print(f"  lookup (cached):   {cached * 1e9:8.0f} ns")
+
+    if 0 < args.cache_size < args.tenants:
+        tenants._tenant_registry = tenants.TenantRegistry(tenants.SecretManagerTenantSource(), cache_size=args.cache_size)
+        lookups = max(args.tenants, args.lookups // 20)
+        churn = time_lookups(base, shuffled, lookups) # 毎回のように追い出しと再構築 (シークレットはキャッシュ済み)
+        print(f"  lookup (cache {args.cache_size}, cycling {args.tenants} tenants): {churn * 1e6:8.1f} us")
+        tenants._tenant_registry = registry
+
+    from main import app
+    client = app.test_client()
+    for label, paths in (("/auth/login", ["/auth/login"]),
+                         (f"/t/<{args.tenants} tenants>/auth/login", [f"/t/{t}/auth/login" for t in shuffled])):
+        client.get(paths[0])
+        t0 = time.perf_counter()
+        for i in range(args.requests):
+            response = client.get(paths[i % len(paths)])
+            assert response.status_code == 302, response.status_code
+        print(f"  {label:>36}: {(time.perf_counter() - t0) / args.requests * 1e6:8.1f} us/request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/bench_token_exchange.py
+"""
+/auth/callback のトークン交換コストの比較 (ローカルのスタブ OAuth サーバーに対して計測)。
+
+- per-request: リクエストごとに新しい requests.Session を作る (Flow をリクエストごとに作る従来方式に相当)
+- pooled: google_oauth.OAuthClient が使う、プロセス共有の Keep-Alive セッション
+
+スタブは平文 HTTP のため TLS ハンドシェイクのコストは含まれません。
+実際の Google エンドポイントでは、接続再利用による差はこれより大きくなります。
+
+    python benchmarks/bench_token_exchange.py [--requests 500] [--concurrency 8]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_google import StubGoogleServer  # noqa: E402
+
+def run(label, exchange, total, concurrency, stub):
+    connections_before = stub.connections
+    latencies = []
+
+    def one(_):
+        t0 = time.perf_counter()
+        exchange()
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    print(f"{label:>12}: {total / elapsed:8.1f} req/s  p50={statistics.median(latencies) * 1000:6.2f} ms  "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:6.2f} ms  "
+          f"new connections={stub.connections - connections_before}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with StubGoogleServer() as stub:
+        os.environ["GOOGLE_TOKEN_URI"] = f"{stub.base_url}/token"
+        os.environ["GOOGLE_AUTH_URI"] = f"{stub.base_url}/auth"
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "auth_server_flask"))
+        import requests
+        import google_oauth
+
+        client = google_oauth.OAuthClient(stub.client_id, "stub-secret", "http://localhost:8080/auth_callback")
+        form = {"grant_type": "authorization_code", "code": "bench", "client_id": stub.client_id,
+                "client_secret": "stub-secret", "redirect_uri": client.redirect_uri}
+
+        def per_request_session():
+            with requests.Session() as session:
+                response = session.post(client.token_uri, data=form, timeout=10)
+                response.raise_for_status()
+                return response.json()
+
+        def pooled():
+            return client.exchange_code("bench")
+
+        # ウォームアップ
+        pooled()
+        run("per-request", per_request_session, args.requests, args.concurrency, stub)
+        run("pooled", pooled, args.requests, args.concurrency, stub)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/stub_google.py
+"""
+ベンチマーク用のローカル Google OAuth スタブサーバー (HTTP/1.1 Keep-Alive 対応)。
+
+    /auth    … 認可エンドポイント。redirect_uri に code と state を付けてリダイレクトします。
+    /token   … トークンエンドポイント。RS256 で署名した ID トークンを返します。
+    /certs   … JWKS 形式の署名証明書。Cache-Control: max-age 付き。rotate_keys() で鍵を入れ替えられます。
+
+接続数・リクエスト数を数えるため、Keep-Alive による接続再利用の効果を確認できます。
+"""
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+class StubGoogleServer:
+    def __init__(self, host="127.0.0.1", port=0, client_id="stub-client-id", email="user@example.com",
+                 certs_max_age=3600, token_delay_seconds=0.0):
+        self.client_id = client_id
+        self.email = email
+        self.certs_max_age = certs_max_age
+        self.token_delay_seconds = token_delay_seconds
+        self.connections = 0
+        self.requests = {"auth": 0, "token": 0, "certs": 0}
+        self._lock = threading.Lock()
+        self._keys = [] # [(kid, private_key)] 先頭が署名に使う鍵
+        self.rotate_keys()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/auth":
+                    stub._count("auth")
+                    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                    location = f"{query['redirect_uri']}?{urlencode({'code': secrets.token_urlsafe(16), 'state': query.get('state', '')})}"
+                    self._send(302, headers={"Location": location})
+                elif parts.path == "/certs":
+                    stub._count("certs")
+                    body = json.dumps(stub.jwks()).encode()
+                    self._send(200, body, {"Content-Type": "application/json",
+                                           "Cache-Control": f"public, max-age={stub.certs_max_age}"})
+                else:
+                    self._send(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", "0"))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                if urlsplit(self.path).path != "/token":
+                    self._send(404)
+                    return
+                stub._count("token")
+                if stub.token_delay_seconds:
+                    time.sleep(stub.token_delay_seconds)
+                if form.get("grant_type") != "authorization_code" or not form.get("code"):
+                    self._send(400, b'{"error": "invalid_grant"}', {"Content-Type": "application/json"})
+                    return
+                body = json.dumps({
+                    "access_token": secrets.token_urlsafe(24),
+                    "expires_in": 3599,
+                    "token_type": "Bearer",
+                    "scope": "openid email profile",
+                    "id_token": stub.issue_id_token(),
+                }).encode()
+                self._send(200, body, {"Content-Type": "application/json"})
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256 # 多数の同時接続 (bench_asgi.py) でも接続を拒否しない
+
+        self.httpd = Server((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def _count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+    def rotate_keys(self, keep_previous=True):
+        """新しい署名鍵を先頭に追加します (keep_previous=False なら古い鍵は公開しない)。"""
+        kid = secrets.token_hex(8)
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        with self._lock:
+            self._keys = [(kid, key)] + (self._keys[:1] if keep_previous else [])
+        return kid
+
+    def jwks(self):
+        keys = []
+        for kid, key in self._keys:
+            jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+            jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
+
+    def issue_id_token(self, email=None, audience=None, lifetime=3600):
+        kid, key = self._keys[0]
+        now = int(time.time())
+        email = email or self.email
+        claims = {
+            "iss": "https://accounts.google.com",
+            "aud": audience or self.client_id,
+            "sub": str(abs(hash(email))),
+            "email": email,
+            "email_verified": True,
+            "name": email.split("@")[0],
+            "iat": now,
+            "exp": now + lifetime,
+        }
+        return jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid})
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-google", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
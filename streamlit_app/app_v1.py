@@ -1,27 +1,69 @@
 # app.py (修正案)
 import streamlit as st
-import jwt
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
+import json
+import logging
 import os
+import time
+import urllib.parse
+import urllib.request
+import jwt_verifier
+import session_store
+
+logger = logging.getLogger(__name__)
 
 # --- 定数 ---
 USER_INFO_KEY = "user_info"
+AUTH_TOKEN_KEY = "auth_token" # 検証済みの生トークン (ログアウト時の失効に使用)
+REFRESH_TOKEN_KEY = "refresh_token" # 期限前にアクセストークンを更新するためのリフレッシュトークン
 AUTH_ERROR_KEY = "auth_error_message"
+VERIFIED_TOKEN_CACHE_SIZE = 4096 # プロセス全体で共有する検証済みトークンの LRU の上限
+REFRESH_AHEAD_SECONDS = 300 # アクセストークンの期限がこの秒数以内になったら、次の再実行時に更新する
+SESSION_ID_KEY = "session_id" # サーバー側セッション (session_store) のID
+SESSION_COOKIE_PENDING_KEY = "session_cookie_pending" # 次の描画でブラウザに書き込む Set-Cookie 相当の文字列
+SESSION_COOKIE_NAME = "streamlit_auth_session"
+
+# 検証失敗の理由ごとの表示メッセージ
+AUTH_FAILURE_MESSAGES = {
+    jwt_verifier.REASON_CONFIG_INCOMPLETE: "アプリケーションの設定が不完全です（キー、発行者、または対象者）。",
+    jwt_verifier.REASON_EXPIRED: "認証トークンの有効期限が切れています。再度ログインしてください。",
+    jwt_verifier.REASON_INVALID_AUDIENCE: "認証トークンの対象者がこのアプリケーションと一致しません。",
+    jwt_verifier.REASON_INVALID_ISSUER: "認証トークンの発行者が不正です。",
+    jwt_verifier.REASON_INVALID_SIGNATURE: "認証トークンの署名が不正です。",
+    jwt_verifier.REASON_KEY_UNAVAILABLE: "認証トークンの検証鍵を取得できませんでした。しばらくしてから再度お試しください。",
+    jwt_verifier.REASON_MALFORMED: "認証トークンの形式が不正です。",
+    jwt_verifier.REASON_REVOKED: "認証トークンは無効化されています。再度ログインしてください。",
+}
 
 # --- 設定値の読み込み ---
 # グローバル変数として定義し、try-except内で値を設定
 JWT_SECRET_KEY = None
+JWT_JWKS_URL = None # 認証サーバーの /.well-known/jwks.json (非対称鍵で署名する場合)
 AUTH_LOGIN_URL = None
+AUTH_REVOKE_URL = None # 認証サーバーの /auth/revoke (ログアウト時にトークンを失効させる)
+AUTH_REFRESH_URL = None # 認証サーバーの /auth/refresh (Google を経由せずにアクセストークンを更新する)
+REVOCATION_FILE = None # 認証サーバーと共有する失効リストファイル (同一ホスト・共有ディスクの場合)
 EXPECTED_ISSUER = None
 EXPECTED_AUDIENCE = None
+SESSION_STORE_PATH = None # 指定時は SQLite ファイルにセッションを保存 (複数プロセスで共有)
+SESSION_TTL_SECONDS = 7 * 24 * 3600 # 認証サーバーのリフレッシュトークンの既定の有効期限と同じ
+SESSION_MAX_COUNT = 10000
 
 try:
-    JWT_SECRET_KEY = st.secrets["JWT_SECRET_KEY"]
+    # 認証サーバーが非対称鍵 (RS256/ES256/EdDSA) で署名する場合は JWT_JWKS_URL を設定すれば共有シークレットは不要
+    JWT_JWKS_URL = st.secrets.get("JWT_JWKS_URL")
+    JWT_SECRET_KEY = st.secrets.get("JWT_SECRET_KEY") if JWT_JWKS_URL else st.secrets["JWT_SECRET_KEY"]
     AUTH_LOGIN_URL = st.secrets["AUTH_LOGIN_URL"]
+    AUTH_REVOKE_URL = st.secrets.get("AUTH_REVOKE_URL")
+    AUTH_REFRESH_URL = st.secrets.get("AUTH_REFRESH_URL")
+    REVOCATION_FILE = st.secrets.get("REVOCATION_FILE", os.environ.get("REVOCATION_FILE"))
     # secrets.toml に以下のキー名で定義されていることを期待
     # もしキー名が異なる場合は、app.py側かtoml側のどちらかを合わせる
     EXPECTED_ISSUER = st.secrets.get("FUNCTION_BASE_URL", os.environ.get("JWT_EXPECTED_ISSUER"))
     EXPECTED_AUDIENCE = st.secrets.get("STREAMLIT_APP_URL", os.environ.get("JWT_EXPECTED_AUDIENCE"))
+    SESSION_STORE_PATH = st.secrets.get("SESSION_STORE_PATH", os.environ.get("SESSION_STORE_PATH"))
+    SESSION_TTL_SECONDS = float(st.secrets.get("SESSION_TTL_SECONDS", SESSION_TTL_SECONDS))
+    SESSION_MAX_COUNT = int(st.secrets.get("SESSION_MAX_COUNT", SESSION_MAX_COUNT))
 
 except (FileNotFoundError, KeyError) as e:
     st.error(f"secrets.toml の読み込みまたは必須キーの取得に失敗しました: {e}。\n"
@@ -33,28 +75,211 @@ except (FileNotFoundError, KeyError) as e:
 
 
 # --- ヘルパー関数 ---
+@st.cache_resource
+def get_token_verifier():
+    """
+    鍵・検証オプションと検証済みトークンのキャッシュを、プロセスで1つだけ作成する。
+    Streamlit の再実行 (rerun) やセッションをまたいで共有される。
+    """
+    settings = jwt_verifier.VerifierSettings(
+        audience=EXPECTED_AUDIENCE,
+        issuer=EXPECTED_ISSUER,
+        secret_key=JWT_SECRET_KEY,
+        jwks_url=JWT_JWKS_URL, # 指定時は公開鍵 (RS256/ES256/EdDSA) で検証
+        leeway_seconds=30,
+    )
+    revocations = jwt_verifier.RevocationFileFollower(REVOCATION_FILE) if REVOCATION_FILE else None
+    return jwt_verifier.TokenVerifier(settings, cache_size=VERIFIED_TOKEN_CACHE_SIZE, is_revoked=revocations)
+
+@st.cache_resource
+def get_session_store():
+    """
+    サーバー側のセッションストアを、プロセスで1つだけ作成する (全セッション・タブで共有)。
+    SESSION_STORE_PATH を指定した場合は SQLite ファイルに保存し、同じファイルを使う別のプロセスとも共有する。
+    """
+    if SESSION_STORE_PATH:
+        return session_store.SQLiteSessionStore(SESSION_STORE_PATH, max_sessions=SESSION_MAX_COUNT,
+                                                ttl_seconds=SESSION_TTL_SECONDS)
+    return session_store.MemorySessionStore(max_sessions=SESSION_MAX_COUNT, ttl_seconds=SESSION_TTL_SECONDS)
+
 def verify_jwt_token(token_string):
-    """JWTトークンを検証し、デコードされたペイロードを返す"""
-    if not all([JWT_SECRET_KEY, EXPECTED_AUDIENCE, EXPECTED_ISSUER]):
-        st.session_state[AUTH_ERROR_KEY] = "アプリケーションの設定が不完全です（キー、発行者、または対象者）。"
-        return None
+    """
+    JWTトークンを検証し、jwt_verifier.VerificationResult を返す。
+    失敗した場合は理由に応じたメッセージを AUTH_ERROR_KEY にセットする。
+    """
+    result = get_token_verifier().verify(token_string)
+    if not result.ok:
+        st.session_state[AUTH_ERROR_KEY] = AUTH_FAILURE_MESSAGES.get(
+            result.reason, f"認証トークンの検証に失敗しました ({result.reason})。"
+        )
+    return result
+
+def post_to_auth_server(url, params, timeout=5):
+    """認証サーバーにフォームを POST し、JSON レスポンス (本文が空なら None) を返す"""
+    data = urllib.parse.urlencode(params).encode("utf-8")
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method="POST"), timeout=timeout) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+def refresh_session():
+    """
+    リフレッシュトークンで新しいアクセストークンを取得し、セッションを更新する。
+    成功した場合は True を返す (失敗時はリフレッシュトークンを破棄する)。
+    """
+    if adopt_newer_server_session():
+        return True
+    refresh_token = st.session_state.get(REFRESH_TOKEN_KEY)
+    if not (AUTH_REFRESH_URL and refresh_token):
+        return False
     try:
-        payload = jwt.decode(
-            token_string,
-            JWT_SECRET_KEY,
-            algorithms=["HS256"],
-            audience=EXPECTED_AUDIENCE,
-            issuer=EXPECTED_ISSUER,
-            leeway=timedelta(seconds=30)
+        tokens = post_to_auth_server(
+            AUTH_REFRESH_URL, {"grant_type": "refresh_token", "refresh_token": refresh_token}
         )
-        return payload
-    except:
-        pass
+    except Exception as e:
+        logger.warning("アクセストークンの更新に失敗しました: %s", e)
+        # 使用済みかどうか分からないため再利用はしない (再利用すると全セッションが無効化される)
+        del st.session_state[REFRESH_TOKEN_KEY]
+        save_server_session()
+        return False
+    st.session_state[REFRESH_TOKEN_KEY] = tokens["refresh_token"]
+    verification = verify_jwt_token(tokens["access_token"])
+    if verification.ok:
+        st.session_state[USER_INFO_KEY] = verification.payload
+        st.session_state[AUTH_TOKEN_KEY] = tokens["access_token"]
+    save_server_session()
+    return verification.ok
+
+def exchange_login_code(login_code):
+    """
+    ログイン直後の URL の使い捨てのログインコードを、バックエンドからリフレッシュトークンと交換する。
+    (長期間有効なリフレッシュトークンは URL に載せない)。成功した場合はトークンの dict、失敗時は None を返す。
+    """
+    if not AUTH_REFRESH_URL:
+        return None
+    try:
+        return post_to_auth_server(AUTH_REFRESH_URL, {"grant_type": "authorization_code", "code": login_code})
+    except Exception as e:
+        logger.warning("ログインコードの交換に失敗しました: %s", e)
         return None
 
+def revoke_token(token_string):
+    """認証サーバーにトークンの失効を依頼する (失敗してもログアウト自体は続行する)"""
+    verifier = get_token_verifier()
+    verifier.invalidate(token_string) # このプロセスの検証済みキャッシュからも削除
+    payload = st.session_state.get(USER_INFO_KEY) or {}
+    if isinstance(verifier.is_revoked, jwt_verifier.RevocationFileFollower) and payload.get("jti"):
+        verifier.is_revoked.add(payload["jti"], payload.get("exp", 0))
+    if not AUTH_REVOKE_URL:
+        return
+    try:
+        post_to_auth_server(AUTH_REVOKE_URL, {"token": token_string})
+        if st.session_state.get(REFRESH_TOKEN_KEY):
+            post_to_auth_server(AUTH_REVOKE_URL, {"token": st.session_state[REFRESH_TOKEN_KEY],
+                                                  "token_type_hint": "refresh_token"})
+    except Exception as e:
+        logger.warning("トークンの失効に失敗しました: %s", e)
+
+# --- サーバー側セッション (Cookie) ---
+SESSION_FIELDS = (USER_INFO_KEY, AUTH_TOKEN_KEY, REFRESH_TOKEN_KEY)
+
+def get_session_cookie():
+    """Cookie のセッションIDを返す (st.context.cookies は Streamlit 1.37 以降。未対応なら None)"""
+    cookies = getattr(getattr(st, "context", None), "cookies", None)
+    return cookies.get(SESSION_COOKIE_NAME) if cookies is not None else None
+
+def schedule_session_cookie(session_id, max_age):
+    """次の描画でブラウザにセッションの Cookie を書き込む (session_id が None なら削除)"""
+    attributes = f"Path=/; Max-Age={int(max_age)}; SameSite=Lax"
+    if (EXPECTED_AUDIENCE or "").startswith("https://"):
+        attributes += "; Secure"
+    st.session_state[SESSION_COOKIE_PENDING_KEY] = f"{SESSION_COOKIE_NAME}={session_id or ''}; {attributes}"
+
+def write_pending_session_cookie():
+    """
+    予約された Cookie をブラウザに書き込む。
+    st.context.cookies は読み取り専用のため、コンポーネントの JavaScript から親ページに書き込む (HttpOnly にはできない)。
+    """
+    cookie = st.session_state.pop(SESSION_COOKIE_PENDING_KEY, None)
+    if cookie:
+        script = f"<script>window.parent.document.cookie = {json.dumps(cookie)};</script>"
+        if hasattr(st, "iframe"): # components.v1.html の後継 (新しいバージョン)
+            st.iframe(script, height=1) # 0 は指定できない
+        else:
+            import streamlit.components.v1 as components
+            components.html(script, height=0)
+
+def load_session_data(data):
+    for key in SESSION_FIELDS:
+        if key in data:
+            st.session_state[key] = data[key]
+        else:
+            st.session_state.pop(key, None)
+
+def start_server_session():
+    """ログイン直後にサーバー側セッションを作成し、Cookie に設定する (同じブラウザの以前のセッションは破棄)"""
+    if getattr(getattr(st, "context", None), "cookies", None) is None:
+        return # Cookie を読めないバージョンでは作成しても復元できない
+    store = get_session_store()
+    previous = get_session_cookie()
+    if previous:
+        store.delete(previous)
+    session_id = store.create({key: st.session_state[key] for key in SESSION_FIELDS if key in st.session_state})
+    st.session_state[SESSION_ID_KEY] = session_id
+    schedule_session_cookie(session_id, SESSION_TTL_SECONDS)
+
+def restore_server_session():
+    """
+    Cookie のセッションIDからログイン状態を復元する (再読み込み・新しいタブ)。
+    ストアの参照と失効リストの確認のみで、認証サーバーへの問い合わせやトークンの署名検証は行わない。
+    """
+    session_id = get_session_cookie()
+    if not session_id:
+        return False
+    store = get_session_store()
+    data = store.get(session_id)
+    user_info = (data or {}).get(USER_INFO_KEY)
+    is_revoked = get_token_verifier().is_revoked
+    if not user_info or (is_revoked is not None and user_info.get("jti") and is_revoked(user_info["jti"])):
+        store.delete(session_id)
+        schedule_session_cookie(None, 0)
+        return False
+    load_session_data(data)
+    st.session_state[SESSION_ID_KEY] = session_id
+    return True
+
+def save_server_session():
+    """更新したトークンをサーバー側セッションに反映する (他のタブ・再読み込みでも新しいトークンを使うため)"""
+    session_id = st.session_state.get(SESSION_ID_KEY)
+    data = {key: st.session_state[key] for key in SESSION_FIELDS if key in st.session_state}
+    if session_id and not get_session_store().update(session_id, data):
+        del st.session_state[SESSION_ID_KEY]
+
+def adopt_newer_server_session():
+    """
+    同じサーバー側セッションの別のタブが先にトークンを更新していれば、それを使う。
+    リフレッシュトークンは使い捨てで、使用済みのものを使うとログインごと無効になるため、更新の前に確認する。
+    採用したアクセストークンの期限に余裕がある場合は True を返す。
+    """
+    session_id = st.session_state.get(SESSION_ID_KEY)
+    data = get_session_store().get(session_id) if session_id else None
+    exp = (data or {}).get(USER_INFO_KEY, {}).get("exp", 0)
+    if exp <= st.session_state[USER_INFO_KEY].get("exp", 0):
+        return False
+    load_session_data(data)
+    return exp - time.time() >= REFRESH_AHEAD_SECONDS
+
+def end_server_session():
+    session_id = st.session_state.pop(SESSION_ID_KEY, None)
+    if session_id:
+        get_session_store().delete(session_id)
+        schedule_session_cookie(None, 0)
+
 def logout():
     """ログアウト処理"""
-    keys_to_delete = [USER_INFO_KEY, AUTH_ERROR_KEY]
+    if st.session_state.get(AUTH_TOKEN_KEY):
+        revoke_token(st.session_state[AUTH_TOKEN_KEY])
+    end_server_session()
+    keys_to_delete = [USER_INFO_KEY, AUTH_TOKEN_KEY, REFRESH_TOKEN_KEY, AUTH_ERROR_KEY]
     for key in keys_to_delete:
         if key in st.session_state:
             del st.session_state[key]
@@ -85,6 +310,7 @@ st.set_page_config(page_title="Streamlit Google Auth Demo", layout="wide")
 st.title("🔒 Streamlit Google認証デモ (Firestoreなし版)")
 
 auth_token = get_query_param("auth_token")
+login_code = get_query_param("login_code")
 auth_error_from_url = get_query_param("auth_error")
 
 # URL経由のエラー処理
@@ -105,17 +331,27 @@ if auth_error_from_url and USER_INFO_KEY not in st.session_state:
         except AttributeError: pass
 
 
+# 再読み込み・新しいタブでは、Cookie のサーバー側セッションからログイン状態を復元する
+if USER_INFO_KEY not in st.session_state and not auth_token:
+    restore_server_session()
+
 # ログイン状態の処理
 if USER_INFO_KEY not in st.session_state:
     if auth_token:
         st.write("認証トークンを検証中...")
-        user_payload = verify_jwt_token(auth_token)
-        if user_payload:
-            st.session_state[USER_INFO_KEY] = user_payload
-            # 検証成功後、URLからauth_tokenを削除
+        verification = verify_jwt_token(auth_token)
+        if verification.ok:
+            st.session_state[USER_INFO_KEY] = verification.payload
+            st.session_state[AUTH_TOKEN_KEY] = auth_token
+            tokens = exchange_login_code(login_code) if login_code else None
+            if tokens:
+                st.session_state[REFRESH_TOKEN_KEY] = tokens["refresh_token"]
+            start_server_session()
+            # 検証成功後、URLからauth_token・login_codeを削除
             try:
                 current_params = st.query_params.to_dict()
-                if "auth_token" in current_params: del current_params["auth_token"]
+                for param in ("auth_token", "login_code"):
+                    if param in current_params: del current_params[param]
                 st.query_params.from_dict(current_params)
             except AttributeError:
                 try: st.experimental_set_query_params()
@@ -125,10 +361,28 @@ if USER_INFO_KEY not in st.session_state:
         # else: 検証失敗。エラーは verify_jwt_token 内で AUTH_ERROR_KEY にセット済。
         #      この後のifブロックでエラー表示とログインボタン表示。
     # else: トークンなし。ログインボタン表示へ。
-# else: ログイン済み。保護されたコンテンツ表示へ。
+else:
+    # ログイン済み。期限が近ければ Google を経由せずにアクセストークンを更新し、
+    # 更新できずに期限切れとなった場合はログイン画面に戻す
+    # サーバー側セッションが削除されていれば (別のタブでのログアウト・セッションの期限切れ)、このタブもログアウトする
+    session_id = st.session_state.get(SESSION_ID_KEY)
+    if session_id and get_session_store().get(session_id) is None:
+        for key in SESSION_FIELDS + (SESSION_ID_KEY,):
+            st.session_state.pop(key, None)
+        schedule_session_cookie(None, 0)
+    exp_timestamp = st.session_state.get(USER_INFO_KEY, {}).get("exp", 0)
+    if USER_INFO_KEY in st.session_state and exp_timestamp - time.time() < REFRESH_AHEAD_SECONDS \
+            and not refresh_session():
+        if time.time() >= exp_timestamp:
+            for key in SESSION_FIELDS:
+                st.session_state.pop(key, None)
+            end_server_session()
+            st.session_state.setdefault(AUTH_ERROR_KEY, AUTH_FAILURE_MESSAGES[jwt_verifier.REASON_EXPIRED])
 
 
 # --- 画面表示 ---
+write_pending_session_cookie()
+
 if USER_INFO_KEY in st.session_state:
     user_info = st.session_state[USER_INFO_KEY]
     st.sidebar.subheader("👤 ユーザー情報")
@@ -0,0 +1,260 @@
+# jwt_verifier.py
+"""
+Streamlit アプリ用のJWT検証モジュール (Streamlit には依存しません)。
+
+- VerifierSettings: 鍵・検証オプションをプロセスで1回だけ準備したもの (st.cache_resource で共有する想定)
+- TokenVerifier: 検証済みトークンの LRU キャッシュ付き検証器。
+  トークンのダイジェスト -> ペイロード を保持し、exp を過ぎたエントリは使いません。
+- 検証失敗時は None ではなく、理由 (reason) を持つ VerificationResult を返します。
+- RevocationFileFollower: 認証サーバーが書き出す失効リストファイル (JSON Lines) を差分で読み込み、
+  TokenVerifier の is_revoked として使います。
+"""
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+# 検証失敗の理由
+REASON_CONFIG_INCOMPLETE = "config_incomplete"
+REASON_EXPIRED = "expired"
+REASON_INVALID_AUDIENCE = "invalid_audience"
+REASON_INVALID_ISSUER = "invalid_issuer"
+REASON_INVALID_SIGNATURE = "invalid_signature"
+REASON_KEY_UNAVAILABLE = "key_unavailable"
+REASON_MALFORMED = "malformed"
+REASON_INVALID_TOKEN = "invalid_token"
+REASON_REVOKED = "revoked"
+
+ASYMMETRIC_ALGORITHMS = ["RS256", "ES256", "EdDSA"]
+
+class VerificationResult:
+    """検証結果。ok が True なら payload、False なら reason (と detail) を持ちます。"""
+
+    __slots__ = ("ok", "payload", "reason", "detail", "cached")
+
+    def __init__(self, ok, payload=None, reason=None, detail=None, cached=False):
+        self.ok = ok
+        self.payload = payload
+        self.reason = reason
+        self.detail = detail
+        self.cached = cached
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        if self.ok:
+            return f"VerificationResult(ok=True, sub={self.payload.get('sub')!r}, cached={self.cached})"
+        return f"VerificationResult(ok=False, reason={self.reason!r}, detail={self.detail!r})"
+
+class VerifierSettings:
+    """
+    検証に使う鍵とオプション。
+
+    jwks_url を指定した場合は非対称鍵 (RS256/ES256/EdDSA) で検証し、公開鍵は PyJWKClient がキャッシュします。
+    指定しない場合は secret_key による HS256 で検証します。
+    """
+
+    __slots__ = ("secret_key", "jwks_client", "audience", "issuer", "leeway_seconds", "algorithms")
+
+    def __init__(self, audience, issuer, secret_key=None, jwks_url=None, leeway_seconds=30):
+        self.secret_key = secret_key
+        self.jwks_client = jwt.PyJWKClient(jwks_url) if jwks_url else None
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway_seconds = leeway_seconds
+        self.algorithms = ASYMMETRIC_ALGORITHMS if jwks_url else ["HS256"]
+
+    def is_complete(self):
+        return bool((self.secret_key or self.jwks_client) and self.audience and self.issuer)
+
+    def key_for(self, token):
+        if self.jwks_client is not None:
+            return self.jwks_client.get_signing_key_from_jwt(token).key
+        return self.secret_key
+
+class TokenVerifier:
+    """検証済みトークンの LRU キャッシュ付き検証器 (スレッドセーフ)。"""
+
+    def __init__(self, settings, cache_size=1024, clock=time.time, is_revoked=None):
+        """
+        Args:
+            is_revoked (callable, optional): jti を受け取り、失効済みなら True を返す関数。
+                キャッシュヒット時も含め、毎回の検証で確認します。
+        """
+        self.settings = settings
+        self.is_revoked = is_revoked
+        self.cache_size = cache_size
+        self._clock = clock
+        self._cache = OrderedDict() # sha256(token) -> (payload, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token):
+        """トークンを検証し、VerificationResult を返します。"""
+        if not self.settings.is_complete():
+            return VerificationResult(False, reason=REASON_CONFIG_INCOMPLETE)
+        if not token:
+            return VerificationResult(False, reason=REASON_MALFORMED)
+
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        now = self._clock()
+        if self.cache_size > 0:
+            with self._lock:
+                entry = self._cache.get(digest)
+                if entry is not None:
+                    payload, expires_at = entry
+                    if now < expires_at:
+                        self._cache.move_to_end(digest)
+                        self.hits += 1
+                        return self._check_revocation(VerificationResult(True, payload=payload, cached=True))
+                    del self._cache[digest]
+                self.misses += 1
+
+        result = self._decode(token)
+        if result.ok and self.cache_size > 0 and "exp" in result.payload:
+            with self._lock:
+                self._cache[digest] = (result.payload, float(result.payload["exp"]))
+                self._cache.move_to_end(digest)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return self._check_revocation(result)
+
+    def _check_revocation(self, result):
+        if result.ok and self.is_revoked is not None:
+            jti = result.payload.get("jti")
+            if jti and self.is_revoked(jti):
+                return VerificationResult(False, reason=REASON_REVOKED)
+        return result
+
+    def _decode(self, token):
+        settings = self.settings
+        try:
+            payload = jwt.decode(
+                token,
+                settings.key_for(token),
+                algorithms=settings.algorithms,
+                audience=settings.audience,
+                issuer=settings.issuer,
+                leeway=settings.leeway_seconds,
+            )
+            return VerificationResult(True, payload=payload)
+        except jwt.ExpiredSignatureError as e:
+            return VerificationResult(False, reason=REASON_EXPIRED, detail=str(e))
+        except jwt.InvalidAudienceError as e:
+            return VerificationResult(False, reason=REASON_INVALID_AUDIENCE, detail=str(e))
+        except jwt.InvalidIssuerError as e:
+            return VerificationResult(False, reason=REASON_INVALID_ISSUER, detail=str(e))
+        except jwt.InvalidSignatureError as e:
+            return VerificationResult(False, reason=REASON_INVALID_SIGNATURE, detail=str(e))
+        except jwt.PyJWKClientError as e:
+            return VerificationResult(False, reason=REASON_KEY_UNAVAILABLE, detail=str(e))
+        except jwt.DecodeError as e:
+            return VerificationResult(False, reason=REASON_MALFORMED, detail=str(e))
+        except jwt.InvalidTokenError as e:
+            return VerificationResult(False, reason=REASON_INVALID_TOKEN, detail=str(e))
+
+    def invalidate(self, token=None):
+        """キャッシュを破棄します (token 省略時は全件)。"""
+        with self._lock:
+            if token is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(hashlib.sha256(token.encode("utf-8")).digest(), None)
+
+    def __len__(self):
+        return len(self._cache)
+
+class RevocationFileFollower:
+    """
+    認証サーバーの失効リストファイル (REVOCATION_FILE、1行に {"jti", "exp"}) を追従する失効判定。
+
+    ファイルは最大 refresh_interval_seconds ごとに前回の続きから追記分だけ読み込み、既存のエントリにマージします。
+    ファイルが作り直された (compact) 場合も先頭から読み直してマージするため、add で追加したエントリは残ります。
+    exp を過ぎたエントリは期限のヒープから古い順に捨てます (全件の作り直しはしません)。
+    判定自体は辞書の参照のみで、他のスレッドが読み込み中の場合は待たずに現在の内容で判定します。
+    """
+
+    def __init__(self, path, refresh_interval_seconds=2.0, clock=time.time):
+        self.path = path
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._clock = clock
+        self._entries = {} # jti -> exp
+        self._expiry_heap = [] # (exp, jti)
+        self._cursor = None # (inode, バイトオフセット)
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, jti):
+        return self.is_revoked(jti)
+
+    def is_revoked(self, jti):
+        now = self._clock()
+        if now >= self._next_refresh:
+            self.refresh()
+        exp = self._entries.get(jti)
+        return exp is not None and exp > now
+
+    def add(self, jti, exp):
+        """ファイルへの反映を待たずに、このプロセスで jti を失効扱いにします (ログアウト時など)。"""
+        with self._lock:
+            self._add_locked(jti, float(exp))
+
+    def _add_locked(self, jti, exp):
+        if self._entries.get(jti, 0.0) < exp:
+            self._entries[jti] = exp
+            heapq.heappush(self._expiry_heap, (exp, jti))
+
+    def refresh(self):
+        """ファイルに追記された差分を取り込み、期限切れのエントリを捨てます。"""
+        if not self._lock.acquire(blocking=False):
+            return # 他のスレッドが読み込み中
+        try:
+            now = self._clock()
+            if now < self._next_refresh:
+                return
+            self._next_refresh = now + self.refresh_interval_seconds
+            self._read_appended(now)
+            heap, entries = self._expiry_heap, self._entries
+            while heap and heap[0][0] <= now:
+                exp, jti = heapq.heappop(heap)
+                if entries.get(jti) == exp:
+                    del entries[jti]
+        finally:
+            self._lock.release()
+
+    def _read_appended(self, now):
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                cursor = self._cursor
+                offset = cursor[1] if cursor and cursor[0] == stat.st_ino and cursor[1] <= stat.st_size else 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning("失効リストファイルの読み込みに失敗しました: %s", e)
+            return
+        complete = data[:data.rfind(b"\n") + 1] # 書き込み途中の最終行は次回に読む
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+                jti, exp = record["jti"], float(record["exp"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if exp > now:
+                self._add_locked(jti, exp)
+        self._cursor = (stat.st_ino, offset + len(complete))
+
+    def __len__(self):
+        return len(self._entries)
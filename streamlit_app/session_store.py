@@ -0,0 +1,157 @@
+# session_store.py
+"""
+Streamlit アプリのサーバー側セッションストア (Streamlit には依存しません)。
+
+ブラウザには推測できないセッションID (Cookie) だけを渡し、ユーザー情報とトークンはサーバー側に保持します。
+再読み込みや新しいタブ (Streamlit のセッションが新しくなる場合) でも Cookie からセッションを引けるため、
+認証サーバーでのログインをやり直す必要がありません。
+
+- MemorySessionStore: プロセス内の辞書 (上限件数・有効期限付き)。st.cache_resource で全セッションから共有する想定
+- SQLiteSessionStore: SQLite ファイルによるストア (複数プロセスで Streamlit を動かす場合)
+- ストアにはセッションIDそのものではなく SHA-256 を保存します (ストアが漏れても Cookie を復元できない)。
+- 有効期限は作成時から ttl_seconds の固定です (参照のたびには延長しません)。
+  そのため作成順 = 期限順となり、期限切れ・上限超過の追い出しは古いものから O(1) で行えます。
+- 保存する値 (data) は JSON に変換できる辞書です。
+"""
+import hashlib
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_ID_BYTES = 32
+
+def new_session_id():
+    return secrets.token_urlsafe(SESSION_ID_BYTES)
+
+def hash_session_id(session_id):
+    return hashlib.sha256(session_id.encode("utf-8")).digest()
+
+class MemorySessionStore:
+    """プロセス内だけで保持するストア (スレッドセーフ)。"""
+
+    def __init__(self, max_sessions=10000, ttl_seconds=7 * 24 * 3600, clock=time.time):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._sessions = OrderedDict() # sha256(session_id) -> (data, expires_at)。作成順 (= 期限順)
+        self._lock = threading.Lock()
+
+    def create(self, data):
+        """セッションを作成し、Cookie に設定するセッションIDを返します。"""
+        session_id = new_session_id()
+        now = self._clock()
+        with self._lock:
+            self._sessions[hash_session_id(session_id)] = (dict(data), now + self.ttl_seconds)
+            self._evict(now)
+        return session_id
+
+    def get(self, session_id):
+        """セッションの data (のコピー) を返します。存在しない・期限切れの場合は None。"""
+        if not session_id:
+            return None
+        entry = self._sessions.get(hash_session_id(session_id))
+        if entry is None or entry[1] <= self._clock():
+            return None
+        return dict(entry[0])
+
+    def update(self, session_id, data):
+        """data を置き換えます (有効期限は変わりません)。セッションが無効なら False を返します。"""
+        key = hash_session_id(session_id)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[1] <= self._clock():
+                return False
+            self._sessions[key] = (dict(data), entry[1]) # 既存キーへの代入は順序を変えない
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(hash_session_id(session_id), None)
+
+    def _evict(self, now):
+        sessions = self._sessions
+        while sessions:
+            key, (_, expires_at) = next(iter(sessions.items()))
+            if expires_at > now and len(sessions) <= self.max_sessions:
+                break
+            del sessions[key]
+
+    def __len__(self):
+        return len(self._sessions)
+
+class SQLiteSessionStore:
+    """
+    SQLite ファイルによるストア。同じファイルを共有するプロセス間 (ローカル・単一VM) で使えます。
+
+    期限切れ・上限超過の削除は作成時に最大 prune_interval_seconds ごとにまとめて行うため、
+    件数は一時的に max_sessions を超えることがあります。
+    """
+
+    def __init__(self, path, max_sessions=10000, ttl_seconds=7 * 24 * 3600, clock=time.time,
+                 prune_interval_seconds=60):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.prune_interval_seconds = prune_interval_seconds
+        self._clock = clock
+        self._next_prune = 0.0
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_hash BLOB PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def create(self, data):
+        session_id = new_session_id()
+        now = self._clock()
+        with self._lock:
+            self._conn.execute("INSERT INTO sessions VALUES (?, ?, ?)",
+                               (hash_session_id(session_id), json.dumps(data), now + self.ttl_seconds))
+        if now >= self._next_prune:
+            self.prune(now)
+        return session_id
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_hash = ? AND expires_at > ?",
+                (hash_session_id(session_id), self._clock()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, session_id, data):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE sessions SET data = ? WHERE session_hash = ? AND expires_at > ?",
+                (json.dumps(data), hash_session_id(session_id), self._clock()),
+            )
+        return cursor.rowcount == 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_hash = ?", (hash_session_id(session_id),))
+
+    def prune(self, now=None):
+        """期限切れのセッションと、max_sessions を超えた分 (古い順) を削除します。"""
+        now = self._clock() if now is None else now
+        self._next_prune = now + self.prune_interval_seconds
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_hash IN (SELECT session_hash FROM sessions"
+                " ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_sessions,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
@@ -0,0 +1,6 @@
+# streamlit_app/tests/conftest.py
+"""Streamlit アプリのテスト。Streamlit に依存しないモジュール (jwt_verifier, session_store) を対象にします。"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
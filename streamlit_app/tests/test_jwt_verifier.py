@@ -0,0 +1,75 @@
+# streamlit_app/tests/test_jwt_verifier.py
+import json
+import os
+
+import jwt_verifier
+
+NOW = 1_000_000.0
+
+class FakeClock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def append(path, jti, exp):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"jti": jti, "exp": exp}) + "\n")
+
+def recreate(path, entries):
+    """認証サーバーの compact と同じく、別ファイルに書いてから置き換えます。"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for jti, exp in entries:
+            f.write(json.dumps({"jti": jti, "exp": exp}) + "\n")
+    os.replace(tmp_path, path)
+
+def test_follower_reads_appended_lines_incrementally(tmp_path):
+    path = str(tmp_path / "revoked.jsonl")
+    clock = FakeClock()
+    follower = jwt_verifier.RevocationFileFollower(path, refresh_interval_seconds=2, clock=clock)
+    assert not follower.is_revoked("a") # ファイルがなくてもよい
+    append(path, "a", NOW + 60)
+    assert not follower.is_revoked("a") # 次の読み込みまでは反映されない
+    clock.now += 2
+    assert follower.is_revoked("a")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"jti": "partial"') # 書き込み途中の行
+    clock.now += 2
+    assert not follower.is_revoked("partial")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(', "exp": %s}\n' % (NOW + 60))
+    clock.now += 2
+    assert follower.is_revoked("partial") and follower.is_revoked("a")
+
+def test_follower_keeps_local_entries_when_file_is_recreated(tmp_path):
+    path = str(tmp_path / "revoked.jsonl")
+    clock = FakeClock()
+    follower = jwt_verifier.RevocationFileFollower(path, refresh_interval_seconds=2, clock=clock)
+    append(path, "from_file", NOW + 60)
+    append(path, "expired", NOW - 1)
+    follower.refresh()
+    follower.add("local", NOW + 60) # ログアウト時など、ファイルへの反映前
+    recreate(path, [("from_file", NOW + 60), ("new", NOW + 60)])
+    clock.now += 2
+    assert follower.is_revoked("local")
+    assert follower.is_revoked("from_file") and follower.is_revoked("new")
+    assert not follower.is_revoked("expired")
+
+def test_follower_drops_expired_entries(tmp_path):
+    path = str(tmp_path / "revoked.jsonl")
+    clock = FakeClock()
+    follower = jwt_verifier.RevocationFileFollower(path, refresh_interval_seconds=2, clock=clock)
+    append(path, "short", NOW + 5)
+    append(path, "long", NOW + 60)
+    follower.refresh()
+    follower.add("long", NOW + 120) # 期限の延長
+    assert len(follower) == 2
+    clock.now += 10
+    assert not follower.is_revoked("short")
+    assert len(follower) == 1
+    clock.now += 60
+    assert follower.is_revoked("long") # 延長後の期限が使われる
+    clock.now += 60
+    assert not follower.is_revoked("long") and len(follower) == 0
@@ -0,0 +1,82 @@
+# streamlit_app/tests/test_session_store.py
+import pytest
+
+import session_store
+
+NOW = 1_000_000.0
+
+class FakeClock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path, clock):
+    def make(**kwargs):
+        kwargs.setdefault("ttl_seconds", 3600)
+        if request.param == "memory":
+            return session_store.MemorySessionStore(clock=clock, **kwargs)
+        return session_store.SQLiteSessionStore(str(tmp_path / "sessions.db"), clock=clock, **kwargs)
+    return make
+
+DATA = {"user_info": {"email": "alice@example.com"}, "auth_token": "token", "refresh_token": "refresh"}
+
+def test_create_get_update_delete(make_store):
+    store = make_store()
+    session_id = store.create(DATA)
+    assert store.get(session_id) == DATA
+    assert store.update(session_id, dict(DATA, auth_token="newer"))
+    assert store.get(session_id)["auth_token"] == "newer"
+    store.delete(session_id)
+    assert store.get(session_id) is None
+    assert not store.update(session_id, DATA)
+
+def test_unknown_or_empty_session_id(make_store):
+    store = make_store()
+    store.create(DATA)
+    assert store.get("guessed-session-id") is None
+    assert store.get("") is None and store.get(None) is None
+
+def test_session_expires_after_ttl_without_sliding(make_store, clock):
+    store = make_store()
+    session_id = store.create(DATA)
+    clock.now += 3000
+    assert store.get(session_id) == DATA # 参照しても期限は延長しない
+    clock.now += 600
+    assert store.get(session_id) is None
+    assert not store.update(session_id, DATA)
+
+def test_session_ids_are_random_and_stored_hashed(make_store):
+    store = make_store()
+    session_ids = {store.create(DATA) for _ in range(20)}
+    assert len(session_ids) == 20
+    assert all(len(session_id) >= 43 for session_id in session_ids) # 32 バイト以上
+    if isinstance(store, session_store.MemorySessionStore):
+        stored_keys = set(store._sessions)
+    else:
+        stored_keys = {row[0] for row in store._conn.execute("SELECT session_hash FROM sessions")}
+    assert stored_keys == {session_store.hash_session_id(session_id) for session_id in session_ids}
+    assert not stored_keys & {session_id.encode() for session_id in session_ids}
+
+def test_returned_data_is_a_copy(make_store):
+    store = make_store()
+    session_id = store.create(DATA)
+    store.get(session_id)["auth_token"] = "tampered"
+    assert store.get(session_id)["auth_token"] == "token"
+
+def test_oldest_sessions_are_evicted_over_limit(make_store, clock):
+    store = make_store(max_sessions=3)
+    session_ids = []
+    for _ in range(5):
+        session_ids.append(store.create(DATA))
+        clock.now += 1
+    if isinstance(store, session_store.SQLiteSessionStore):
+        store.prune() # SQLite は prune_interval_seconds ごとにまとめて削除する
+    assert len(store) == 3
+    assert [store.get(session_id) is not None for session_id in session_ids] == [False, False, True, True, True]